@@ -1,23 +1,63 @@
-import os
-import random
-import time
-from openai import OpenAI
+import asyncio
+import json
+
+from colm_cache import RESPONSE_CACHE, make_key
+from colm_clients import ClientRegistry
+from colm_context import fit_responses
+from colm_convergence import ConvergenceTracker
+from colm_engine import load_config
+from colm_engine.prompts import refine_messages, selection_messages, summary_messages
+from colm_gateway import GATEWAY
+from colm_metrics import call_stage
+from colm_participation import participating_experts
+from colm_ratelimit import RATE_LIMITS, estimate_tokens
+from colm_router import get_router
+from colm_speculative import DEFAULT_THRESHOLDS, speculate
+
+# experts, providers and the summary prompt are shared with the generate scripts
+CONFIG = load_config()
+
+MODEL_PROMPTS = {name: spec["prompt"] for name, spec in CONFIG["experts"].items()}
+
+MODEL_SOURCES = {name: spec["source"] for name, spec in CONFIG["experts"].items()}
+
+MODEL_PROVIDERS = CONFIG["providers"]
+
+SUMMARY_PROMPT = CONFIG["summary"]["prompt"]
+
+
+def build_clients():
+    # async clients are bound to the running event loop, so each run gets its own
+    # registry; models served by the same endpoint still share one connection pool
+    return GATEWAY.clients(list(dict.fromkeys(["gpt-4o", *MODEL_SOURCES.values()])), asynchronous=True, registry=ClientRegistry())
+
+
+async def close_clients(clients):
+    unique = {id(client): client for client in clients.values()}
+    await asyncio.gather(*(client.close() for client in unique.values()))
 
 
 # -----------------------------
 # Call model
 # -----------------------------
-def call_model(model_source, messages, clients):
-    time.sleep(random.uniform(0.3, 0.8))  
-    try:
+async def call_model(model_source, messages, clients):
+    async def request():
         client = clients[model_source]
-        response = client.chat.completions.create(
-            model=model_source,
-            messages=messages,
-            max_tokens=1000,
-            stream=False
+        response = await RATE_LIMITS.acall(
+            MODEL_PROVIDERS.get(model_source, "openai"),
+            model_source,
+            lambda: client.chat.completions.create(
+                model=model_source,
+                messages=messages,
+                max_tokens=1000,
+                stream=False
+            ),
+            estimate_tokens(messages, 1000)
         )
         return response.choices[0].message.content.strip()
+
+    try:
+        return await RESPONSE_CACHE.acached(model_source, messages, {"max_tokens": 1000}, request)
     except Exception as e:
         print(f"Model call failed for {model_source}: {e}")
         return ""
@@ -26,17 +66,22 @@ def call_model(model_source, messages, clients):
 # -----------------------------
 # Step 1: Model Selection (optional)
 # -----------------------------
-def select_models(client, model_id, selection_prompt, question, specializations, top_k):
-    try:
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=[
-                {"role": "system", "content": selection_prompt},
-                {"role": "user", "content": f"Given the question: '{question}', select the {top_k} most relevant specializations from the following:\n\n" +
-                                            "\n".join(specializations.keys()) + "\n\nReturn only the names of the most relevant models, separated by commas."}
-            ]
+async def select_models(client, model_id, selection_prompt, question, specializations, top_k):
+    messages = selection_messages(selection_prompt, question, specializations, top_k)
+
+    async def request():
+        response = await RATE_LIMITS.acall(
+            MODEL_PROVIDERS.get(model_id, "openai"),
+            model_id,
+            lambda: client.chat.completions.create(model=model_id, messages=messages),
+            estimate_tokens(messages, 100)
         )
-        selected = response.choices[0].message.content.strip().split(", ")
+        return response.choices[0].message.content.strip()
+
+    try:
+        with call_stage("select"):
+            content = await RESPONSE_CACHE.acached(model_id, messages, {}, request)
+        selected = content.split(", ")
         print(f"\n>>> Selected Models: {selected}")
         return selected
     except Exception as e:
@@ -47,148 +92,441 @@ def select_models(client, model_id, selection_prompt, question, specializations,
 # -----------------------------
 # Step 2: Get initial responses
 # -----------------------------
-def get_model_responses(selected, model_prompts, model_sources, question, clients):
-    responses = {}
-    for model_name in selected:
+async def get_model_responses(selected, model_prompts, model_sources, question, clients):
+    async def respond(model_name):
         model_id = model_sources.get(model_name, "gpt-4o")
         prompt = model_prompts[model_name]
         messages = [
             {"role": "system", "content": prompt},
             {"role": "user", "content": question}
         ]
-        response = call_model(model_id, messages, clients)
-        responses[model_name] = response
+        response = await call_model(model_id, messages, clients)
         print(f"\n>>> {model_name} initial response: {response[:100]}...")
-    return responses
+        return response
+
+    # all experts are queried concurrently, so a round costs the slowest expert
+    with call_stage("answer"):
+        results = await asyncio.gather(*(respond(model_name) for model_name in selected))
+    return dict(zip(selected, results))
 
 
 # -----------------------------
 # Step 3: Summarize all responses
 # -----------------------------
-def summarize_all(client, model_id, responses, summary_prompt):
-    combined = "\n\n".join([f"{name}:\n{resp}" for name, resp in responses.items()])
-    messages = [
-        {"role": "system", "content": summary_prompt},
-        {"role": "user", "content": f"Here are multiple responses:\n\n{combined}"}
-    ]
-    response = client.chat.completions.create(
-        model=model_id,
-        messages=messages
-    )
-    return response.choices[0].message.content.strip()
+async def summarize_all(client, model_id, responses, summary_prompt):
+    # near-duplicate answers are merged and long ones trimmed to keep the prompt within budget
+    messages = summary_messages(summary_prompt, fit_responses(responses))
+
+    async def request():
+        response = await RATE_LIMITS.acall(
+            MODEL_PROVIDERS.get(model_id, "openai"),
+            model_id,
+            lambda: client.chat.completions.create(model=model_id, messages=messages),
+            estimate_tokens(messages, 1000)
+        )
+        return response.choices[0].message.content.strip()
+
+    with call_stage("summary"):
+        return await RESPONSE_CACHE.acached(model_id, messages, {}, request)
 
 
 # -----------------------------
 # Step 4: Refinement
 # -----------------------------
-def refine_responses(
+async def refine_responses(
     clients, selected_models, model_prompts, model_sources,
-    initial_responses, summary_prompt, question, iterations
+    initial_responses, summary_prompt, question, iterations,
+    tracker=None, participants=None
 ):
     current_responses = initial_responses.copy()
     for i in range(iterations):
+        if tracker is not None and tracker.done:
+            reason = "token budget spent" if tracker.budget_exhausted else "all experts converged"
+            print(f"\n=== Stopping after {i} iteration(s): {reason} ===")
+            break
         print(f"\n=== Iteration {i + 1}: Refinement ===")
 
-        summary = summarize_all(
+        summary = await summarize_all(
             client=clients["gpt-4o"],
             model_id="gpt-4o",
             responses=current_responses,
             summary_prompt=summary_prompt
         )
+        if tracker is not None:
+            tracker.charge([{"content": summary_prompt}] + [{"content": r} for r in current_responses.values()], summary)
 
-        updated_responses = {}
-        for model_name, prompt in model_prompts.items():
+        async def refine(model_name, prompt):
             model_id = model_sources.get(model_name, "gpt-4o")
-            messages = [
-                {"role": "system", "content": prompt},
-                {"role": "system", "content": (
-                    f"Here is a refined summary of previous answers:\n\n{summary}\n\n"
-                    f"{'Your perspective is relevant.' if model_name in selected_models else 'Your perspective is less relevant.'}\n"
-                    "Please revise your previous answer based on this summary and the question."
-                )},
-                {"role": "user", "content": question}
-            ]
-            response = call_model(model_id, messages, clients)
-            updated_responses[model_name] = response
+            messages = refine_messages(model_name, prompt, summary, selected_models, question)
+            response = await call_model(model_id, messages, clients)
+            if tracker is not None:
+                tracker.charge(messages, response)
             print(f"\n>>> {model_name} refined response (iteration {i + 1}): {response[:100]}...")
+            return response
+
+        # experts outside the participation policy or already converged are not re-queried
+        active = [
+            model_name for model_name in model_prompts
+            if (participants is None or model_name in participants)
+            and (tracker is None or model_name in tracker.active)
+        ]
+        with call_stage("refine"):
+            results = await asyncio.gather(
+                *(refine(model_name, model_prompts[model_name]) for model_name in active)
+            )
+        refined = dict(zip(active, results))
+        if tracker is not None:
+            converged = tracker.update(current_responses, refined, summary)
+            if converged:
+                print(f"\n>>> Converged after iteration {i + 1}: {converged}")
 
-        current_responses = updated_responses  # update for next round
+        # update for next round; experts that sat this round out keep their previous answer
+        current_responses = {
+            model_name: refined[model_name] if model_name in refined else current_responses[model_name]
+            for model_name in model_prompts
+            if model_name in refined or model_name in current_responses
+        }
 
     return current_responses
 
 
 # -----------------------------
-# Main 
+# Collaboration engine
 # -----------------------------
-def main(
+async def choose_models(clients, question, model_prompts, use_selection, selector, top_k):
+    if not use_selection:
+        return list(model_prompts.keys())
+    if selector == "local":
+        selected = get_router(model_prompts).route(question, top_k)
+        if selected is not None:
+            print(f"\n>>> Selected Models (local router): {selected}")
+            return selected
+    return await select_models(
+        client=clients["gpt-4o"],
+        model_id="gpt-4o",
+        selection_prompt=SUMMARY_PROMPT,
+        question=question,
+        specializations=model_prompts,
+        top_k=top_k
+    )
+
+
+async def run_colm(
     question,
     use_selection=True,
     iterations=2,
-    top_k=2
+    top_k=2,
+    selector="local",
+    adaptive=False,
+    convergence_threshold=0.9,
+    token_budget=None,
+    participation="all",
+    speculative=None,
+    confidence_threshold=None,
+    consistency_samples=3
 ):
-    model_prompts = {
-        "qwen-math": "You are a helpful math assistant.",
-        "gpt-conv": "You are a conversational assistant focused on natural, fluent communication.",
-        "qwen-coder": "You are a helpful code assistant.",
-        "ds-creative": "You are a creative assistant who writes imaginatively and artistically."
-    }
+    model_prompts = MODEL_PROMPTS
+    model_sources = MODEL_SOURCES
+    summary_prompt = SUMMARY_PROMPT
+    clients = build_clients()
+    path, confidence = "refined", None
+    final_responses = {}
 
-    model_sources = {
-        "qwen-math": "qwen-math-plus",
-        "gpt-conv": "gpt-4o",
-        "qwen-coder": "qwen-coder-plus",
-        "ds-creative": "deepseek-chat"
-    }
+    try:
+        selected = await choose_models(clients, question, model_prompts, use_selection, selector, top_k)
+        participants = participating_experts(participation, selected, model_prompts, model_sources)
+        tracker = ConvergenceTracker(participants, convergence_threshold, token_budget) if adaptive else None
 
-    summary_prompt = (
-        "Please summarize the following answers by:\n"
-        "- Removing redundancy\n"
-        "- Keeping important insights\n"
-        "- Improving clarity and coherence\n"
-        "- Returning a concise but complete synthesis"
-    )
+        known = {}
+        if speculative and selected:
+            # the top expert answers alone; the server loop only runs if its answer looks unreliable
+            lead = selected[0]
+            model_id = model_sources.get(lead, "gpt-4o")
+            messages = [
+                {"role": "system", "content": model_prompts[lead]},
+                {"role": "user", "content": question}
+            ]
+            answer, confidence = await speculate(
+                clients[model_id], model_id, MODEL_PROVIDERS.get(model_id, "openai"), messages, question,
+                speculative, consistency_samples
+            )
+            threshold = DEFAULT_THRESHOLDS[speculative] if confidence_threshold is None else confidence_threshold
+            print(f"\n>>> {lead} speculative answer (confidence {confidence:.3f}, threshold {threshold}): {answer[:100]}...")
+            if answer and confidence >= threshold:
+                path = "client"
+                final_responses = {lead: answer}
+            else:
+                known[lead] = answer
 
-    clients = {
-        "gpt-4o": OpenAI(api_key=os.environ["OPENAI_API_KEY"]),
-        "deepseek-chat": OpenAI(api_key=os.environ["DEEPSEEK_API_KEY"]),
-        "qwen-math-plus": OpenAI(api_key=os.environ["QWEN_API_KEY"]),
-        "qwen-coder-plus": OpenAI(api_key=os.environ["QWEN_API_KEY"])
+        if path == "refined":
+            initial_responses = await get_model_responses(
+                selected=[name for name in selected if not known.get(name)],
+                model_prompts=model_prompts,
+                model_sources=model_sources,
+                question=question,
+                clients=clients
+            )
+            initial_responses = {name: known.get(name) or initial_responses[name] for name in selected}
+
+            final_responses = await refine_responses(
+                clients=clients,
+                selected_models=selected,
+                model_prompts=model_prompts,
+                model_sources=model_sources,
+                initial_responses=initial_responses,
+                summary_prompt=summary_prompt,
+                question=question,
+                iterations=iterations,
+                tracker=tracker,
+                participants=participants
+            )
+    finally:
+        await close_clients(clients)
+
+    metadata = {
+        "use_selection": use_selection,
+        "selector": selector,
+        "top_k": top_k,
+        "selected": selected,
+        "iterations": iterations,
+        "participation": participation,
+        "participants": participants,
+        "adaptive": adaptive,
+        "speculative": speculative,
+        "path": path,
     }
+    if confidence is not None:
+        metadata["confidence"] = round(confidence, 4)
+    if tracker is not None:
+        metadata["convergence"] = tracker.history
+    return final_responses, metadata
 
-    if use_selection:
-        selected = select_models(
-            client=clients["gpt-4o"],
-            model_id="gpt-4o",
-            selection_prompt=summary_prompt,
-            question=question,
-            specializations=model_prompts,
-            top_k=top_k
-        )
-    else:
-        selected = list(model_prompts.keys())
 
-    initial_responses = get_model_responses(
-        selected=selected,
-        model_prompts=model_prompts,
-        model_sources=model_sources,
-        question=question,
-        clients=clients
+# -----------------------------
+# Streaming engine
+# -----------------------------
+async def stream_model(model_source, messages, clients):
+    """Yield the answer of `model_source` chunk by chunk as it is generated.
+
+    Raises if the call fails, possibly after some chunks were already yielded.
+    """
+    key = make_key(model_source, messages, {"max_tokens": 1000})
+    cached = RESPONSE_CACHE.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    client = clients[model_source]
+    chunks = []
+    # the rate-limit slot is held until the stream is fully consumed
+    stream = RATE_LIMITS.astream(
+        MODEL_PROVIDERS.get(model_source, "openai"),
+        model_source,
+        lambda: client.chat.completions.create(
+            model=model_source,
+            messages=messages,
+            max_tokens=1000,
+            stream=True
+        ),
+        estimate_tokens(messages, 1000)
     )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            chunks.append(delta)
+            yield delta
+
+    content = "".join(chunks).strip()
+    if content:
+        RESPONSE_CACHE.put(key, content)
+
+
+async def summarize_incrementally(client, model_id, answers, expected, summary_prompt):
+    """Fold expert answers into a running summary as they arrive on the `answers` queue.
+
+    Answers that arrive while a merge is in flight are batched into the next
+    merge, so only the stragglers are left to summarize after the last expert.
+    """
+    summary = None
+    received = 0
+    while received < expected:
+        name, response = await answers.get()
+        batch = {name: response}
+        received += 1
+        while not answers.empty():
+            name, response = answers.get_nowait()
+            batch[name] = response
+            received += 1
+        if summary is not None:
+            batch = {"Summary so far": summary, **batch}
+        summary = await summarize_all(client, model_id, batch, summary_prompt)
+    return summary
+
+
+async def stream_colm(
+    question,
+    use_selection=True,
+    iterations=2,
+    top_k=2,
+    selector="local",
+    participation="all"
+):
+    """Run CoLM and yield events as soon as they happen.
+
+    Events are dicts with a "type" of "selected", "token" (one chunk of an
+    expert answer, tagged with its iteration; 0 is the initial answer),
+    "retry" (the expert's stream broke; discard its tokens so far, the
+    answer is re-requested without streaming), "answer" (a completed expert
+    answer), "summary" or "final".
+    """
+    events = asyncio.Queue()
+    done = object()
+    clients = build_clients()
+
+    async def answer_round(iteration, requests, carried, need_summary):
+        answers = asyncio.Queue()
+        for name, response in carried.items():
+            answers.put_nowait((name, response))
+
+        async def answer(model_name, messages):
+            model_id = MODEL_SOURCES.get(model_name, "gpt-4o")
+            chunks = []
+            try:
+                async for delta in stream_model(model_id, messages, clients):
+                    chunks.append(delta)
+                    await events.put({"type": "token", "model": model_name, "iteration": iteration, "delta": delta})
+                response = "".join(chunks).strip()
+            except Exception as e:
+                # a truncated answer must not reach the summary, so retry once without streaming
+                print(f"Streaming failed for {model_id}: {e}; retrying without streaming")
+                await events.put({"type": "retry", "model": model_name, "iteration": iteration})
+                response = await call_model(model_id, messages, clients)
+            await events.put({"type": "answer", "model": model_name, "iteration": iteration, "content": response})
+            await answers.put((model_name, response))
+            return response
+
+        summary_task = None
+        if need_summary:
+            summary_task = asyncio.create_task(summarize_incrementally(
+                clients["gpt-4o"], "gpt-4o", answers, len(requests) + len(carried), SUMMARY_PROMPT
+            ))
+        with call_stage("answer" if iteration == 0 else "refine"):
+            results = await asyncio.gather(*(answer(name, messages) for name, messages in requests.items()))
+        summary = await summary_task if summary_task is not None else None
+        return dict(zip(requests, results)), summary
+
+    async def orchestrate():
+        try:
+            selected = await choose_models(clients, question, MODEL_PROMPTS, use_selection, selector, top_k)
+            participants = participating_experts(participation, selected, MODEL_PROMPTS, MODEL_SOURCES)
+            await events.put({"type": "selected", "models": selected, "participants": participants})
+
+            requests = {
+                name: [{"role": "system", "content": MODEL_PROMPTS[name]}, {"role": "user", "content": question}]
+                for name in selected
+            }
+            current, summary = await answer_round(0, requests, {}, iterations > 0)
+            for i in range(iterations):
+                await events.put({"type": "summary", "iteration": i + 1, "content": summary})
+                requests = {
+                    name: refine_messages(name, MODEL_PROMPTS[name], summary, selected, question)
+                    for name in MODEL_PROMPTS if name in participants
+                }
+                carried = {name: response for name, response in current.items() if name not in requests}
+                refined, summary = await answer_round(i + 1, requests, carried, i + 1 < iterations)
+                current = {
+                    name: refined[name] if name in refined else current[name]
+                    for name in MODEL_PROMPTS if name in refined or name in current
+                }
+            await events.put({"type": "final", "responses": current})
+        finally:
+            await events.put(done)
+
+    task = asyncio.create_task(orchestrate())
+    try:
+        while True:
+            event = await events.get()
+            if event is done:
+                break
+            yield event
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+        await close_clients(clients)
+
+
+async def print_stream(events):
+    final_responses = {}
+    async for event in events:
+        if event["type"] == "selected":
+            print(f"\n>>> Selected Models: {event['models']}")
+        elif event["type"] == "answer":
+            label = "initial response" if event["iteration"] == 0 else f"refined response (iteration {event['iteration']})"
+            print(f"\n>>> {event['model']} {label}: {event['content'][:100]}...")
+        elif event["type"] == "summary":
+            print(f"\n=== Iteration {event['iteration']}: Refinement ===")
+        elif event["type"] == "final":
+            final_responses = event["responses"]
+    return final_responses
+
 
-    final_responses = refine_responses(
-        clients=clients,
-        selected_models=selected,
-        model_prompts=model_prompts,
-        model_sources=model_sources,
-        initial_responses=initial_responses,
-        summary_prompt=summary_prompt,
+# -----------------------------
+# Main 
+# -----------------------------
+def main(
+    question,
+    use_selection=True,
+    iterations=2,
+    top_k=2,
+    selector="local",
+    adaptive=False,
+    convergence_threshold=0.9,
+    token_budget=None,
+    participation="all",
+    stream=False,
+    speculative=None,
+    confidence_threshold=None
+):
+    if stream:
+        unsupported = [name for name, value in (
+            ("adaptive", adaptive), ("token_budget", token_budget), ("speculative", speculative)
+        ) if value]
+        if unsupported:
+            raise ValueError(f"stream=True does not support {', '.join(unsupported)}; run without stream to use them")
+        final_responses = asyncio.run(print_stream(stream_colm(
+            question=question,
+            use_selection=use_selection,
+            iterations=iterations,
+            top_k=top_k,
+            selector=selector,
+            participation=participation
+        )))
+        print("\n=== Final Model Outputs ===")
+        for model, response in final_responses.items():
+            print(f"\n[{model}]\n{response}\n")
+        return final_responses
+
+    final_responses, metadata = asyncio.run(run_colm(
         question=question,
-        iterations=iterations
-    )
+        use_selection=use_selection,
+        iterations=iterations,
+        top_k=top_k,
+        selector=selector,
+        adaptive=adaptive,
+        convergence_threshold=convergence_threshold,
+        token_budget=token_budget,
+        participation=participation,
+        speculative=speculative,
+        confidence_threshold=confidence_threshold
+    ))
 
     print("\n=== Final Model Outputs ===")
     for model, response in final_responses.items():
         print(f"\n[{model}]\n{response}\n")
+    print(f"Run metadata: {json.dumps(metadata, ensure_ascii=False)}")
+    print(f"Response cache: {RESPONSE_CACHE.stats()}")
+    return final_responses
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+Lazy, memory-lean access to model answer JSONL files.
+
+`AnswerFile` maps question_id -> answer for one JSONL file through a byte-offset
+index, and parses a record only when it is accessed. The index is persisted
+next to the file as `<file>.jsonl.idx` and rebuilt when the file's size or
+mtime changes. `ModelAnswers` maps model name -> `AnswerFile` for a directory,
+so `load_model_answers` costs one index read per file instead of every record.
+
+With `fields`, records are projected to those fields; paths may go through
+list elements, e.g. "conv_metadata", "choices[0].turns" or "games[*].score".
+The projected record keeps the original nesting, so
+`answer["choices"][0]["turns"]` works the same on it.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+INDEX_SUFFIX = ".idx"
+_PATH_TOKEN = re.compile(r"\[(\d+|\*)\]|([^.\[\]]+)")
+
+
+def parse_field(path):
+    """"choices[0].turns" -> ["choices", 0, "turns"]; "[*]" is kept as "*"."""
+    tokens = []
+    for index, name in _PATH_TOKEN.findall(path):
+        if name:
+            tokens.append(name)
+        else:
+            tokens.append("*" if index == "*" else int(index))
+    return tokens
+
+
+_MISSING = object()
+
+
+def _extract(value, tokens):
+    if not tokens:
+        return value
+    token, rest = tokens[0], tokens[1:]
+    if token == "*":
+        if not isinstance(value, list):
+            return _MISSING
+        items = [_extract(item, rest) for item in value]
+        return [None if item is _MISSING else item for item in items]
+    if isinstance(token, int):
+        if not isinstance(value, list) or token >= len(value):
+            return _MISSING
+        item = _extract(value[token], rest)
+        return _MISSING if item is _MISSING else [None] * token + [item]
+    if not isinstance(value, dict) or token not in value:
+        return _MISSING
+    item = _extract(value[token], rest)
+    return _MISSING if item is _MISSING else {token: item}
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = _merge(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(a, list) and isinstance(b, list):
+        return [_merge(x, y) for x, y in zip(a, b)] + a[len(b):] + b[len(a):]
+    return b
+
+
+def project(record, fields):
+    """Keep only `fields` of `record` (plus its question_id); missing fields are left out."""
+    if fields is None:
+        return record
+    projected = {"question_id": record["question_id"]} if "question_id" in record else {}
+    for tokens in fields:
+        part = _extract(record, tokens)
+        if part is not _MISSING:
+            projected = _merge(projected, part)
+    return projected
+
+
+def iter_jsonl(path, fields=None):
+    """Stream the records of a JSONL file, projected to `fields`; malformed lines are skipped."""
+    parsed = None if fields is None else [parse_field(field) for field in fields]
+    with open(path, "r", encoding="utf-8") as fin:
+        for line in fin:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line in {path}")
+                continue
+            yield project(record, parsed)
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_index(path):
+    """question_id -> (offset, length) of its line; a later line for the same question wins."""
+    entries = {}
+    offset = 0
+    with open(path, "rb") as fin:
+        for line in fin:
+            if line.strip():
+                try:
+                    entries[json.loads(line)["question_id"]] = (offset, len(line))
+                except (json.JSONDecodeError, KeyError):
+                    print(f"Skipping malformed line in {path}")
+            offset += len(line)
+    return entries
+
+
+def load_index(path):
+    """The persisted index of `path`, rebuilt (and re-saved) if the file changed since."""
+    size, mtime_ns = _file_stamp(path)
+    index_path = path + INDEX_SUFFIX
+    try:
+        with open(index_path, "r", encoding="utf-8") as fin:
+            saved = json.load(fin)
+        if saved["size"] == size and saved["mtime_ns"] == mtime_ns:
+            return {qid: (offset, length) for qid, offset, length in saved["entries"]}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    entries = build_index(path)
+    data = {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "entries": [[qid, offset, length] for qid, (offset, length) in entries.items()],
+    }
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump(data, fout)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # read-only answer directories just keep the index in memory
+        pass
+    return entries
+
+
+class AnswerFile(Mapping):
+    """question_id -> answer record of one JSONL file, read from disk on access."""
+
+    def __init__(self, path, fields=None, cache_size=256):
+        self.path = path
+        self.fields = None if fields is None else [parse_field(field) for field in fields]
+        self.cache_size = cache_size
+        self._index = load_index(path)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, question_id):
+        with self._lock:
+            if question_id in self._cache:
+                self._cache.move_to_end(question_id)
+                return self._cache[question_id]
+        offset, length = self._index[question_id]
+        with open(self.path, "rb") as fin:
+            fin.seek(offset)
+            record = project(json.loads(fin.read(length)), self.fields)
+        with self._lock:
+            self._cache[question_id] = record
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    def __contains__(self, question_id):
+        return question_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ModelAnswers(Mapping):
+    """model name -> `AnswerFile` for every `<model>.jsonl` in a directory, opened on first use."""
+
+    def __init__(self, answer_dir, fields=None):
+        self.answer_dir = answer_dir
+        self.fields = fields
+        filenames = sorted(
+            name for name in os.listdir(answer_dir) if name.endswith(".jsonl")
+        ) if os.path.isdir(answer_dir) else []
+        self._paths = {name[:-6]: os.path.join(answer_dir, name) for name in filenames}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, model_name):
+        with self._lock:
+            if model_name not in self._files:
+                self._files[model_name] = AnswerFile(self._paths[model_name], self.fields)
+            return self._files[model_name]
+
+    def __contains__(self, model_name):
+        return model_name in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
@@ -7,6 +7,7 @@ import dataclasses
 import glob
 import json
 import os
+import random
 import re
 import time
 from typing import Optional
@@ -14,6 +15,8 @@ from typing import Optional
 import openai
 import anthropic
 
+from fastchat.llm_judge.answer_store import ModelAnswers
+from fastchat.llm_judge.judgment_cache import JUDGMENT_CACHE, conversation_messages
 from fastchat.model.model_adapter import (
     get_conversation_template,
     ANTHROPIC_MODEL_LIST,
@@ -23,10 +26,15 @@ from fastchat.model.model_adapter import (
 # API setting constants
 API_MAX_RETRY = 16
 API_RETRY_SLEEP = 10
+# (first delay, cap) in seconds for full-jitter exponential backoff; None sleeps API_RETRY_SLEEP every retry
+API_RETRY_BACKOFF = None
 API_ERROR_OUTPUT = "$ERROR$"
 
 TIE_DELTA = 0.1
 
+# Answer fields the judge prompts read (see load_model_answers)
+ANSWER_FIELDS = ["model_id", "choices[0].turns"]
+
 # Categories that need reference answers
 NEED_REF_CATS = ["math", "reasoning", "coding", "arena-hard-200"]
 
@@ -96,26 +104,16 @@ def load_questions(question_file: str, begin: Optional[int], end: Optional[int])
     return questions
 
 
-def load_model_answers(answer_dir: str):
+def load_model_answers(answer_dir: str, fields: Optional[list] = None):
     """Load model answers.
 
-    The return value is a python dict of type:
+    The return value is a lazy mapping of type:
     Dict[model_name: str -> Dict[question_id: int -> answer: dict]]
-    """
-    filenames = glob.glob(os.path.join(answer_dir, "*.jsonl"))
-    filenames.sort()
-    model_answers = {}
 
-    for filename in filenames:
-        model_name = os.path.basename(filename)[:-6]
-        answer = {}
-        with open(filename) as fin:
-            for line in fin:
-                line = json.loads(line)
-                answer[line["question_id"]] = line
-        model_answers[model_name] = answer
-
-    return model_answers
+    Answers are read on access through a byte-offset index kept next to each
+    file. With `fields` (e.g. ["choices[0].turns"]), only those are kept.
+    """
+    return ModelAnswers(answer_dir, fields)
 
 
 def load_judge_prompts(prompt_file: str):
@@ -164,10 +162,22 @@ def run_judge_single(question, answer, judge, ref_answer, multi_turn=False):
     conv.append_message(conv.roles[1], None)
 
     if model in OPENAI_MODEL_LIST:
-        judgment = chat_completion_openai(model, conv, temperature=0, max_tokens=2048)
+        judgment = JUDGMENT_CACHE.cached(
+            model,
+            conversation_messages(conv),
+            0,
+            2048,
+            lambda: chat_completion_openai(model, conv, temperature=0, max_tokens=2048),
+        )
     elif model in ANTHROPIC_MODEL_LIST:
-        judgment = chat_completion_anthropic(
-            model, conv, temperature=0, max_tokens=1024
+        judgment = JUDGMENT_CACHE.cached(
+            model,
+            conversation_messages(conv),
+            0,
+            1024,
+            lambda: chat_completion_anthropic(
+                model, conv, temperature=0, max_tokens=1024
+            ),
         )
     else:
         raise ValueError(f"Invalid judge model name: {model}")
@@ -268,13 +278,25 @@ def run_judge_pair(question, answer_a, answer_b, judge, ref_answer, multi_turn=F
 
     if model in OPENAI_MODEL_LIST:
         conv.set_system_message(system_prompt)
-        judgment = chat_completion_openai(model, conv, temperature=0, max_tokens=2048)
+        judgment = JUDGMENT_CACHE.cached(
+            model,
+            conversation_messages(conv),
+            0,
+            2048,
+            lambda: chat_completion_openai(model, conv, temperature=0, max_tokens=2048),
+        )
     elif model in ANTHROPIC_MODEL_LIST:
         if system_prompt != "You are a helpful assistant.":
             user_prompt = "[Instruction]\n" + system_prompt + "\n\n" + user_prompt
             conv.messages[0][1] = user_prompt
-        judgment = chat_completion_anthropic(
-            model, conv, temperature=0, max_tokens=1024
+        judgment = JUDGMENT_CACHE.cached(
+            model,
+            conversation_messages(conv),
+            0,
+            1024,
+            lambda: chat_completion_anthropic(
+                model, conv, temperature=0, max_tokens=1024
+            ),
         )
     else:
         raise ValueError(f"Invalid judge model name: {model}")
@@ -373,6 +395,7 @@ def play_a_match_pair(match: MatchPair, output_file: str):
             winner = "model_2"
 
         question_id = question["question_id"]
+        turn = 1 if not multi_turn else 2
         result = {
             "question_id": question_id,
             "model_1": model_1,
@@ -386,10 +409,11 @@ def play_a_match_pair(match: MatchPair, output_file: str):
             "g2_judgment": m2_judgment,
             "m1_score": m1_score,
             "m2_score": m2_score,
+            "turn": turn,
             "tstamp": time.time(),
         }
         print(
-            f"question: {question_id}, model_1: {model_1}, model_2: {model_2}, "
+            f"question: {question_id}, turn: {turn}, model_1: {model_1}, model_2: {model_2}, "
             f"winner: {winner}, m1_score: {m1_score}, m2_score: {m2_score}, "
             f"judge: {(judge.model_name, judge.prompt_template['name'])}"
         )
@@ -404,12 +428,21 @@ def play_a_match_pair(match: MatchPair, output_file: str):
     return result
 
 
+def retry_sleep(attempt):
+    """Sleep before retry `attempt` (0-based): API_RETRY_SLEEP, or the API_RETRY_BACKOFF schedule if set."""
+    if API_RETRY_BACKOFF is None:
+        time.sleep(API_RETRY_SLEEP)
+        return
+    first, cap = API_RETRY_BACKOFF
+    time.sleep(random.uniform(0, min(cap, first * 2**attempt)))
+
+
 def chat_completion_openai(model, conv, temperature, max_tokens, api_dict=None):
     if api_dict is not None:
         openai.api_base = api_dict["api_base"]
         openai.api_key = api_dict["api_key"]
     output = API_ERROR_OUTPUT
-    for _ in range(API_MAX_RETRY):
+    for attempt in range(API_MAX_RETRY):
         try:
             messages = conv.to_openai_api_messages()
             response = openai.ChatCompletion.create(
@@ -423,7 +456,7 @@ def chat_completion_openai(model, conv, temperature, max_tokens, api_dict=None):
             break
         except openai.error.OpenAIError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(attempt)
 
     return output
 
@@ -442,7 +475,7 @@ def chat_completion_openai_azure(model, conv, temperature, max_tokens, api_dict=
         model = model[6:]
 
     output = API_ERROR_OUTPUT
-    for _ in range(API_MAX_RETRY):
+    for attempt in range(API_MAX_RETRY):
         try:
             messages = conv.to_openai_api_messages()
             response = openai.ChatCompletion.create(
@@ -456,7 +489,7 @@ def chat_completion_openai_azure(model, conv, temperature, max_tokens, api_dict=
             break
         except openai.error.OpenAIError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(attempt)
         except openai.error.InvalidRequestError as e:
             print(type(e), e)
             break
@@ -474,7 +507,7 @@ def chat_completion_anthropic(model, conv, temperature, max_tokens, api_dict=Non
         api_key = os.environ["ANTHROPIC_API_KEY"]
 
     output = API_ERROR_OUTPUT
-    for _ in range(API_MAX_RETRY):
+    for attempt in range(API_MAX_RETRY):
         try:
             c = anthropic.Anthropic(api_key=api_key)
             prompt = conv.get_prompt()
@@ -489,7 +522,7 @@ def chat_completion_anthropic(model, conv, temperature, max_tokens, api_dict=Non
             break
         except anthropic.APIError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(attempt)
     return output.strip()
 
 
@@ -508,14 +541,14 @@ def chat_completion_palm(chat_state, model, conv, temperature, max_tokens):
         "max_output_tokens": max_tokens,
     }
     output = API_ERROR_OUTPUT
-    for _ in range(API_MAX_RETRY):
+    for attempt in range(API_MAX_RETRY):
         try:
             response = chat_state.send_message(conv.messages[-2][1], **parameters)
             output = response.text
             break
         except Exception as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(attempt)
     return chat_state, output
 
 
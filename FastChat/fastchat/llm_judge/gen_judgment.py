@@ -9,6 +9,7 @@ import json
 import numpy as np
 from tqdm import tqdm
 
+from fastchat.llm_judge.judgment_cache import JUDGMENT_CACHE
 from fastchat.llm_judge.common import (
     load_questions,
     load_model_answers,
@@ -21,6 +22,7 @@ from fastchat.llm_judge.common import (
     MatchPair,
     MatchSingle,
     NEED_REF_CATS,
+    ANSWER_FIELDS,
 )
 
 
@@ -217,8 +219,8 @@ if __name__ == "__main__":
     questions = load_questions(question_file, None, None)
 
     # Load answers
-    model_answers = load_model_answers(answer_dir)
-    ref_answers = load_model_answers(ref_answer_dir)
+    model_answers = load_model_answers(answer_dir, ANSWER_FIELDS)
+    ref_answers = load_model_answers(ref_answer_dir, ANSWER_FIELDS)
 
     # Load judge
     judge_prompts = load_judge_prompts(args.judge_file)
@@ -320,3 +322,5 @@ if __name__ == "__main__":
                 executor.map(play_a_match_wrapper, matches), total=len(matches)
             ):
                 pass
+
+    JUDGMENT_CACHE.print_stats()
@@ -0,0 +1,132 @@
+"""
+Content-addressed cache of judge outputs.
+
+A judgment is keyed by a SHA-256 of the judge model, temperature, max_tokens
+and the exact messages sent (system prompt and rendered conversation), so a
+re-judge only calls the judge for prompts it has never seen, regardless of the
+bench directory, answer file or script that asked. It is shared by
+`play_a_match_single` / `play_a_match_pair`, eval_mt_bench.py and
+arena_hard_gen_judge.py.
+
+Error outputs are never stored. The cache is one SQLite file, configured with
+FASTCHAT_JUDGMENT_CACHE (path, default .judgment_cache/judgments.sqlite) and
+FASTCHAT_JUDGMENT_CACHE_MODE (readwrite, readonly, refresh or bypass).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_MODES = ("readwrite", "readonly", "refresh", "bypass")
+API_ERROR_OUTPUT = "$ERROR$"
+
+
+def judgment_key(model, messages, temperature, max_tokens):
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": messages,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def conversation_messages(conv):
+    """The messages a fastchat Conversation sends, in OpenAI format."""
+    return conv.to_openai_api_messages()
+
+
+class JudgmentCache:
+    def __init__(self, path, mode="readwrite"):
+        assert mode in CACHE_MODES, f"unknown cache mode {mode}, expected one of {CACHE_MODES}"
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS judgments ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, judgment TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            if self.mode in ("bypass", "refresh"):
+                self.misses += 1
+                return None
+            row = self._connect().execute(
+                "SELECT judgment FROM judgments WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, judgment):
+        if self.mode in ("bypass", "readonly"):
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO judgments (key, model, judgment, created) VALUES (?, ?, ?, ?)",
+                (key, model, judgment, time.time()),
+            )
+            conn.commit()
+
+    def cached(self, model, messages, temperature, max_tokens, fn):
+        """Return the stored judgment for this prompt, or call `fn()` and store its output."""
+        key = judgment_key(model, messages, temperature, max_tokens)
+        judgment = self.get(key)
+        if judgment is not None:
+            return judgment
+        judgment = fn()
+        if judgment and judgment != API_ERROR_OUTPUT:
+            self.put(key, model, judgment)
+        return judgment
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Judgment cache ({self.path}): {stats['hits']} hits, {stats['misses']} misses, "
+            f"hit rate {stats['hit_rate']}, mode {stats['mode']}"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+JUDGMENT_CACHE = JudgmentCache(
+    path=os.environ.get(
+        "FASTCHAT_JUDGMENT_CACHE",
+        os.path.join(".judgment_cache", "judgments.sqlite"),
+    ),
+    mode=os.environ.get("FASTCHAT_JUDGMENT_CACHE_MODE", "readwrite"),
+)
@@ -1,3 +1,16 @@
+"""
+Arena-Hard judgments, run on asyncio.
+
+Judgments are scheduled as tasks; each one takes a slot on one of the judge
+model's endpoints (every entry of `endpoints` in api_config.yaml may set its own
+`parallel`, defaulting to the model's) and, with --max-rps, a slot from a global
+request-rate limiter. The blocking API clients run in worker threads. A single
+writer task owns the judgment files: results are buffered per model and
+appended in question order every --flush-interval seconds (or --flush-size
+results), so concurrent judgments never interleave lines. Judgments already in
+the output files are skipped, so an interrupted run resumes where it stopped.
+"""
+import asyncio
 import json
 import random
 import time
@@ -5,10 +18,14 @@ import yaml
 import argparse
 import os
 import re
-import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from tqdm import tqdm
 
+from arena_hard_store import JudgmentStore
+from colm_writer import read_jsonl
+from fastchat.llm_judge.judgment_cache import JUDGMENT_CACHE, judgment_key
+
 from arena_hard_utils import (
     load_questions,
     load_model_answers,
@@ -17,7 +34,13 @@ from arena_hard_utils import (
     chat_completion_openai,
     chat_completion_anthropic,
     chat_completion_openai_azure,
+    API_ERROR_OUTPUT,
 )
+
+# answer fields read by build_conv and judgment
+ANSWER_FIELDS = ["model_id", "choices[0].turns"]
+
+
 def count_markdown_elements(markdown_text, suffix):
     counters = {
         f"header_count{suffix}": {
@@ -63,10 +86,11 @@ def get_score(judgment, pattern, pairwise=True):
 
 
 # get answer from model
-def get_answer(model, conv, temperature, max_tokens, endpoint_dict=None):
-    api_dict = get_endpoint(endpoint_dict["endpoints"])
+def get_answer(model, conv, temperature, max_tokens, endpoint_dict=None, api_dict=None):
+    if api_dict is None:
+        api_dict = get_endpoint(endpoint_dict["endpoints"])
     if endpoint_dict["api_type"] == "anthropic":
-        output = chat_completion_anthropic(model, conv, temperature, max_tokens)
+        output = chat_completion_anthropic(model, conv, temperature, max_tokens, api_dict)
     elif endpoint_dict["api_type"] == "azure":
         output = chat_completion_openai_azure(model, conv, temperature, max_tokens, api_dict)
     else:
@@ -74,66 +98,180 @@ def get_answer(model, conv, temperature, max_tokens, endpoint_dict=None):
     return output
 
 
-def judgment(**args):
-    question = args["question"]
-    answer = args["answer"]
-    reference = args["reference"]
-    baseline = args["baseline_answer"]
-    configs = args["configs"]
-    output_file = args["output_file"]
-    model = configs["judge_model"]
-
+class EndpointPool:
+    """Concurrency slots per endpoint of one api_config.yaml entry; requests go to the least busy endpoint."""
+
+    def __init__(self, endpoint_dict):
+        endpoints = endpoint_dict.get("endpoints") or [None]
+        default = endpoint_dict.get("parallel", 8)
+        self.endpoints = endpoints
+        self.limits = [(endpoint or {}).get("parallel", default) for endpoint in endpoints]
+        self.in_flight = [0] * len(endpoints)
+        self._available = None
+
+    @property
+    def capacity(self):
+        return sum(self.limits)
+
+    async def acquire(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+        async with self._available:
+            while True:
+                free = [i for i, limit in enumerate(self.limits) if self.in_flight[i] < limit]
+                if free:
+                    least = min(self.in_flight[i] / self.limits[i] for i in free)
+                    index = random.choice([i for i in free if self.in_flight[i] / self.limits[i] == least])
+                    self.in_flight[index] += 1
+                    return index
+                await self._available.wait()
+
+    async def release(self, index):
+        async with self._available:
+            self.in_flight[index] -= 1
+            self._available.notify()
+
+
+class RequestRateLimiter:
+    """Spaces request starts at least 1 / max_rps seconds apart (no limit when max_rps is None)."""
+
+    def __init__(self, max_rps=None):
+        self.interval = 1.0 / max_rps if max_rps else 0.0
+        self._next = 0.0
+        self._lock = None
+
+    async def wait(self):
+        if not self.interval:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class JudgmentWriter:
+    """Single writer task: buffers judgments per model file and appends them in question order."""
+
+    def __init__(self, output_files, question_order, flush_interval=5.0, flush_size=64):
+        self.output_files = output_files
+        self.question_order = question_order
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.written = 0
+        self._queue = asyncio.Queue()
+        self._pending = {}
+
+    def put(self, model, output):
+        self._queue.put_nowait((model, output))
+
+    def _flush(self):
+        for model, outputs in self._pending.items():
+            if not outputs:
+                continue
+            outputs.sort(key=lambda output: self.question_order.get(output["question_id"], 0))
+            with open(self.output_files[model], "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(output, ensure_ascii=False) + "\n" for output in outputs))
+                f.flush()
+                os.fsync(f.fileno())
+            self.written += len(outputs)
+        self._pending = {}
+
+    async def run(self):
+        buffered = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._pending.setdefault(item[0], []).append(item[1])
+                buffered += 1
+            if buffered >= self.flush_size or time.monotonic() >= deadline:
+                await asyncio.to_thread(self._flush)
+                buffered = 0
+                deadline = time.monotonic() + self.flush_interval
+        self._flush()
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+
+def build_conv(question, answer, baseline, reference, configs, game):
+    conv = [{"role": "system", "content": configs["system_prompt"]}]
+    if baseline and game % 2 == 1:  # swap position
+        answer, baseline = baseline, answer
+
+    for template in configs["prompt_template"]:
+        prompt_args = {}
+
+        for i, turn in enumerate(question["turns"]):
+            prompt_args[f"question_{i+1}"] = turn["content"]
+        base = 1
+
+        if baseline:
+            for i, turn in enumerate(baseline["choices"][0]["turns"]):
+                prompt_args[f"answer_{i+1}"] = turn["content"]
+                base += 1
+        if answer:
+            for i, turn in enumerate(answer["choices"][0]["turns"]):
+                prompt_args[f"answer_{i+base}"] = turn["content"]
+
+        if reference:
+            for j, ref_answer in enumerate(reference):
+                for i, turn in enumerate(ref_answer["choices"][0]["turns"]):
+                    prompt_args[f"ref_answer_{i+j+1}"] = turn["content"]
+
+        user_prompt = template.format(**prompt_args)
+        conv.append({"role": "user", "content": user_prompt})
+    return conv
+
+
+async def judgment(question, answer, reference, baseline_answer, configs, endpoint_dict, regex_pattern, pool, limiter):
     num_games = 2 if configs["pairwise"] else 1
 
     output = {
         "question_id": question["question_id"],
         "model": answer["model_id"],
-        "judge": model,
+        "judge": configs["judge_model"],
         "games": []
         }
 
     for game in range(num_games):
-        conv = [{"role": "system", "content": configs["system_prompt"]}]
-
-        for template in configs["prompt_template"]:
-            prompt_args = {}
-
-            for i, turn in enumerate(question["turns"]):
-                prompt_args[f"question_{i+1}"] = turn["content"]
-            base = 1
-
-            if baseline:
-                if game % 2 == 1: # swap position
-                    answer, baseline = baseline, answer
-
-                for i, turn in enumerate(baseline["choices"][0]["turns"]):
-                    prompt_args[f"answer_{i+1}"] = turn["content"]
-                    base += 1
-            if answer:
-                for i, turn in enumerate(answer["choices"][0]["turns"]):
-                    prompt_args[f"answer_{i+base}"] = turn["content"]
-
-            if reference:
-                for j, ref_answer in enumerate(reference):
-                    for i, turn in enumerate(ref_answer["choices"][0]["turns"]):
-                        prompt_args[f"ref_answer_{i+j+1}"] = turn["content"]
-            
-            user_prompt = template.format(**prompt_args)
-            conv.append({"role": "user", "content": user_prompt})
+        conv = build_conv(question, answer, baseline_answer, reference, configs, game)
 
         judgment = ""
         for _ in range(configs['number_of_judgment_attempts']):
-            new_judgment = get_answer(
-                endpoint_info["model_name"],
-                conv,
-                configs["temperature"],
-                configs["max_tokens"],
-                args["endpoint_dict"],
-            )
+            # identical prompts judged before (under any bench or baseline) are not re-sent
+            key = judgment_key(endpoint_dict["model_name"], conv, configs["temperature"], configs["max_tokens"])
+            new_judgment = await asyncio.to_thread(JUDGMENT_CACHE.get, key)
+            if new_judgment is None:
+                await limiter.wait()
+                slot = await pool.acquire()
+                try:
+                    new_judgment = await asyncio.to_thread(
+                        get_answer,
+                        endpoint_dict["model_name"],
+                        list(conv),
+                        configs["temperature"],
+                        configs["max_tokens"],
+                        endpoint_dict,
+                        pool.endpoints[slot],
+                    )
+                finally:
+                    await pool.release(slot)
+                if new_judgment != API_ERROR_OUTPUT:
+                    await asyncio.to_thread(JUDGMENT_CACHE.put, key, endpoint_dict["model_name"], new_judgment)
 
             judgment += ("\n" + new_judgment)
 
-            score, try_again = get_score(judgment, args["regex_pattern"])
+            score, try_again = get_score(judgment, regex_pattern)
 
             conv.append({"role": "assistant", "content": new_judgment})
 
@@ -148,15 +286,49 @@ def judgment(**args):
             "score": score
         }
         output["games"].append(result)
+    return output
+
 
-    with open(output_file, "a", encoding="utf-8") as f:
-        f.write(json.dumps(output, ensure_ascii=False) + "\n")
+def load_existing_judgments(output_files):
+    """model -> judged question ids; a torn last line from an interrupted run is ignored."""
+    return {model: {entry["question_id"] for entry in read_jsonl(path)} for model, path in output_files.items()}
+
+
+async def run_judgments(tasks, endpoint_info, output_files, question_order, args):
+    pool = EndpointPool(endpoint_info)
+    limiter = RequestRateLimiter(args.max_rps)
+    writer = JudgmentWriter(output_files, question_order, args.flush_interval, args.flush_size)
+    # the blocking clients run in threads; one per endpoint slot
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=pool.capacity))
+    writer_task = asyncio.create_task(writer.run())
+    print(f"Judging {len(tasks)} answers on {len(pool.endpoints)} endpoint(s), concurrency {pool.limits}, "
+          f"max rps {args.max_rps or 'unlimited'}")
+
+    async def one(model, kwargs):
+        writer.put(model, await judgment(**kwargs, pool=pool, limiter=limiter))
+
+    failed = 0
+    with tqdm(total=len(tasks)) as pbar:
+        for future in asyncio.as_completed([one(model, kwargs) for model, kwargs in tasks]):
+            try:
+                await future
+            except Exception as e:
+                failed += 1
+                print(f"Judgment failed: {type(e).__name__}: {e}")
+            pbar.update(1)
+    writer.close()
+    await writer_task
+    print(f"Wrote {writer.written} judgments" + (f", {failed} failed (re-run to retry them)" if failed else ""))
+    JUDGMENT_CACHE.print_stats()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--setting-file", type=str, default="arena_hard_judge_config.yaml")
     parser.add_argument("--endpoint-file", type=str, default="api_config.yaml")
+    parser.add_argument("--max-rps", type=float, default=None, help="Cap on judge requests started per second.")
+    parser.add_argument("--flush-interval", type=float, default=5.0, help="Seconds between appends to the judgment files.")
+    parser.add_argument("--flush-size", type=int, default=64, help="Append early once this many judgments are buffered.")
     args = parser.parse_args()
     print(args)
 
@@ -175,16 +347,16 @@ if __name__ == "__main__":
     ref_answer_dir = os.path.join(configs["bench_name"], "reference_answer")
 
     questions = load_questions(question_file)
-    model_answers = load_model_answers(answer_dir)
-    
+    model_answers = load_model_answers(answer_dir, ANSWER_FIELDS)
+
     # if user choose a set of models, only judge those models
     models = [model for model in configs["model_list"]]
-        
+
     ref_answers = None
     if configs["reference"]:
-        ref_answers = load_model_answers(ref_answer_dir)
+        ref_answers = load_model_answers(ref_answer_dir, ANSWER_FIELDS)
         ref_answers = [ref_answers[model] for model in configs["ref_model"]]
-    
+
     output_files = {}
     output_dir = f"{configs['bench_name']}/model_judgment/{configs['judge_model']}"
     for model in models:
@@ -196,48 +368,47 @@ if __name__ == "__main__":
     for output_file in output_files.values():
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-    existing_judgments = load_model_answers(output_dir)
+    existing_judgments = load_existing_judgments(output_files)
 
     endpoint_info = endpoint_list[configs["judge_model"]]
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=endpoint_info["parallel"]) as executor:
-        futures = []
-        for model in models:
-            count = 0
-            for question in questions:
-                question_id = question["question_id"]
-
-                kwargs = {}
-                kwargs["question"] = question
-                if model in model_answers and not question_id in model_answers[model]:
-                    print(f"Warning: {model} answer to {question['question_id']} cannot be found.")
-                    continue
-
-                if model in existing_judgments and question_id in existing_judgments[model]:
-                    count += 1
-                    continue
-
-                kwargs["answer"] = model_answers[model][question_id]
-                if ref_answers:
-                    kwargs["reference"] = [ref_answer[question_id] for ref_answer in ref_answers]
-                    assert len(kwargs["reference"]) == len(configs["ref_model"])
-                else:
-                    kwargs["reference"] = None
-                if configs["baseline"]:
-                    kwargs["baseline_answer"] = model_answers[configs["baseline_model"]][question_id]
-                else:
-                    kwargs["baseline_answer"] = None
-                kwargs["configs"] = configs
-                kwargs["endpoint_dict"] = endpoint_info
-                kwargs["output_file"] = output_files[model]
-                kwargs["regex_pattern"] = pattern
-                future = executor.submit(judgment, **kwargs)
-                futures.append(future)
-
-            if count > 0:
-                print(f"{count} number of existing judgments")
-
-        for future in tqdm(
-            concurrent.futures.as_completed(futures), total=len(futures)
-        ):
-            future.result()
\ No newline at end of file
+    tasks = []
+    for model in models:
+        count = 0
+        for question in questions:
+            question_id = question["question_id"]
+
+            kwargs = {}
+            kwargs["question"] = question
+            if model in model_answers and not question_id in model_answers[model]:
+                print(f"Warning: {model} answer to {question['question_id']} cannot be found.")
+                continue
+
+            if question_id in existing_judgments[model]:
+                count += 1
+                continue
+
+            kwargs["answer"] = model_answers[model][question_id]
+            if ref_answers:
+                kwargs["reference"] = [ref_answer[question_id] for ref_answer in ref_answers]
+                assert len(kwargs["reference"]) == len(configs["ref_model"])
+            else:
+                kwargs["reference"] = None
+            if configs["baseline"]:
+                kwargs["baseline_answer"] = model_answers[configs["baseline_model"]][question_id]
+            else:
+                kwargs["baseline_answer"] = None
+            kwargs["configs"] = configs
+            kwargs["endpoint_dict"] = endpoint_info
+            kwargs["regex_pattern"] = pattern
+            tasks.append((model, kwargs))
+
+        if count > 0:
+            print(f"{count} number of existing judgments")
+
+    question_order = {question["question_id"]: i for i, question in enumerate(questions)}
+    asyncio.run(run_judgments(tasks, endpoint_info, output_files, question_order, args))
+
+    # bring the leaderboard's columnar store up to date with the appended judgments
+    added = JudgmentStore(configs["bench_name"], configs["judge_model"]).sync()
+    print(f"Judgment store updated: {sum(added.values())} new rows")
@@ -8,12 +8,22 @@ import os
 from glob import glob
 from tqdm import tqdm
 
-from arena_hard_utils import load_model_answers
+from arena_hard_store import JudgmentStore
+from fastchat.llm_judge.answer_store import iter_jsonl
+from arena_hard_utils import (
+    load_model_answers,
+    battles_from_judgments,
+    style_metadata_frame,
+)
 from arena_hard_utils_math import (
     compute_mle_elo, 
-    get_bootstrap_result,
+    get_bootstrap_result_weighted,
     get_win_rate_column,
     fit_bt,
+    fit_bt_warm,
+    fit_bt_weighted,
+    aggregate_battles,
+    anchored_elo,
     construct_style_matrices,
     get_bootstrap_result_style_control,
     STYLE_CONTROL_ELEMENTS,
@@ -22,87 +32,35 @@ from arena_hard_utils_math import (
 )
 
 
-def get_battles_from_row(row, first_game_only, multiplier, baseline_model, metadata=None):
-    results = []
-    output = {"question_id": row["question_id"],
-              "model_a": baseline_model,
-              "model_b": row["model"]}
-    
-    game = row["games"][0]
-    weight = 1
-    if game["score"] == "A=B":
-        output["winner"] = "tie"
-    elif game["score"] == "A>B":
-        output["winner"] = "model_a"
-    elif game["score"] == "A>>B":
-        output["winner"] = "model_a"
-        weight = multiplier
-    elif game["score"] == "B>A":
-        output["winner"] = "model_b"
-    elif game["score"] == "B>>A":
-        output["winner"] = "model_b"
-        weight = multiplier
-    else:
-        weight = 0
-    
-    # add conv_metadata for style control
-    if metadata:
-        output["conv_metadata"] = {
-            "sum_assistant_a_tokens": metadata[baseline_model][row["question_id"]]["conv_metadata"]["token_len"],
-            "sum_assistant_b_tokens": metadata[row["model"]][row["question_id"]]["conv_metadata"]["token_len"],
-            "header_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["header_count"],
-            "header_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["header_count"],
-            "list_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["list_count"],
-            "list_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["list_count"],
-            "bold_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["bold_count"],
-            "bold_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["bold_count"],
-        }
+# style mode -> (apply_ratio, style_elements) for construct_style_matrices
+STYLE_MODES = {
+    "style": ([1, 1, 1, 1], STYLE_CONTROL_ELEMENTS),
+    "length": ([1], LENGTH_CONTROL_ELEMENTS),
+    "markdown": ([1, 1, 1], MARKDOWN_CONTROL_ELEMENTS),
+}
 
-    if weight:
-        results += [output] * weight
-        
-    if first_game_only:
-        return results
-    
-    # game 2
-    output = {"question_id": row["question_id"],
-            "model_a": baseline_model,
-            "model_b": row["model"]}
+JUDGMENT_FIELDS = ["model", "judge", "games[*].score"]
 
-    game = row["games"][1]
 
-    weight = 1
-    if game["score"] == "A=B":
-        output["winner"] = "tie"
-    elif game["score"] == "A>B":
-        output["winner"] = "model_b"
-    elif game["score"] == "A>>B":
-        output["winner"] = "model_b"
-        weight = multiplier
-    elif game["score"] == "B>A":
-        output["winner"] = "model_a"
-    elif game["score"] == "B>>A":
-        output["winner"] = "model_a"
-        weight = multiplier
-    else:
-        weight = 0
-    
-    if metadata:
-        output["conv_metadata"] = {
-            "sum_assistant_a_tokens": metadata[baseline_model][row["question_id"]]["conv_metadata"]["token_len"],
-            "sum_assistant_b_tokens": metadata[row["model"]][row["question_id"]]["conv_metadata"]["token_len"],
-            "header_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["header_count"],
-            "header_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["header_count"],
-            "list_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["list_count"],
-            "list_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["list_count"],
-            "bold_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["bold_count"],
-            "bold_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["bold_count"],
-        }
+def load_judgments(bench_name, judge_name):
+    judge_dir = f"{bench_name}/model_judgment/{judge_name}"
+    print(judge_dir)
+    assert os.path.exists(judge_dir)
+    # only the verdicts are read; the judgment texts are skipped
+    return pd.concat([pd.DataFrame(list(iter_jsonl(file, JUDGMENT_FIELDS))) for file in tqdm(glob(f"{judge_dir}/*jsonl"))])
 
-    if weight:
-        results += [output] * weight
-    
-    return results
+
+def load_style_metadata(bench_name):
+    """One row per (model, question_id) with the conv_metadata fields used by style control."""
+    ans_dir = f"{bench_name}/model_answer"
+    assert os.path.exists(ans_dir)
+
+    frames = []
+    for file in tqdm(glob(f"{ans_dir}/*.jsonl")):
+        answers = list(iter_jsonl(file, ["model_id", "conv_metadata"]))
+        assert all("conv_metadata" in a for a in answers), "You must have conv_metadata attributes in your model answer to apply style contro. Please pull newest data if needed."
+        frames.append(style_metadata_frame(answers[0]["model_id"], [a["question_id"] for a in answers], [a["conv_metadata"] for a in answers]))
+    return pd.concat(frames, ignore_index=True)
 
 
 def get_battles_from_judgment(bench_name, 
@@ -113,23 +71,10 @@ def get_battles_from_judgment(bench_name,
                               style_control=False):
     print("Turning judgment results into battles...")
 
-    judge_dir = f"{bench_name}/model_judgment/{judge_name}"
-    print(judge_dir)
-    assert os.path.exists(judge_dir)
-    judgments = pd.concat([pd.read_json(file, lines=True, encoding='utf-8') for file in tqdm(glob(f"{judge_dir}/*jsonl"))])
-    metadata = None
-    if style_control:
-        ans_dir = f"{bench_name}/model_answer"
-        assert os.path.exists(ans_dir)
-        
-        metadata = {}
-        for file in tqdm(glob(f"{ans_dir}/*.jsonl")):
-            df = pd.read_json(file, lines=True)
-            assert "conv_metadata" in df.columns, "You must have conv_metadata attributes in your model answer to apply style contro. Please pull newest data if needed."
-            metadata[df.model_id[0]] = df[["question_id", "conv_metadata"]].set_index("question_id").to_dict("index")
-    
-    battles = judgments.apply(lambda row: get_battles_from_row(row, first_game_only, multiplier, baseline_model, metadata), axis=1)
-    battles = pd.DataFrame(battles[battles.map(len) > 0].explode().tolist())
+    judgments = load_judgments(bench_name, judge_name)
+    metadata = load_style_metadata(bench_name) if style_control else None
+
+    battles = battles_from_judgments(judgments, first_game_only, multiplier, baseline_model, metadata)
     battles.to_json("arena-hard-v0.1/arena_hard_battles.jsonl", orient="records", lines=True)
     return battles
 
@@ -143,11 +88,13 @@ if __name__ == "__main__":
     parser.add_argument("--show-elo", action="store_true")
     parser.add_argument("--weight", type=int, default=3)
     parser.add_argument("--num-rounds", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="Processes for the bootstrap rounds (default: all CPUs).")
     parser.add_argument("--output", action="store_true")
     parser.add_argument("--first-game-only", action="store_true")
     parser.add_argument("--style-control", action="store_true")
     parser.add_argument("--length-control-only", action="store_true")
     parser.add_argument("--markdown-control-only", action="store_true")
+    parser.add_argument("--incremental", action="store_true", help="Use the Parquet judgment/battle store and warm-start from the last fit.")
     args = parser.parse_args()
     print(args)
     assert not args.load_bootstrap or (args.load_battles and args.load_bootstrap), "If loading prexisting bootstrapping data, you must also load preexisting battles."
@@ -155,48 +102,55 @@ if __name__ == "__main__":
 
     answer_dir = os.path.join("data", args.bench_name, "model_answer")
     model_answers = load_model_answers(answer_dir)
+
+    mode = "style" if args.style_control else "length" if args.length_control_only else "markdown" if args.markdown_control_only else "plain"
+    if args.incremental:
+        store = JudgmentStore(args.bench_name, args.judge_name)
+        print(f"New judgments: {store.sync()}")
+        battles, store_key = store.battles(args.first_game_only, args.weight, args.baseline, mode != "plain")
+    else:
+        battles = get_battles_from_judgment(args.bench_name, 
+                                            args.judge_name, 
+                                            args.first_game_only, 
+                                            args.weight, 
+                                            args.baseline,
+                                            mode != "plain")
     
-    battles = get_battles_from_judgment(args.bench_name, 
-                                        args.judge_name, 
-                                        args.first_game_only, 
-                                        args.weight, 
-                                        args.baseline,
-                                        args.style_control or args.length_control_only or args.markdown_control_only)
-    
-    if args.style_control:
-        X, Y, models = construct_style_matrices(battles)
-        bt_model_coef, style_coef = fit_bt(X, Y, models, baseline_model=args.baseline)
-        bootstrap_model_coef, _ = get_bootstrap_result_style_control(X, Y, battles, models, 
-                                                                     fit_bt, 
-                                                                     num_round=args.num_rounds, 
-                                                                     baseline_model=args.baseline)
-        display_coefs = {STYLE_CONTROL_ELEMENTS[i]: round(style_coef[i], 3) for i in range(len(STYLE_CONTROL_ELEMENTS) // 2)}
-        print(f"Style Coefficients: {display_coefs}")
-    elif args.length_control_only:
-        X, Y, models = construct_style_matrices(battles, 
-                                                apply_ratio=[1], 
-                                                style_elements=LENGTH_CONTROL_ELEMENTS)
-        bt_model_coef, style_coef = fit_bt(X, Y, models, baseline_model=args.baseline)
-        bootstrap_model_coef, _ = get_bootstrap_result_style_control(X, Y, battles, models, 
-                                                                     fit_bt, 
-                                                                     num_round=args.num_rounds, 
-                                                                     baseline_model=args.baseline)
-        display_coefs = {LENGTH_CONTROL_ELEMENTS[i]: round(style_coef[i], 3) for i in range(len(LENGTH_CONTROL_ELEMENTS) // 2)}
-        print(f"Style Coefficients: {display_coefs}")
-    elif args.markdown_control_only:
+    if mode != "plain":
+        apply_ratio, style_elements = STYLE_MODES[mode]
         X, Y, models = construct_style_matrices(battles, 
-                                                apply_ratio=[1, 1, 1], 
-                                                style_elements=MARKDOWN_CONTROL_ELEMENTS)
-        bt_model_coef, style_coef = fit_bt(X, Y, models, baseline_model=args.baseline)
-        bootstrap_model_coef, _ = get_bootstrap_result_style_control(X, Y, battles, models, 
-                                                                     fit_bt, 
+                                                apply_ratio=apply_ratio, 
+                                                style_elements=style_elements)
+        theta = None
+        if args.incremental:
+            # start from the previous leaderboard's coefficients; new models start at 0
+            previous = store.previous_coefficients(store_key, mode, models)
+            init = None
+            if previous is not None and len(previous[1]) == X.shape[1] - len(models):
+                init = np.concatenate(previous)
+            bt_model_coef, style_coef, theta = fit_bt_warm(X, Y, models, init, baseline_model=args.baseline)
+            store.save_coefficients(store_key, mode, models, theta)
+        else:
+            bt_model_coef, style_coef = fit_bt(X, Y, models, baseline_model=args.baseline)
+        bootstrap_model_coef, _ = get_bootstrap_result_style_control(X, Y, models, 
                                                                      num_round=args.num_rounds, 
-                                                                     baseline_model=args.baseline)
-        display_coefs = {MARKDOWN_CONTROL_ELEMENTS[i]: round(style_coef[i], 3) for i in range(len(MARKDOWN_CONTROL_ELEMENTS) // 2)}
+                                                                     baseline_model=args.baseline,
+                                                                     workers=args.workers,
+                                                                     init=theta)
+        display_coefs = {style_elements[i]: round(style_coef[i], 3) for i in range(len(style_elements) // 2)}
         print(f"Style Coefficients: {display_coefs}")
+    elif args.incremental:
+        cells, models = aggregate_battles(battles)
+        previous = store.previous_coefficients(store_key, mode, models)
+        # centered like a fit from zero, so unanchored ratings match compute_mle_elo too
+        init = previous[0] - previous[0].mean() if previous is not None else None
+        theta = fit_bt_weighted(cells, cells["count"].to_numpy(), len(models), init)
+        store.save_coefficients(store_key, mode, models, theta)
+        bt_model_coef = anchored_elo(theta, models, baseline_model=args.baseline)
+        bootstrap_model_coef = get_bootstrap_result_weighted(battles, args.num_rounds, args.baseline, args.workers, init=theta)
     else:
         bt_model_coef = compute_mle_elo(battles, baseline_model=args.baseline)
-        bootstrap_model_coef = get_bootstrap_result(battles, compute_mle_elo, args.num_rounds, args.baseline)
+        bootstrap_model_coef = get_bootstrap_result_weighted(battles, args.num_rounds, args.baseline, args.workers)
 
     stats = pd.DataFrame()
     stats["results"] = None
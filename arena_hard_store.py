@@ -0,0 +1,252 @@
+"""Columnar (Parquet) store of arena-hard judgments and battles.
+
+The judgment JSONL files under `{bench}/model_judgment/{judge}/` stay the
+source of truth. `JudgmentStore.sync` mirrors their verdicts into
+`{bench}/store/judge={judge}/judgments/model={model}/part-*.parquet`, reading
+only the bytes appended since the last sync (a file that shrank or was
+rewritten is re-read from the start).
+
+`JudgmentStore.battles` featurizes only judgment rows it has not seen before,
+under one directory per battle setting (first game only, weight, baseline,
+style control). With style control a model's battles are rebuilt when its
+answer file, or the baseline's, changes. The coefficients of the last fit are
+kept per setting so the next leaderboard can start from them.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from arena_hard_utils import battles_from_judgments, style_metadata_frame
+from fastchat.llm_judge.answer_store import iter_jsonl
+
+HEAD_BYTES = 1024
+STYLE_COLUMNS = [
+    "sum_assistant_a_tokens",
+    "sum_assistant_b_tokens",
+    "header_count_a",
+    "header_count_b",
+    "list_count_a",
+    "list_count_b",
+    "bold_count_a",
+    "bold_count_b",
+]
+
+
+def file_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_json_file(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_parts(directory, columns=None):
+    if not os.path.isdir(directory):
+        return None
+    parts = sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+    if not parts:
+        return None
+    return pd.concat([pd.read_parquet(os.path.join(directory, name), columns=columns) for name in parts], ignore_index=True)
+
+
+def append_part(directory, df):
+    os.makedirs(directory, exist_ok=True)
+    index = sum(name.endswith(".parquet") for name in os.listdir(directory))
+    df.to_parquet(os.path.join(directory, f"part-{index:05d}.parquet"), index=False)
+
+
+def read_appended_lines(path, offset):
+    """Records in complete lines after byte `offset`, and the offset just past them."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"Skipping malformed line in {path}")
+    return records, offset + end
+
+
+def file_head(path, size):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def judgment_rows(records, model, judge):
+    def score(record, game_idx):
+        games = record.get("games") or []
+        return games[game_idx].get("score") if game_idx < len(games) else None
+
+    return pd.DataFrame({
+        "question_id": [str(record["question_id"]) for record in records],
+        "model": model,
+        "judge": judge,
+        "score_1": pd.Series([score(record, 0) for record in records], dtype=object),
+        "score_2": pd.Series([score(record, 1) for record in records], dtype=object),
+    })
+
+
+class JudgmentStore:
+    def __init__(self, bench_name, judge_name, root=None):
+        self.bench_name = bench_name
+        self.judge_name = judge_name
+        self.judgment_dir = os.path.join(bench_name, "model_judgment", judge_name)
+        self.answer_dir = os.path.join(bench_name, "model_answer")
+        self.root = root or os.path.join(bench_name, "store", f"judge={judge_name}")
+        self.manifest_path = os.path.join(self.root, "judgments", "manifest.json")
+
+    def _model_dir(self, *parts):
+        return os.path.join(self.root, *parts[:-1], f"model={parts[-1]}")
+
+    def manifest(self):
+        return read_json_file(self.manifest_path, {})
+
+    def sync(self):
+        """Mirror judgments appended to the JSONL files since the last sync; returns model -> new rows."""
+        manifest = self.manifest()
+        files = {}
+        if os.path.isdir(self.judgment_dir):
+            files = {name[:-len(".jsonl")]: os.path.join(self.judgment_dir, name)
+                     for name in sorted(os.listdir(self.judgment_dir)) if name.endswith(".jsonl")}
+
+        added = {}
+        for model in [m for m in manifest if m not in files]:
+            shutil.rmtree(self._model_dir("judgments", model), ignore_errors=True)
+            del manifest[model]
+        for model, path in files.items():
+            entry = manifest.get(model, {"offset": 0, "rows": 0, "head": None, "generation": 0})
+            size = os.path.getsize(path)
+            if size < entry["offset"] or (entry["head"] is not None and file_head(path, min(entry["offset"], HEAD_BYTES)) != entry["head"]):
+                print(f"{path} was rewritten, re-reading it")
+                shutil.rmtree(self._model_dir("judgments", model), ignore_errors=True)
+                # a new generation tells the battle store to re-featurize the model from scratch
+                entry = {"offset": 0, "rows": 0, "head": None, "generation": entry["generation"] + 1}
+            if size > entry["offset"]:
+                records, offset = read_appended_lines(path, entry["offset"])
+                if records:
+                    append_part(self._model_dir("judgments", model), judgment_rows(records, model, self.judge_name))
+                entry = dict(entry, offset=offset, rows=entry["rows"] + len(records),
+                             head=file_head(path, min(offset, HEAD_BYTES)))
+                added[model] = len(records)
+            manifest[model] = entry
+        write_json_file(self.manifest_path, manifest)
+        return added
+
+    def judgments(self, model, start=0):
+        rows = read_parts(self._model_dir("judgments", model))
+        if rows is None:
+            return judgment_rows([], model, self.judge_name)
+        return rows.iloc[start:].reset_index(drop=True)
+
+    def _style_metadata(self, model):
+        answers = list(iter_jsonl(os.path.join(self.answer_dir, f"{model}.jsonl"), ["conv_metadata"]))
+        assert all("conv_metadata" in a for a in answers), "You must have conv_metadata attributes in your model answer to apply style contro. Please pull newest data if needed."
+        return style_metadata_frame(model, [str(a["question_id"]) for a in answers], [a["conv_metadata"] for a in answers])
+
+    def _featurize(self, judgments, settings, metadata):
+        judgments = judgments.assign(games=[
+            [{"score": s1}, {"score": s2}] for s1, s2 in zip(judgments["score_1"], judgments["score_2"])
+        ])
+        battles = battles_from_judgments(
+            judgments, settings["first_game_only"], settings["multiplier"], settings["baseline_model"], metadata
+        )
+        if metadata is None:
+            return battles
+        # counts kept per markdown element are summed, as construct_style_matrices does
+        style = pd.DataFrame(
+            [[m[c] if type(m[c]) is int else sum(m[c].values()) for c in STYLE_COLUMNS] for m in battles.pop("conv_metadata")],
+            columns=STYLE_COLUMNS, index=battles.index,
+        )
+        return pd.concat([battles, style], axis=1)
+
+    def battles(self, first_game_only=False, multiplier=1, baseline_model="gpt-4-0314", style_control=False):
+        """Battles for these settings, featurizing only judgments added since the last call."""
+        settings = {
+            "first_game_only": bool(first_game_only),
+            "multiplier": int(multiplier),
+            "baseline_model": baseline_model,
+            "style_control": bool(style_control),
+        }
+        key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        battle_root = os.path.join(self.root, "battles", key)
+        manifest_path = os.path.join(battle_root, "manifest.json")
+        manifest = read_json_file(manifest_path, {"settings": settings, "models": {}})
+        judgments_manifest = self.manifest()
+        baseline_answers = file_fingerprint(os.path.join(self.answer_dir, f"{baseline_model}.jsonl"))
+
+        featurized = 0
+        baseline_metadata = None
+        for model in [m for m in manifest["models"] if m not in judgments_manifest]:
+            shutil.rmtree(self._model_dir("battles", key, model), ignore_errors=True)
+            del manifest["models"][model]
+        for model, source in judgments_manifest.items():
+            entry = manifest["models"].get(model, {"rows": 0})
+            answers = [file_fingerprint(os.path.join(self.answer_dir, f"{model}.jsonl")), baseline_answers] if style_control else None
+            if entry.get("generation") != source["generation"] or entry.get("answers") != answers:
+                shutil.rmtree(self._model_dir("battles", key, model), ignore_errors=True)
+                entry = {"rows": 0}
+            if entry["rows"] < source["rows"]:
+                judgments = self.judgments(model, entry["rows"])
+                metadata = None
+                if style_control:
+                    if baseline_metadata is None:
+                        baseline_metadata = self._style_metadata(baseline_model)
+                    metadata = pd.concat([baseline_metadata, self._style_metadata(model)], ignore_index=True)
+                battles = self._featurize(judgments, settings, metadata)
+                if len(battles):
+                    append_part(self._model_dir("battles", key, model), battles)
+                featurized += len(judgments)
+            manifest["models"][model] = {"rows": source["rows"], "generation": source["generation"], "answers": answers}
+        write_json_file(manifest_path, manifest)
+        print(f"Featurized {featurized} new judgments")
+
+        frames = [read_parts(self._model_dir("battles", key, model)) for model in sorted(manifest["models"])]
+        frames = [frame for frame in frames if frame is not None]
+        columns = ["question_id", "model_a", "model_b", "winner"] + (STYLE_COLUMNS if style_control else [])
+        battles = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        if style_control:
+            style = battles[STYLE_COLUMNS].to_numpy().tolist()
+            battles = battles.drop(columns=STYLE_COLUMNS)
+            battles["conv_metadata"] = [dict(zip(STYLE_COLUMNS, values)) for values in style]
+        return battles, key
+
+    def _ratings_path(self, key, mode):
+        return os.path.join(self.root, "ratings", f"{key}-{mode}.json")
+
+    def previous_coefficients(self, key, mode, models):
+        """The last fit's coefficients in `models` order (0 for models it did not have), or None."""
+        saved = read_json_file(self._ratings_path(key, mode), None)
+        if saved is None:
+            return None
+        init = np.array([saved["models"].get(model, 0.0) for model in models.index], dtype=float)
+        return init, np.asarray(saved.get("style", []), dtype=float)
+
+    def save_coefficients(self, key, mode, models, theta):
+        p = len(models.index)
+        write_json_file(self._ratings_path(key, mode), {
+            "models": dict(zip(models.index, theta[:p].tolist())),
+            "style": theta[p:].tolist(),
+        })
@@ -4,9 +4,13 @@ import time
 import yaml
 import random
 import requests
+import numpy as np
+import pandas as pd
 
 from typing import Optional
-from glob import glob
+
+from colm_clients import client_from_api_dict
+from fastchat.llm_judge.answer_store import ModelAnswers
 
 # API setting constants
 API_MAX_RETRY = 16
@@ -30,6 +34,29 @@ OPENAI_MODEL_LIST = (
 )
 
 
+# verdict -> (winner, strong) for game 1; game 2 has the positions swapped
+GAME_1_VERDICTS = {
+    "A=B": ("tie", False),
+    "A>B": ("model_a", False),
+    "A>>B": ("model_a", True),
+    "B>A": ("model_b", False),
+    "B>>A": ("model_b", True),
+}
+GAME_2_VERDICTS = {
+    "A=B": ("tie", False),
+    "A>B": ("model_b", False),
+    "A>>B": ("model_b", True),
+    "B>A": ("model_a", False),
+    "B>>A": ("model_a", True),
+}
+STYLE_METADATA = {
+    "sum_assistant_{}_tokens": "token_len",
+    "header_count_{}": "header_count",
+    "list_count_{}": "list_count",
+    "bold_count_{}": "bold_count",
+}
+
+
 temperature_config = {
     "writing": 0.7,
     "roleplay": 0.7,
@@ -52,26 +79,16 @@ def load_questions(question_file: str):
     return questions
 
 
-def load_model_answers(answer_dir: str):
+def load_model_answers(answer_dir: str, fields: Optional[list] = None):
     """Load model answers.
 
-    The return value is a python dict of type:
+    The return value is a lazy mapping of type:
     Dict[model_name: str -> Dict[question_id: int -> answer: dict]]
-    """
-    filenames = glob(os.path.join(answer_dir, "*.jsonl"))
-    filenames.sort()
-    model_answers = {}
-
-    for filename in filenames:
-        model_name = os.path.basename(filename)[:-6]
-        answer = {}
-        with open(filename, 'r', encoding='utf-8') as fin:
-            for line in fin:
-                line = json.loads(line)
-                answer[line["question_id"]] = line
-        model_answers[model_name] = answer
 
-    return model_answers
+    Answers are read on access through a byte-offset index kept next to each
+    file. With `fields` (e.g. ["conv_metadata"]), only those are kept.
+    """
+    return ModelAnswers(answer_dir, fields)
 
 
 def get_endpoint(endpoint_list):
@@ -96,13 +113,7 @@ def make_config(config_file: str) -> dict:
 
 def chat_completion_openai(model, messages, temperature, max_tokens, api_dict=None):
     import openai
-    if api_dict:
-        client = openai.OpenAI(
-            base_url=api_dict["api_base"],
-            api_key=api_dict["api_key"],
-        )
-    else:
-        client = openai.OpenAI()
+    client = client_from_api_dict("openai", api_dict)
     
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
@@ -130,16 +141,8 @@ def chat_completion_openai(model, messages, temperature, max_tokens, api_dict=No
 
 def chat_completion_openai_azure(model, messages, temperature, max_tokens, api_dict=None):
     import openai
-    from openai import AzureOpenAI
 
-    api_base = api_dict["api_base"]
-    client = AzureOpenAI(
-        azure_endpoint = api_base,
-        api_key= api_dict["api_key"],
-        api_version=api_dict["api_version"],
-        timeout=240,
-        max_retries=2
-    )
+    client = client_from_api_dict("azure", api_dict)
 
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
@@ -170,10 +173,7 @@ def chat_completion_openai_azure(model, messages, temperature, max_tokens, api_d
 def chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict=None):
     import anthropic
 
-    if api_dict:
-        api_key = api_dict["api_key"]
-    else:
-        api_key = os.environ["ANTHROPIC_API_KEY"]
+    c = client_from_api_dict("anthropic", api_dict)
 
     sys_msg = ""
     if messages[0]["role"] == "system":
@@ -183,7 +183,6 @@ def chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
         try:
-            c = anthropic.Anthropic(api_key=api_key)
             response = c.messages.create(
                 model=model,
                 messages=messages,
@@ -306,3 +305,54 @@ def reorg_answer_file(answer_file):
     with open(answer_file, "w") as fout:
         for qid in qids:
             fout.write(answers[qid])
+
+
+def style_metadata_frame(model, question_ids, conv_metadata):
+    frame = pd.DataFrame({field: [m[field] for m in conv_metadata] for field in STYLE_METADATA.values()})
+    frame.insert(0, "question_id", list(question_ids))
+    frame.insert(0, "model", model)
+    # later answers to the same question win, as with the dict lookups this replaces
+    return frame.drop_duplicates(["model", "question_id"], keep="last")
+
+
+def battles_from_judgments(judgments, first_game_only=False, multiplier=1, baseline_model="gpt-4-0314", metadata=None):
+    """Vectorized equivalent of applying `get_battles_from_row` (benchmark_battles.py) to every judgment.
+
+    Verdicts are mapped through lookup tables, strong verdicts are expanded by
+    repeating rows `multiplier` times, and style metadata (`style_metadata_frame`
+    rows for every model) is joined on (model, question_id).
+    """
+    games = judgments["games"].tolist()
+    order = np.arange(len(games))
+    frames = []
+    for game_idx, verdicts in enumerate([GAME_1_VERDICTS] if first_game_only else [GAME_1_VERDICTS, GAME_2_VERDICTS]):
+        scores = pd.Series([g[game_idx]["score"] for g in games], dtype=object)
+        frames.append(pd.DataFrame({
+            "row": order,
+            "game": game_idx,
+            "question_id": judgments["question_id"].to_numpy(),
+            "model_a": baseline_model,
+            "model_b": judgments["model"].to_numpy(),
+            "winner": scores.map({score: winner for score, (winner, _) in verdicts.items()}).to_numpy(),
+            "strong": scores.map({score: strong for score, (_, strong) in verdicts.items()}).to_numpy(),
+        }))
+    battles = pd.concat(frames, ignore_index=True)
+    battles = battles[battles["winner"].notna()].sort_values(["row", "game"], kind="stable")
+
+    if metadata is not None:
+        conv_metadata = pd.DataFrame({"question_id": battles["question_id"].to_numpy()})
+        for side, model_column in (("a", "model_a"), ("b", "model_b")):
+            side_metadata = battles[[model_column, "question_id"]].rename(columns={model_column: "model"}).merge(
+                metadata, on=["model", "question_id"], how="left", validate="many_to_one"
+            )
+            if side_metadata["token_len"].isna().any():
+                missing = side_metadata[side_metadata["token_len"].isna()].iloc[0]
+                raise KeyError(f"no conv_metadata for {missing['model']} on question {missing['question_id']}")
+            for column, field in STYLE_METADATA.items():
+                conv_metadata[column.format(side)] = side_metadata[field].to_numpy()
+        columns = [column.format(side) for column in STYLE_METADATA for side in ("a", "b")]
+        battles["conv_metadata"] = [dict(zip(columns, values)) for values in zip(*(conv_metadata[c] for c in columns))]
+
+    repeats = np.where(battles["strong"].to_numpy(dtype=bool), multiplier, 1)
+    battles = battles.loc[battles.index.repeat(repeats)].drop(columns=["row", "game", "strong"])
+    return battles.reset_index(drop=True)
@@ -2,10 +2,16 @@ import pandas as pd
 import numpy as np
 import math
 import inspect
+import functools
+import os
 
 from tqdm import tqdm
+from scipy import sparse
+from scipy.optimize import minimize
+from scipy.special import expit
 from sklearn.linear_model import LogisticRegression
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 np.random.seed(42)
 
@@ -72,14 +78,116 @@ def compute_mle_elo(df, SCALE=400, BASE=10, INIT_RATING=1000, baseline_model="gp
 def get_bootstrap_result(battles, func_compute_elo, num_round, baseline_model="gpt-4-0314"):
     rows = []
     kwargs = {}
-    if baseline_model in inspect.signature(func_compute_elo).parameters:
-        kwargs[baseline_model] = baseline_model
+    if "baseline_model" in inspect.signature(func_compute_elo).parameters:
+        kwargs["baseline_model"] = baseline_model
     for _ in tqdm(range(num_round), desc="bootstrap"):
         rows.append(func_compute_elo(battles.sample(frac=1.0, replace=True), **kwargs))
     df = pd.DataFrame(rows)
     return df[df.median().sort_values(ascending=False).index]
 
 
+def aggregate_battles(df):
+    """Collapse battles into unique (model_a, model_b, outcome) cells.
+
+    `wins` is how many of the two duplicated rows `compute_mle_elo` labels as an
+    A win: 2 for model_a, 1 for a tie, 0 otherwise.
+    """
+    models = pd.concat([df["model_a"], df["model_b"]]).unique()
+    models = pd.Series(np.arange(len(models)), index=models)
+
+    is_tie = (df["winner"] == "tie") | (df["winner"] == "tie (bothbad)")
+    wins = np.where(df["winner"] == "model_a", 2, np.where(is_tie, 1, 0))
+    cells = pd.DataFrame({
+        "model_a": models[df["model_a"]].to_numpy(),
+        "model_b": models[df["model_b"]].to_numpy(),
+        "wins": wins,
+    }).value_counts(sort=False).reset_index(name="count")
+    return cells, models
+
+
+def fit_bt_weighted(cells, weights, p, init=None, BASE=10):
+    """Bradley-Terry coefficients for `cells` weighted by `weights` battles each.
+
+    Minimizes the same log loss as `compute_mle_elo` with L-BFGS. Starting from
+    zero, or from a previous fit, the coefficients stay centered the way
+    sklearn's are, so anchored ratings agree.
+    """
+    a = cells["model_a"].to_numpy()
+    b = cells["model_b"].to_numpy()
+    wins = cells["wins"].to_numpy()
+    pos = weights * wins
+    neg = weights * (2 - wins)
+    total = pos.sum() + neg.sum()
+    log_base = math.log(BASE)
+
+    def loss(theta):
+        d = log_base * (theta[a] - theta[b])
+        value = (pos @ np.logaddexp(0, -d) + neg @ np.logaddexp(0, d)) / total
+        g = log_base * (neg - (pos + neg) * expit(-d)) / total
+        return value, np.bincount(a, g, minlength=p) - np.bincount(b, g, minlength=p)
+
+    x0 = np.zeros(p) if init is None else np.asarray(init, dtype=float)
+    result = minimize(loss, x0, jac=True, method="L-BFGS-B", options={"maxiter": 1000, "ftol": 1e-15, "gtol": 1e-10})
+    return result.x
+
+
+def anchored_elo(theta, models, SCALE=400, INIT_RATING=1000, baseline_model="gpt-4-0314"):
+    elo_scores = SCALE * theta + INIT_RATING
+    if baseline_model in models.index:
+        elo_scores += 1000 - elo_scores[models[baseline_model]]
+    return pd.Series(elo_scores, index=models.index).sort_values(ascending=False)
+
+
+def _bootstrap_bt_rounds(cells, counts, init, models, baseline_model, SCALE=400, INIT_RATING=1000):
+    a = cells["model_a"].to_numpy()
+    b = cells["model_b"].to_numpy()
+    anchor = models.get(baseline_model)
+    elos = np.full((len(counts), len(models)), np.nan)
+    for i, weights in enumerate(counts):
+        present = np.zeros(len(models), dtype=bool)
+        present[a[weights > 0]] = True
+        present[b[weights > 0]] = True
+        theta = fit_bt_weighted(cells, weights, len(models), init)
+        # models that drew no battles are left out, as when refitting on a resampled frame
+        elo_scores = SCALE * (theta - theta[present].mean()) + INIT_RATING
+        if anchor is not None:
+            elo_scores += 1000 - elo_scores[anchor]
+        elos[i, present] = elo_scores[present]
+    return elos
+
+
+def bootstrap_counts(cells, num_round, seed=42):
+    """Multinomial battle counts per cell, one row per round; the same as resampling battles."""
+    counts = cells["count"].to_numpy()
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(counts.sum(), counts / counts.sum(), size=num_round)
+
+
+def run_bootstrap_rounds(worker, rounds, args, workers=None, combine=np.concatenate):
+    """Split `rounds` across processes and `combine` what `worker(args[0], chunk, *args[1:])` returns per chunk."""
+    workers = min(workers or os.cpu_count() or 1, len(rounds))
+    if workers <= 1:
+        return combine([worker(args[0], rounds, *args[1:])])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker, args[0], chunk, *args[1:]) for chunk in np.array_split(rounds, workers)]
+        return combine([future.result() for future in tqdm(futures, desc="bootstrap")])
+
+
+def get_bootstrap_result_weighted(battles, num_round, baseline_model="gpt-4-0314", workers=None, seed=42, init=None):
+    """`get_bootstrap_result` with `compute_mle_elo`, without resampling the battles frame.
+
+    Battles are aggregated once, each round draws multinomial counts as sample
+    weights, and the fit is warm-started from the full-data coefficients (which
+    are themselves fitted starting from `init`, if given).
+    """
+    cells, models = aggregate_battles(battles)
+    init = fit_bt_weighted(cells, cells["count"].to_numpy(), len(models), init)
+    counts = bootstrap_counts(cells, num_round, seed)
+    elos = run_bootstrap_rounds(_bootstrap_bt_rounds, counts, (cells, init, models, baseline_model), workers)
+    df = pd.DataFrame(elos, columns=models.index)
+    return df[df.median().sort_values(ascending=False).index]
+
+
 def preety_print_two_ratings(ratings_1, ratings_2, column_names):
     df = pd.DataFrame([
         [n, ratings_1[n], ratings_2[n]] for n in ratings_1.keys()
@@ -135,39 +243,36 @@ def fit_bt(X, Y, models, SCALE=400, INIT_RATING=1000, baseline_model="gpt-4-0314
     )
     
     
-def construct_style_matrices(
-    df,
-    BASE=10,
-    apply_ratio=[1, 1, 1, 1],
-    style_elements=STYLE_CONTROL_ELEMENTS,
-    add_one=True,
-):
-    models = pd.concat([df["model_a"], df["model_b"]]).unique()
-    models = pd.Series(np.arange(len(models)), index=models)
+# style feature sets kept by `style_features` (one per mode and answer set in a typical run)
+STYLE_FEATURES_CACHE_SIZE = 8
 
-    # duplicate battles
-    df = pd.concat([df, df], ignore_index=True)
-    p = len(models.index)
-    n = df.shape[0]
-    assert len(style_elements) % 2 == 0
-    k = int(len(style_elements) / 2)
-
-    X = np.zeros([n, p + k])
-    X[np.arange(n), models[df["model_a"]]] = +math.log(BASE)
-    X[np.arange(n), models[df["model_b"]]] = -math.log(BASE)
 
-    # creates turn each of the specified column in "conv_metadata" into a vector
-    style_vector = np.array(
+def style_values(df, style_elements=STYLE_CONTROL_ELEMENTS):
+    """Raw style counts, one row per element of `style_elements` and one column per battle."""
+    # turns each of the specified columns in "conv_metadata" into a vector
+    return np.array(
         [
-            df.conv_metadata.map(
-                lambda x: x[element]
-                if type(x[element]) is int
-                else sum(x[element].values())
-            ).tolist()
+            [x[element] if type(x[element]) is int else sum(x[element].values()) for x in df.conv_metadata]
             for element in style_elements
         ]
+    ).reshape(len(style_elements), len(df))
+
+
+def style_features(df, apply_ratio=[1, 1, 1, 1], style_elements=STYLE_CONTROL_ELEMENTS, add_one=True):
+    """Normalized style differences, one row per battle, memoized per style values and options."""
+    assert len(style_elements) % 2 == 0
+    style_vector = style_values(df, style_elements)
+    # keyed on the values, not the battles: the same battles with new answer metadata get new features
+    return _style_features(
+        style_vector.tobytes(), style_vector.dtype.str, style_vector.shape, tuple(apply_ratio), add_one
     )
 
+
+@functools.lru_cache(maxsize=STYLE_FEATURES_CACHE_SIZE)
+def _style_features(values, dtype, shape, apply_ratio, add_one):
+    style_vector = np.frombuffer(values, dtype=dtype).reshape(shape)
+    k = int(shape[0] / 2)
+
     style_diff = (style_vector[:k] - style_vector[k:]).astype(float)
     style_sum = (style_vector[:k] + style_vector[k:]).astype(float)
 
@@ -183,49 +288,147 @@ def construct_style_matrices(
     style_mean = np.mean(style_diff, axis=1)
     style_std = np.std(style_diff, axis=1)
 
-    X[:, -k:] = ((style_diff - style_mean[:, np.newaxis]) / style_std[:, np.newaxis]).T
+    return ((style_diff - style_mean[:, np.newaxis]) / style_std[:, np.newaxis]).T
+
+
+def construct_style_matrices(
+    df,
+    BASE=10,
+    apply_ratio=[1, 1, 1, 1],
+    style_elements=STYLE_CONTROL_ELEMENTS,
+    add_one=True,
+):
+    """Design matrix (sparse model indicators followed by dense style features), labels and model index.
+
+    Rows are the battles followed by the same battles again, as in `compute_mle_elo`.
+    """
+    models = pd.concat([df["model_a"], df["model_b"]]).unique()
+    models = pd.Series(np.arange(len(models)), index=models)
+
+    p = len(models.index)
+    n = df.shape[0]
+    features = style_features(df, apply_ratio, style_elements, add_one)
+
+    # duplicate battles
+    rows = np.tile(np.arange(n), 2)
+    indicators = sparse.csr_matrix(
+        (
+            np.repeat([+math.log(BASE), -math.log(BASE)], 2 * n),
+            (np.tile(np.arange(2 * n), 2), np.concatenate([np.tile(models[df["model_a"]].to_numpy(), 2),
+                                                           np.tile(models[df["model_b"]].to_numpy(), 2)])),
+        ),
+        shape=(2 * n, p),
+    )
+    X = sparse.hstack([indicators, sparse.csr_matrix(features[rows])], format="csr")
 
     # one A win => two A win
-    Y = np.zeros(n)
-    Y[df["winner"] == "model_a"] = 1.0
+    Y = np.zeros(2 * n)
+    Y[np.tile(df["winner"].to_numpy() == "model_a", 2)] = 1.0
 
     # one tie => one A win + one B win
     # find tie + tie (both bad) index
-    tie_idx = (df["winner"] == "tie") | (df["winner"] == "tie (bothbad)")
-    tie_idx[len(tie_idx) // 2 :] = False
-    Y[tie_idx] = 1.0
+    tie_idx = ((df["winner"] == "tie") | (df["winner"] == "tie (bothbad)")).to_numpy()
+    Y[:n][tie_idx] = 1.0
 
     return X, Y, models
 
 
-def get_bootstrap_result_style_control(X, Y, battles, models, func_compute_elo, num_round=1000, baseline_model="gpt-4-0314"):
-    elos = []
+def fit_bt_style_weighted(X, pos, neg, init=None, C=1.0):
+    """Coefficients minimizing `fit_bt`'s L2-regularized log loss, with rows of `X` counted
+    `pos` times as an A win and `neg` times as a B win."""
+    total = pos.sum() + neg.sum()
+    trials = pos + neg
+    XT = X.T.tocsr()
+
+    def loss(theta):
+        d = X @ theta
+        # pos * log(1 + e^-d) + neg * log(1 + e^d) == trials * log(1 + e^-d) + neg * d
+        value = trials @ np.logaddexp(0, -d) + neg @ d + 0.5 * theta @ theta / C
+        g = neg - trials * expit(-d)
+        return value / total, (XT @ g + theta / C) / total
+
+    x0 = np.zeros(X.shape[1]) if init is None else np.asarray(init, dtype=float)
+    result = minimize(loss, x0, jac=True, method="L-BFGS-B", options={"maxiter": 1000, "ftol": 1e-15, "gtol": 1e-10})
+    return result.x
+
+
+def _bootstrap_style_rounds(X, round_ids, groups, pos, neg, init, p, anchor, seed, SCALE=400, INIT_RATING=1000):
+    n = len(groups)
+    indicators = X[:, :p]
+    elos = np.full((len(round_ids), p), np.nan)
     coefs = []
+    for i, round_id in enumerate(round_ids):
+        rng = np.random.default_rng([seed, round_id])
+        # bincount of a uniform draw with replacement = multinomial counts per battle
+        weights = np.bincount(rng.integers(0, n, n), minlength=n)
+        group_pos = np.bincount(groups, weights * pos, minlength=X.shape[0])
+        group_neg = np.bincount(groups, weights * neg, minlength=X.shape[0])
+        theta = fit_bt_style_weighted(X, group_pos, group_neg, init)
+        present = np.bincount(indicators[group_pos + group_neg > 0].indices, minlength=p) > 0
+
+        elo_scores = SCALE * theta[:p] + INIT_RATING
+        elo_scores += 1114 - elo_scores[anchor]
+        elos[i, present] = elo_scores[present]
+        coefs.append(theta[p:])
+    return elos, coefs
+
+
+def _combine_style_rounds(chunks):
+    return np.concatenate([elos for elos, _ in chunks]), [coef for _, coefs in chunks for coef in coefs]
+
+
+def unique_battle_rows(X, Y, p):
+    """Distinct battle rows of a `construct_style_matrices` design (the same question and models).
+
+    Returns those rows, the row of every battle, and how many of each battle's
+    two duplicated rows are labelled as an A win and a B win.
+    """
     assert X.shape[0] % 2 == 0 and X.shape[0] == Y.shape[0]
     k = int(
         X.shape[0] / 2
-    )  # Since we duplicate the battles when constructing X and Y, we don't want to sample the duplicates
+    )  # Since we duplicate the battles when constructing X and Y, we only keep one copy and count its labels
+    pos = Y[:k] + Y[k:]
+    neg = 2 - pos
 
-    battles_tie_idx = (battles["winner"] == "tie") | (battles["winner"] == "tie (bothbad)")
-    for _ in tqdm(range(num_round), desc="bootstrap"):
-        indices = np.random.choice(list(range(k)), size=(k), replace=True)
+    indicators = X[:k, :p].tocoo()
+    a, b = np.full(k, -1), np.full(k, -1)
+    a[indicators.row[indicators.data > 0]] = indicators.col[indicators.data > 0]
+    b[indicators.row[indicators.data < 0]] = indicators.col[indicators.data < 0]
+    rows = np.column_stack([a, b, X[:k, p:].toarray()])
+    _, first, groups = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    return X[:k][first], groups.ravel(), pos, neg
 
-        index2tie = np.zeros(k, dtype=bool)
-        index2tie[battles_tie_idx] = True
 
-        nontie_indices = indices[~index2tie[indices]]
-        tie_indices = np.concatenate([indices[index2tie[indices]], indices[index2tie[indices]]+k])
+def fit_bt_warm(X, Y, models, init=None, SCALE=400, INIT_RATING=1000, baseline_model="gpt-4-0314"):
+    """`fit_bt` with the weighted L-BFGS solver, starting from `init` (e.g. the previous leaderboard's coefficients).
 
-        _X = np.concatenate([X[nontie_indices], X[nontie_indices], X[tie_indices]])
-        _Y = np.concatenate([Y[nontie_indices], Y[nontie_indices], Y[tie_indices]])
+    Returns the ratings, the style coefficients and the full coefficient vector.
+    """
+    assert baseline_model in models.index
+    p = len(models.index)
+    unique_X, groups, pos, neg = unique_battle_rows(X, Y, p)
+    theta = fit_bt_style_weighted(unique_X, np.bincount(groups, pos), np.bincount(groups, neg), init)
 
-        assert _X.shape == X.shape and _Y.shape == Y.shape
+    elo_scores = SCALE * theta[:p] + INIT_RATING
+    elo_scores += 1114 - elo_scores[models[baseline_model]]
+    return pd.Series(elo_scores, index=models.index).sort_values(ascending=False), theta[p:], theta
 
-        states = ~_X[:, : len(models)].any(axis=0)
 
-        elo, coef = func_compute_elo(_X, _Y, models[~states], baseline_model=baseline_model)
-        elos.append(elo)
-        coefs.append(coef)
+def get_bootstrap_result_style_control(X, Y, models, num_round=1000, baseline_model="gpt-4-0314", workers=None, seed=42, init=None):
+    """Bootstrap `fit_bt` by refitting with multinomial battle weights, spread over `workers` processes.
 
-    df = pd.DataFrame(elos)
-    return df[df.median().sort_values(ascending=False).index], coefs
\ No newline at end of file
+    Battles with identical design rows (the same question and models) share
+    one row of the fit, and every round starts from the full-data fit.
+    """
+    assert baseline_model in models.index
+    p = len(models.index)
+    unique_X, groups, pos, neg = unique_battle_rows(X, Y, p)
+
+    init = fit_bt_style_weighted(unique_X, np.bincount(groups, pos), np.bincount(groups, neg), init)
+    elos, coefs = run_bootstrap_rounds(
+        _bootstrap_style_rounds, np.arange(num_round),
+        (unique_X, groups, pos, neg, init, p, models[baseline_model], seed), workers,
+        combine=_combine_style_rounds,
+    )
+    df = pd.DataFrame(elos, columns=models.index)
+    return df[df.median().sort_values(ascending=False).index], coefs
@@ -0,0 +1,182 @@
+"""
+Compare the vectorized battle builder in arena_hard_utils.py with the
+original row-wise `get_battles_from_row`, kept here as the reference
+implementation, on synthetic judgment sets, checking that both produce
+identical battles.
+
+Usage:
+python benchmark_battles.py --rows 100000 200000
+python benchmark_battles.py --rows 100000 --style-control --first-game-only
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from arena_hard_utils import battles_from_judgments, style_metadata_frame
+
+SCORES = ["A>>B", "A>B", "A=B", "B>A", "B>>A", None]
+SCORE_WEIGHTS = [0.15, 0.25, 0.2, 0.2, 0.15, 0.05]
+
+
+def synthetic_judgments(rows, num_models=50, baseline_model="gpt-4-0314", seed=0):
+    """`rows` judgments spread over `num_models` models, plus conv_metadata for every answer."""
+    rng = np.random.default_rng(seed)
+    models = [f"model-{i}" for i in range(num_models)]
+    num_questions = -(-rows // num_models)
+    question_ids = [f"q{i:06d}" for i in range(num_questions)]
+    pairs = [(model, qid) for model in models for qid in question_ids][:rows]
+    scores = rng.choice(len(SCORES), size=(len(pairs), 2), p=SCORE_WEIGHTS)
+    judgments = pd.DataFrame({
+        "question_id": [qid for _, qid in pairs],
+        "model": [model for model, _ in pairs],
+        "judge": "gpt-4o",
+        "games": [[{"score": SCORES[a]}, {"score": SCORES[b]}] for a, b in scores],
+    })
+
+    metadata = {}
+    for model in [baseline_model, *models]:
+        counts = rng.integers(0, 20, size=(num_questions, 6))
+        metadata[model] = {
+            qid: {"conv_metadata": {
+                "token_len": int(rng.integers(50, 2000)),
+                "header_count": {"h1": int(c[0]), "h2": int(c[1])},
+                "list_count": {"ordered": int(c[2]), "unordered": int(c[3])},
+                "bold_count": {"**": int(c[4]), "__": int(c[5])},
+            }}
+            for qid, c in zip(question_ids, counts)
+        }
+    return judgments, metadata
+
+
+def get_battles_from_row(row, first_game_only, multiplier, baseline_model, metadata=None):
+    results = []
+    output = {"question_id": row["question_id"],
+              "model_a": baseline_model,
+              "model_b": row["model"]}
+    
+    game = row["games"][0]
+    weight = 1
+    if game["score"] == "A=B":
+        output["winner"] = "tie"
+    elif game["score"] == "A>B":
+        output["winner"] = "model_a"
+    elif game["score"] == "A>>B":
+        output["winner"] = "model_a"
+        weight = multiplier
+    elif game["score"] == "B>A":
+        output["winner"] = "model_b"
+    elif game["score"] == "B>>A":
+        output["winner"] = "model_b"
+        weight = multiplier
+    else:
+        weight = 0
+    
+    # add conv_metadata for style control
+    if metadata:
+        output["conv_metadata"] = {
+            "sum_assistant_a_tokens": metadata[baseline_model][row["question_id"]]["conv_metadata"]["token_len"],
+            "sum_assistant_b_tokens": metadata[row["model"]][row["question_id"]]["conv_metadata"]["token_len"],
+            "header_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["header_count"],
+            "header_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["header_count"],
+            "list_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["list_count"],
+            "list_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["list_count"],
+            "bold_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["bold_count"],
+            "bold_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["bold_count"],
+        }
+
+    if weight:
+        results += [output] * weight
+        
+    if first_game_only:
+        return results
+    
+    # game 2
+    output = {"question_id": row["question_id"],
+            "model_a": baseline_model,
+            "model_b": row["model"]}
+
+    game = row["games"][1]
+
+    weight = 1
+    if game["score"] == "A=B":
+        output["winner"] = "tie"
+    elif game["score"] == "A>B":
+        output["winner"] = "model_b"
+    elif game["score"] == "A>>B":
+        output["winner"] = "model_b"
+        weight = multiplier
+    elif game["score"] == "B>A":
+        output["winner"] = "model_a"
+    elif game["score"] == "B>>A":
+        output["winner"] = "model_a"
+        weight = multiplier
+    else:
+        weight = 0
+    
+    if metadata:
+        output["conv_metadata"] = {
+            "sum_assistant_a_tokens": metadata[baseline_model][row["question_id"]]["conv_metadata"]["token_len"],
+            "sum_assistant_b_tokens": metadata[row["model"]][row["question_id"]]["conv_metadata"]["token_len"],
+            "header_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["header_count"],
+            "header_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["header_count"],
+            "list_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["list_count"],
+            "list_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["list_count"],
+            "bold_count_a": metadata[baseline_model][row["question_id"]]["conv_metadata"]["bold_count"],
+            "bold_count_b": metadata[row["model"]][row["question_id"]]["conv_metadata"]["bold_count"],
+        }
+
+    if weight:
+        results += [output] * weight
+    
+    return results
+
+
+def rowwise_battles(judgments, first_game_only, multiplier, baseline_model, metadata):
+    battles = judgments.apply(lambda row: get_battles_from_row(row, first_game_only, multiplier, baseline_model, metadata), axis=1)
+    return pd.DataFrame(battles[battles.map(len) > 0].explode().tolist())
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    parser.add_argument("--models", type=int, default=50)
+    parser.add_argument("--weight", type=int, default=3)
+    parser.add_argument("--baseline", type=str, default="gpt-4-0314")
+    parser.add_argument("--first-game-only", action="store_true")
+    parser.add_argument("--style-control", action="store_true")
+    parser.add_argument("--skip-rowwise", action="store_true", help="Only time the vectorized builder.")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        judgments, metadata = synthetic_judgments(rows, args.models, args.baseline)
+        metadata_frame = None
+        if args.style_control:
+            metadata_frame = pd.concat([
+                style_metadata_frame(model, list(answers), [a["conv_metadata"] for a in answers.values()])
+                for model, answers in metadata.items()
+            ], ignore_index=True)
+
+        battles, vectorized_time = timed(lambda: battles_from_judgments(
+            judgments, args.first_game_only, args.weight, args.baseline, metadata_frame
+        ))
+        result = {"rows": rows, "battles": len(battles), "vectorized_s": round(vectorized_time, 3)}
+
+        if not args.skip_rowwise:
+            expected, rowwise_time = timed(lambda: rowwise_battles(
+                judgments, args.first_game_only, args.weight, args.baseline, metadata if args.style_control else None
+            ))
+            pd.testing.assert_frame_equal(battles, expected)
+            result.update({"rowwise_s": round(rowwise_time, 3), "speedup": round(rowwise_time / vectorized_time, 1),
+                           "identical": True})
+        results.append(result)
+        print(json.dumps(result))
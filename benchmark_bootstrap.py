@@ -0,0 +1,135 @@
+"""
+Compare the weighted bootstraps in arena_hard_utils_math.py with resampling
+battles and refitting with sklearn, on synthetic judgments from
+benchmark_battles.py.
+
+Usage:
+python benchmark_bootstrap.py --rows 100000 --rounds 1000 --reference-rounds 20
+python benchmark_bootstrap.py --rows 100000 --rounds 1000 --style-control
+"""
+import argparse
+import json
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from arena_hard_utils import battles_from_judgments, style_metadata_frame
+from arena_hard_utils_math import (
+    aggregate_battles,
+    anchored_elo,
+    compute_mle_elo,
+    construct_style_matrices,
+    fit_bt,
+    fit_bt_weighted,
+    get_bootstrap_result,
+    get_bootstrap_result_style_control,
+    get_bootstrap_result_weighted,
+)
+from benchmark_battles import synthetic_judgments
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def resampling_style_bootstrap(X, Y, models, num_round, baseline_model):
+    """Resample battle rows of the dense design and refit with sklearn each round."""
+    X = X.toarray()
+    k = X.shape[0] // 2
+    tie = Y[:k] != Y[k:]
+    elos = []
+    for _ in range(num_round):
+        indices = np.random.choice(k, size=k, replace=True)
+        nontie, ties = indices[~tie[indices]], indices[tie[indices]]
+        rows = np.concatenate([nontie, nontie, ties, ties + k])
+        elos.append(fit_bt(X[rows], Y[rows], models, baseline_model=baseline_model)[0])
+    return pd.DataFrame(elos)
+
+
+def style_control(args, judgments, metadata):
+    metadata_frame = pd.concat([
+        style_metadata_frame(model, list(answers), [a["conv_metadata"] for a in answers.values()])
+        for model, answers in metadata.items()
+    ], ignore_index=True)
+    battles = battles_from_judgments(judgments, multiplier=args.weight, baseline_model=args.baseline, metadata=metadata_frame)
+
+    (X, Y, models), build_time = timed(lambda: construct_style_matrices(battles))
+    _, cached_time = timed(lambda: construct_style_matrices(battles))
+    (expected, style_coef), sklearn_time = timed(lambda: fit_bt(X, Y, models, baseline_model=args.baseline))
+    bootstrap, bootstrap_time = timed(lambda: get_bootstrap_result_style_control(
+        X, Y, models, args.rounds, args.baseline, args.workers
+    ))
+    result = {
+        "battles": len(battles),
+        "construct_s": round(build_time, 3),
+        "construct_cached_s": round(cached_time, 4),
+        "fit_sklearn_s": round(sklearn_time, 3),
+        "style_coef": [round(c, 4) for c in style_coef],
+        "bootstrap_style_coef_mean": [round(c, 4) for c in np.mean(bootstrap[1], axis=0)],
+        "max_median_diff": float((expected - bootstrap[0].median()[expected.index]).abs().max()),
+        f"weighted_{args.rounds}_rounds_s": round(bootstrap_time, 3),
+        "weighted_s_per_round": round(bootstrap_time / args.rounds, 4),
+    }
+    if args.reference_rounds:
+        reference, reference_time = timed(lambda: resampling_style_bootstrap(
+            X, Y, models, args.reference_rounds, args.baseline
+        ))
+        result["resampling_s_per_round"] = round(reference_time / args.reference_rounds, 3)
+        widths = bootstrap[0].quantile(0.975) - bootstrap[0].quantile(0.025)
+        reference_widths = reference.quantile(0.975) - reference.quantile(0.025)
+        result["median_ci_width"] = round(float(np.median(widths)), 2)
+        result["median_ci_width_resampling"] = round(float(np.median(reference_widths)), 2)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--models", type=int, default=50)
+    parser.add_argument("--weight", type=int, default=3)
+    parser.add_argument("--baseline", type=str, default="gpt-4-0314")
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--reference-rounds", type=int, default=20, help="Rounds of the resampling bootstrap to time.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--style-control", action="store_true")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", FutureWarning)
+
+    judgments, metadata = synthetic_judgments(args.rows, args.models, args.baseline)
+    if args.style_control:
+        print(json.dumps(style_control(args, judgments, metadata), indent=2))
+        raise SystemExit
+    battles = battles_from_judgments(judgments, multiplier=args.weight, baseline_model=args.baseline)
+
+    expected, sklearn_time = timed(lambda: compute_mle_elo(battles, baseline_model=args.baseline))
+    cells, models = aggregate_battles(battles)
+    ratings, weighted_time = timed(lambda: anchored_elo(
+        fit_bt_weighted(cells, cells["count"].to_numpy(), len(models)), models, baseline_model=args.baseline
+    ))
+    result = {
+        "battles": len(battles),
+        "cells": len(cells),
+        "fit_sklearn_s": round(sklearn_time, 3),
+        "fit_weighted_s": round(weighted_time, 4),
+        "max_rating_diff": float((expected - ratings[expected.index]).abs().max()),
+    }
+
+    bootstrap, bootstrap_time = timed(lambda: get_bootstrap_result_weighted(
+        battles, args.rounds, args.baseline, args.workers
+    ))
+    result[f"weighted_{args.rounds}_rounds_s"] = round(bootstrap_time, 3)
+    if args.reference_rounds:
+        reference, reference_time = timed(lambda: get_bootstrap_result(
+            battles, compute_mle_elo, args.reference_rounds, args.baseline
+        ))
+        result["resampling_s_per_round"] = round(reference_time / args.reference_rounds, 3)
+        result["weighted_s_per_round"] = round(bootstrap_time / args.rounds, 5)
+        widths = bootstrap.quantile(0.975) - bootstrap.quantile(0.025)
+        reference_widths = reference.quantile(0.975) - reference.quantile(0.025)
+        result["median_ci_width"] = round(float(np.median(widths)), 2)
+        result["median_ci_width_resampling"] = round(float(np.median(reference_widths)), 2)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,263 @@
+"""
+End-to-end CoLM benchmark: latency, token and cost accounting per call.
+
+Runs every combination of the given settings over a question file, records each
+API call (stage, provider, model, latency, retries, tokens) and writes
+    {output-dir}/{tag}_calls.csv     one row per call
+    {output-dir}/{tag}_summary.csv   p50/p95/p99 per config, stage and provider
+    {output-dir}/{tag}.json          the full report
+
+Usage:
+python benchmark_colm.py --target colm --limit 20 --iterations 1 2 --top-k 2 --concurrency 1 8
+python benchmark_colm.py --target arena --backend config --limit 50   # real backends from colm_gateway.yaml
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+QUESTION_FILES = {
+    "colm": "arena_hard_question.jsonl",
+    "arena": "arena_hard_question.jsonl",
+    "mt_bench": "question.jsonl",
+}
+
+PIPELINES = {"arena": "arena_hard", "mt_bench": "mt_bench"}
+
+CALL_FIELDS = [
+    "config", "stage", "question_id", "provider", "model", "latency", "service_time",
+    "retries", "prompt_tokens", "completion_tokens", "error",
+]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "mean": None}
+    values = np.array(values)
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "mean": round(float(values.mean()), 4),
+    }
+
+
+def call_cost(call):
+    from colm_journal import PRICES
+
+    price_in, price_out = PRICES.get(call["model"], (0.0, 0.0))
+    return ((call["prompt_tokens"] or 0) * price_in + (call["completion_tokens"] or 0) * price_out) / 1e6
+
+
+def summarize_calls(calls, question_latencies, num_questions, wall_time):
+    def group(key):
+        groups = {}
+        for call in calls:
+            groups.setdefault(call[key], []).append(call)
+        return {
+            name: {
+                "latency": percentiles([c["latency"] for c in members]),
+                "retries": sum(c["retries"] for c in members),
+                "errors": sum(c["error"] is not None for c in members),
+                "prompt_tokens": sum(c["prompt_tokens"] or 0 for c in members),
+                "completion_tokens": sum(c["completion_tokens"] or 0 for c in members),
+            }
+            for name, members in sorted(groups.items())
+        }
+
+    return {
+        "questions": num_questions,
+        "wall_time": round(wall_time, 3),
+        "throughput_qps": round(num_questions / wall_time, 4) if wall_time else None,
+        "calls": len(calls),
+        "calls_per_question": round(len(calls) / num_questions, 3) if num_questions else None,
+        "question_latency": percentiles(question_latencies),
+        "prompt_tokens": sum(c["prompt_tokens"] or 0 for c in calls),
+        "completion_tokens": sum(c["completion_tokens"] or 0 for c in calls),
+        "retries": sum(c["retries"] for c in calls),
+        "errors": sum(c["error"] is not None for c in calls),
+        "estimated_cost_usd": round(sum(call_cost(c) for c in calls), 6),
+        "by_stage": group("stage"),
+        "by_provider": group("provider"),
+    }
+
+
+def run_colm_config(questions, config):
+    import CoLM
+    from colm_metrics import call_question
+
+    latencies, paths = [], {}
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(config["concurrency"])
+
+        async def one(question_id, text):
+            async with semaphore:
+                with call_question(question_id):
+                    start = time.perf_counter()
+                    _, metadata = await CoLM.run_colm(
+                        text,
+                        use_selection=config["use_selection"],
+                        iterations=config["iterations"],
+                        top_k=config["top_k"],
+                        speculative=config["speculative"],
+                    )
+                    latencies.append(time.perf_counter() - start)
+                    paths[question_id] = {"path": metadata["path"], "confidence": metadata.get("confidence")}
+
+        await asyncio.gather(*(one(question_id, text) for question_id, text in questions))
+
+    asyncio.run(run_all())
+    return latencies, paths
+
+
+def run_pipeline_config(questions, config, pipeline):
+    from colm_engine import Engine, load_config
+    from colm_engine.data import read_question_items
+    from colm_metrics import call_question
+
+    # the journal is off so every config pays for its own calls
+    engine = Engine(load_config(pipeline, selection={"top_k": config["top_k"]}, journal=None))
+    latencies = []
+
+    def one(item):
+        with call_question(item["id"]):
+            start = time.perf_counter()
+            engine.process(item)
+            latencies.append(time.perf_counter() - start)
+
+    with engine, ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+        for item, future in [(item, executor.submit(one, item)) for item in read_question_items(questions)]:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{item['id']}: failed: {e}")
+    return latencies, {}
+
+
+def config_name(config):
+    return "_".join(f"{key}={value}" for key, value in config.items())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", type=str, default="colm", choices=list(QUESTION_FILES))
+    parser.add_argument("--question-file", type=str, default=None)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--iterations", type=int, nargs="+", default=[2], help="CoLM refinement rounds (colm target only).")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[2])
+    parser.add_argument("--use-selection", type=str, nargs="+", default=["true"], choices=["true", "false"],
+                        help="Expert selection on/off (colm target only).")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1], help="Questions in flight at once.")
+    parser.add_argument("--speculative", type=str, nargs="+", default=["none"],
+                        choices=["none", "self_consistency", "logprobs", "verifier"],
+                        help="Client-first confidence check (colm target only); 'none' always refines.")
+    parser.add_argument("--backend", type=str, default="mock",
+                        help="Gateway backend every model is routed to; 'config' keeps colm_gateway.yaml as is.")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the response cache on (off by default).")
+    parser.add_argument("--output-dir", type=str, default="benchmark_results")
+    parser.add_argument("--tag", type=str, default=None)
+    args = parser.parse_args()
+
+    # both are read when the CoLM modules are imported
+    if args.backend != "config":
+        os.environ["COLM_GATEWAY_BACKEND"] = args.backend
+    if not args.use_cache:
+        os.environ["COLM_CACHE_MODE"] = "bypass"
+
+    from colm_gateway import GATEWAY
+    from colm_metrics import CallRecorder
+    from colm_router import question_text
+
+    question_file = os.path.abspath(args.question_file or QUESTION_FILES[args.target])
+    with open(question_file, "r", encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    if args.limit:
+        questions = questions[: args.limit]
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    tag = args.tag or f"{args.target}_{time.strftime('%Y%m%d-%H%M%S')}"
+
+    if args.target == "colm":
+        grid = itertools.product(args.iterations, args.top_k, args.use_selection, args.concurrency, args.speculative)
+        configs = [
+            {"iterations": i, "top_k": k, "use_selection": s == "true", "concurrency": c,
+             "speculative": None if p == "none" else p}
+            for i, k, s, c, p in grid
+        ]
+    else:
+        configs = [{"top_k": k, "concurrency": c} for k, c in itertools.product(args.top_k, args.concurrency)]
+
+    # the generate scripts write answers to ./output, so run them in a scratch directory
+    workdir = tempfile.mkdtemp(prefix="colm_bench_")
+    os.chdir(workdir)
+
+    report = {"target": args.target, "backend": args.backend, "question_file": question_file, "configs": []}
+    all_calls = []
+    for config in configs:
+        name = config_name(config)
+        print(f"Running {name} on {len(questions)} questions...")
+        GATEWAY.reset_mocks()
+        with CallRecorder() as recorder:
+            start = time.perf_counter()
+            if args.target == "colm":
+                latencies, paths = run_colm_config(
+                    [(q.get("question_id", i), question_text(q)) for i, q in enumerate(questions)], config
+                )
+            else:
+                latencies, paths = run_pipeline_config(questions, config, PIPELINES[args.target])
+            wall_time = time.perf_counter() - start
+
+        summary = summarize_calls(recorder.calls, latencies, len(questions), wall_time)
+        if paths:
+            summary["paths"] = {path: sum(p["path"] == path for p in paths.values()) for path in ("client", "refined")}
+            summary["per_question"] = paths
+        report["configs"].append({"name": name, "config": config, **summary})
+        all_calls += [{"config": name, **call} for call in recorder.calls]
+        print(json.dumps({key: summary[key] for key in ("wall_time", "calls_per_question", "question_latency", "estimated_cost_usd")}))
+
+    # speculative configs are compared with the same config without speculation
+    for entry in report["configs"]:
+        if not entry["config"].get("speculative"):
+            continue
+        baseline = next((other for other in report["configs"]
+                         if other["config"] == {**entry["config"], "speculative": None}), None)
+        if baseline is not None and baseline["estimated_cost_usd"]:
+            entry["savings_vs_refined"] = {
+                "baseline": baseline["name"],
+                "cost": round(1 - entry["estimated_cost_usd"] / baseline["estimated_cost_usd"], 4),
+                "calls": round(1 - entry["calls"] / baseline["calls"], 4),
+                "mean_latency": round(1 - entry["question_latency"]["mean"] / baseline["question_latency"]["mean"], 4),
+            }
+            print(f"{entry['name']}: {entry['paths']}, savings {entry['savings_vs_refined']}")
+
+    with open(os.path.join(output_dir, f"{tag}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    with open(os.path.join(output_dir, f"{tag}_calls.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CALL_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(all_calls)
+
+    with open(os.path.join(output_dir, f"{tag}_summary.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["config", "group", "name", "count", "p50", "p95", "p99", "mean",
+                         "retries", "errors", "prompt_tokens", "completion_tokens"])
+        for entry in report["configs"]:
+            writer.writerow([entry["name"], "question", "all", *entry["question_latency"].values(),
+                             entry["retries"], entry["errors"], entry["prompt_tokens"], entry["completion_tokens"]])
+            for group in ("by_stage", "by_provider"):
+                for name, stats in entry[group].items():
+                    writer.writerow([entry["name"], group[3:], name, *stats["latency"].values(),
+                                     stats["retries"], stats["errors"], stats["prompt_tokens"], stats["completion_tokens"]])
+
+    print(f"Wrote {tag}.json, {tag}_calls.csv and {tag}_summary.csv to {output_dir}")
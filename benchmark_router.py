@@ -0,0 +1,113 @@
+"""
+Compare the local router against the gpt-4o selector.
+
+The selector is called directly, without the response cache or the rate
+limiter, so its latency is the API round trip.
+
+Usage:
+python benchmark_router.py --question-file arena_hard_question.jsonl --top-k 2 --limit 100
+python benchmark_router.py --skip-llm   # router latency only, no API key needed
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from CoLM import MODEL_PROMPTS
+from colm_engine.prompts import selection_messages
+from colm_router import LocalRouter, question_text
+
+SELECTION_PROMPT = (
+    "You are an AI assistant that selects the most relevant model specializations for a given question. "
+    "Only return model names, separated by commas."
+)
+
+
+def latency_stats(latencies):
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+async def llm_selections(questions, top_k, concurrency):
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def select(question):
+        messages = selection_messages(SELECTION_PROMPT, question, MODEL_PROMPTS, top_k)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(model="gpt-4o", messages=messages)
+                selected = response.choices[0].message.content.strip().split(", ")
+            except Exception as e:
+                print(f"Model selection failed: {e}")
+                selected = []
+            return selected, time.perf_counter() - start
+
+    try:
+        return await asyncio.gather(*(select(q) for q in questions))
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--question-file", type=str, default="arena_hard_question.jsonl")
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--parallel", type=int, default=8)
+    parser.add_argument("--skip-llm", action="store_true")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON file for per-question decisions.")
+    args = parser.parse_args()
+
+    with open(args.question_file, "r", encoding="utf-8") as f:
+        questions = [question_text(json.loads(line)) for line in f if line.strip()]
+    if args.limit:
+        questions = questions[: args.limit]
+
+    router = LocalRouter(MODEL_PROMPTS)
+    local_results, local_latencies = [], []
+    for q in questions:
+        start = time.perf_counter()
+        local_results.append(router.route(q, args.top_k))
+        local_latencies.append(time.perf_counter() - start)
+
+    report = {
+        "num_questions": len(questions),
+        "top_k": args.top_k,
+        "local_router": latency_stats(local_latencies),
+        "local_abstain_rate": round(sum(r is None for r in local_results) / len(questions), 3),
+    }
+
+    llm_results = [None] * len(questions)
+    if not args.skip_llm:
+        outputs = asyncio.run(llm_selections(questions, args.top_k, args.parallel))
+        llm_results = [selected for selected, _ in outputs]
+        report["llm_selector"] = latency_stats([latency for _, latency in outputs])
+        report["llm_malformed_rate"] = round(
+            sum(not set(s) <= set(MODEL_PROMPTS) or len(s) != args.top_k for s in llm_results) / len(questions), 3
+        )
+
+        compared = [(l, m) for l, m in zip(local_results, llm_results) if l is not None and m]
+        if compared:
+            report["exact_agreement"] = round(np.mean([set(l) == set(m) for l, m in compared]), 3)
+            report["top1_agreement"] = round(np.mean([l[0] == m[0] for l, m in compared]), 3)
+            report["mean_overlap"] = round(np.mean([len(set(l) & set(m)) / args.top_k for l, m in compared]), 3)
+
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                [{"question": q, "local": l, "llm": m} for q, l, m in zip(questions, local_results, llm_results)],
+                f, indent=2, ensure_ascii=False,
+            )
@@ -0,0 +1,282 @@
+"""
+Batched summarizer calls for the generation scripts.
+
+Two modes:
+    json        summaries requested by different questions are packed into one
+                JSON-mode request (answers keyed by task id). A batch is sent
+                once it reaches `max_batch_tokens` or its oldest request has
+                waited `max_wait` seconds.
+    batch_file  summaries are appended to an OpenAI Batch API input file
+                instead of being requested; the question stops there. Run the
+                batch (on the Batch API, or locally with run-local), import
+                its output into the response cache, and re-run the script: the
+                journal replays the expert answers and the summaries are
+                cache hits.
+
+Usage:
+python colm_batch.py submit output/summary_batch.jsonl output/summary_batch_out.jsonl
+python colm_batch.py run-local output/summary_batch.jsonl output/summary_batch_out.jsonl
+python colm_batch.py import output/summary_batch_out.jsonl
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from colm_cache import RESPONSE_CACHE, make_key
+from colm_ratelimit import RATE_LIMITS, estimate_tokens
+
+BATCH_MODES = ("json", "batch_file")
+BATCH_ENDPOINT = "/v1/chat/completions"
+# completion tokens reserved per packed summary
+OUTPUT_TOKENS_PER_ITEM = 1000
+MAX_OUTPUT_TOKENS = 16000
+
+BATCH_SYSTEM_PROMPT = (
+    "You will receive a JSON list of independent tasks. Each task has an id, its own instructions "
+    "and its input. Complete every task separately, following its instructions exactly as if it were the "
+    "only request. Respond with a JSON object that maps every task id to the complete answer for that task, "
+    "as a string."
+)
+
+
+class SummaryDeferred(Exception):
+    """Raised in batch_file mode once a request has been written to the batch input file."""
+
+
+def batch_request_line(custom_id, model, messages, **params):
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+            "body": {"model": model, "messages": messages, **params}}
+
+
+def read_batch_ids(path):
+    """custom_ids already in a Batch API input file (empty if it does not exist)."""
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                ids.add(json.loads(line)["custom_id"])
+            except (json.JSONDecodeError, KeyError):
+                print(f"Skipping malformed line in {path}")
+    return ids
+
+
+def read_batch_output(path):
+    """custom_id -> answer text (None for failed requests) from a Batch API output file."""
+    results = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200 and body.get("choices"):
+                results[entry["custom_id"]] = body["choices"][0]["message"]["content"]
+            else:
+                results[entry["custom_id"]] = None
+    return results
+
+
+def run_batch_locally(input_path, output_path, client):
+    """Stand-in for the Batch API: run every request of `input_path` and write the output file format."""
+    with open(input_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+        for i, line in enumerate(fin):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            entry = {"id": f"batch_req_{i}", "custom_id": request["custom_id"], "response": None, "error": None}
+            try:
+                completion = client.chat.completions.create(**request["body"])
+                entry["response"] = {"status_code": 200, "request_id": f"local_{i}", "body": {
+                    "model": request["body"]["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.choices[0].message.content},
+                                 "finish_reason": "stop"}],
+                }}
+            except Exception as e:
+                entry["error"] = {"code": type(e).__name__, "message": str(e)}
+            fout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def submit_batch(client, input_path, output_path, poll_interval=60):
+    """Run `input_path` on the OpenAI Batch API and download its output to `output_path`."""
+    with open(input_path, "rb") as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"Submitted batch {batch.id}")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+    if batch.status != "completed":
+        raise RuntimeError(f"batch {batch.id} ended with status {batch.status}")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(client.files.content(batch.output_file_id).text)
+
+
+def import_batch_output(path, cache=None):
+    """Store successful batch answers in the response cache (custom ids are cache keys)."""
+    cache = RESPONSE_CACHE if cache is None else cache
+    imported = 0
+    for key, content in read_batch_output(path).items():
+        if content:
+            cache.put(key, content.strip())
+            imported += 1
+    return imported
+
+
+class SummaryBatcher:
+    def __init__(self, client, model="gpt-4o", provider="openai", mode="json", max_batch_tokens=12000,
+                 max_wait=2.0, max_batch_size=16, max_concurrent_batches=4, batch_file=None):
+        assert mode in BATCH_MODES, f"unknown batch mode {mode}, expected one of {BATCH_MODES}"
+        assert mode != "batch_file" or batch_file, "batch_file mode needs a batch_file path"
+        self.client = client
+        self.model = model
+        self.provider = provider
+        self.mode = mode
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.max_batch_size = min(max_batch_size, MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_ITEM)
+        self.batch_file = batch_file
+        self.batches = 0
+        self.batched = 0
+        self.fallbacks = 0
+        self.deferred = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches)
+        self._thread = None
+        # the Batch API rejects input files with repeated custom_ids
+        self._written = read_batch_ids(batch_file) if mode == "batch_file" else set()
+        if mode == "json":
+            self._thread = threading.Thread(target=self._run, name="summary-batcher", daemon=True)
+            self._thread.start()
+
+    def summarize(self, messages, fallback):
+        """Answer `messages` as part of a batch; `fallback()` makes the unbatched call."""
+        if self.mode == "batch_file":
+            return self._defer(messages)
+        future = Future()
+        self._queue.put((messages, fallback, future))
+        return future.result()
+
+    def _defer(self, messages):
+        key = make_key(self.model, messages, {})
+        with self._lock:
+            if key not in self._written:
+                os.makedirs(os.path.dirname(self.batch_file) or ".", exist_ok=True)
+                with open(self.batch_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(batch_request_line(key, self.model, messages), ensure_ascii=False) + "\n")
+                self._written.add(key)
+            self.deferred += 1
+        raise SummaryDeferred(f"summary written to {self.batch_file}")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, tokens = [item], estimate_tokens(item[0], OUTPUT_TOKENS_PER_ITEM)
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size and tokens < self.max_batch_tokens:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                tokens += estimate_tokens(item[0], OUTPUT_TOKENS_PER_ITEM)
+            self._executor.submit(self._send, batch)
+            if stop:
+                return
+
+    def _send(self, batch):
+        if len(batch) == 1:
+            self._resolve_single(batch[0])
+            return
+        tasks = [
+            {"id": str(i), "instructions": messages[0]["content"], "input": "\n\n".join(m["content"] for m in messages[1:])}
+            for i, (messages, _, _) in enumerate(batch)
+        ]
+        request = [
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": json.dumps(tasks, ensure_ascii=False)},
+        ]
+        max_tokens = min(MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_PER_ITEM * len(batch))
+        try:
+            response = RATE_LIMITS.call(
+                self.provider,
+                self.model,
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=request,
+                    max_tokens=max_tokens,
+                    response_format={"type": "json_object"}
+                ),
+                estimate_tokens(request, max_tokens)
+            )
+            answers = json.loads(response.choices[0].message.content)
+        except Exception as e:
+            print(f"Batched summary of {len(batch)} requests failed, falling back to single calls: {e}")
+            answers = {}
+
+        with self._lock:
+            self.batches += 1
+        for i, item in enumerate(batch):
+            answer = answers.get(str(i))
+            if isinstance(answer, str) and answer.strip():
+                with self._lock:
+                    self.batched += 1
+                item[2].set_result(answer.strip())
+            else:
+                self._resolve_single(item)
+
+    def _resolve_single(self, item):
+        _, fallback, future = item
+        with self._lock:
+            self.fallbacks += 1
+        try:
+            future.set_result(fallback())
+        except Exception as e:
+            future.set_exception(e)
+
+    def stats(self):
+        return {"mode": self.mode, "batches": self.batches, "batched": self.batched,
+                "single": self.fallbacks, "deferred": self.deferred}
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["submit", "run-local", "import"])
+    parser.add_argument("input", type=str, help="Batch input file (output file for import).")
+    parser.add_argument("output", type=str, nargs="?", default=None)
+    parser.add_argument("--poll-interval", type=int, default=60)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"Imported {import_batch_output(args.input)} answers into {RESPONSE_CACHE.path}")
+    else:
+        from colm_gateway import GATEWAY
+
+        client = GATEWAY.client("gpt-4o")
+        if args.command == "submit":
+            submit_batch(client, args.input, args.output, args.poll_interval)
+        else:
+            run_batch_locally(args.input, args.output, client)
+        print(f"Wrote batch output to {args.output}")
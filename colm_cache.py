@@ -0,0 +1,167 @@
+"""Content-addressed on-disk cache for CoLM model responses.
+
+Entries are keyed by a SHA-256 of the model id, the exact messages and the
+decoding parameters, so re-running an experiment only pays for requests whose
+inputs actually changed. The store is a single SQLite file; once it grows past
+`max_bytes` the least recently used entries are evicted.
+
+Modes:
+    readwrite  serve hits and store new responses (default)
+    readonly   serve hits but never write
+    refresh    ignore existing entries and overwrite them with fresh responses
+    bypass     do not touch the cache at all
+
+The shared `RESPONSE_CACHE` is configured through COLM_CACHE_DIR,
+COLM_CACHE_MODE and COLM_CACHE_MAX_MB.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_MODES = ("readwrite", "readonly", "refresh", "bypass")
+# least recently used entries deleted per eviction statement
+EVICT_CHUNK = 64
+
+
+def make_key(model, messages, params=None):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, max_bytes=1 << 30, mode="readwrite"):
+        assert mode in CACHE_MODES, f"unknown cache mode {mode}, expected one of {CACHE_MODES}"
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._total = 0
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+            # running byte total, updated by put and re-read from the table on connect, after
+            # eviction and whenever another connection (e.g. another process) has committed
+            self._total = self._table_size(self._conn)
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return self._conn
+
+    def get(self, key):
+        if self.mode in ("bypass", "refresh"):
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        if self.mode in ("bypass", "readonly"):
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._total = self._table_size(conn)
+                self._data_version = data_version
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._total += size - (old[0] if old else 0)
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        if self._total <= self.max_bytes:
+            return
+        # other processes may write the same file, so evict against the table's real size
+        self._total = self._table_size(conn)
+        while self._total > self.max_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT ?", (EVICT_CHUNK,)
+            ).fetchall()
+            if not rows:
+                break
+            # delete exactly the selected rows, so ties in `accessed` cannot skew the count
+            conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self._total -= sum(size for _, size in rows)
+        self._total = self._table_size(conn)
+
+    @staticmethod
+    def _table_size(conn):
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def cached(self, model, messages, params, fn):
+        """Return the cached response for this request, or call `fn()` and store its result.
+
+        Empty results are not stored, since call_model uses "" to signal failure.
+        """
+        key = make_key(model, messages, params)
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = fn()
+        if value:
+            self.put(key, value)
+        return value
+
+    async def acached(self, model, messages, params, fn):
+        """Async variant of `cached`; `fn()` must return an awaitable."""
+        key = make_key(model, messages, params)
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = await fn()
+        if value:
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+RESPONSE_CACHE = ResponseCache(
+    path=os.path.join(os.environ.get("COLM_CACHE_DIR", ".colm_cache"), "responses.sqlite"),
+    max_bytes=int(float(os.environ.get("COLM_CACHE_MAX_MB", 1024)) * (1 << 20)),
+    mode=os.environ.get("COLM_CACHE_MODE", "readwrite"),
+)
@@ -0,0 +1,74 @@
+"""
+Shared provider clients.
+
+Clients are built once per (api_type, api_base, api_key, api_version) and reused
+by every thread, so judgments and generations share one HTTP keep-alive
+connection pool per endpoint instead of opening a new one per call.
+"""
+import os
+import threading
+
+API_TYPES = ("openai", "azure", "anthropic", "openai_async")
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_type="openai", api_base=None, api_key=None, api_version=None):
+        assert api_type in API_TYPES, f"unknown api_type {api_type}, expected one of {API_TYPES}"
+        key = (api_type, api_base, api_key, api_version)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._build(*key)
+            return self._clients[key]
+
+    def _build(self, api_type, api_base, api_key, api_version):
+        if api_type == "anthropic":
+            import anthropic
+            return anthropic.Anthropic(api_key=api_key or os.environ["ANTHROPIC_API_KEY"])
+
+        import openai
+        if api_type == "azure":
+            return openai.AzureOpenAI(
+                azure_endpoint=api_base,
+                api_key=api_key,
+                api_version=api_version,
+                timeout=240,
+                max_retries=2
+            )
+        client_cls = openai.AsyncOpenAI if api_type == "openai_async" else openai.OpenAI
+        return client_cls(base_url=api_base, api_key=api_key)
+
+    def clients(self):
+        with self._lock:
+            return list(self._clients.values())
+
+    def close(self):
+        for client in self.clients():
+            client.close()
+        with self._lock:
+            self._clients = {}
+
+    async def aclose(self):
+        for client in self.clients():
+            await client.close()
+        with self._lock:
+            self._clients = {}
+
+    def __len__(self):
+        return len(self._clients)
+
+
+CLIENT_REGISTRY = ClientRegistry()
+
+
+def get_client(api_type="openai", api_base=None, api_key=None, api_version=None):
+    return CLIENT_REGISTRY.get(api_type, api_base, api_key, api_version)
+
+
+def client_from_api_dict(api_type, api_dict=None):
+    """Client for an api_config.yaml endpoint entry (None means the environment defaults)."""
+    api_dict = api_dict or {}
+    return get_client(api_type, api_dict.get("api_base"), api_dict.get("api_key"), api_dict.get("api_version"))
@@ -0,0 +1,116 @@
+"""
+Token-budgeted prompt compaction.
+
+Summarizer inputs are deduplicated (near-identical expert answers are merged)
+and every answer is trimmed to a fair share of the budget; multi-turn
+conversations keep their system prompts and latest turn and trim older turns,
+oldest first, until the prompt fits. Trimmed text keeps its head and tail
+around an elision marker.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated at
+4 characters per token like the rate limiter does.
+"""
+from functools import lru_cache
+
+from colm_convergence import similarity
+
+# prompt-token budgets per call
+SUMMARY_INPUT_BUDGET = 6000
+CONVERSATION_BUDGET = 8000
+# answers at least this similar (word-level) are merged before summarization
+DEDUPE_THRESHOLD = 0.9
+MESSAGE_OVERHEAD = 4
+ELISION = "\n[...]\n"
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model="gpt-4o"):
+    if not text:
+        return 0
+    if tiktoken is None:
+        return len(text) // 4
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model="gpt-4o"):
+    return sum(count_tokens(m.get("content") or "", model) + MESSAGE_OVERHEAD for m in messages)
+
+
+def truncate(text, budget, model="gpt-4o"):
+    """Trim `text` to about `budget` tokens, keeping its beginning and end."""
+    if count_tokens(text, model) <= budget:
+        return text
+    budget = max(budget - count_tokens(ELISION, model), 0)
+    head, tail = budget * 2 // 3, budget - budget * 2 // 3
+    if tiktoken is None:
+        return text[: head * 4] + ELISION + (text[-tail * 4:] if tail else "")
+    encoding = _encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:head]) + ELISION + (encoding.decode(tokens[-tail:]) if tail else "")
+
+
+def dedupe(responses, threshold=DEDUPE_THRESHOLD):
+    """Merge near-identical answers; the merged entry is keyed by all of their names."""
+    kept = []
+    for name, text in responses.items():
+        for entry in kept:
+            if similarity(entry[1], text) >= threshold:
+                entry[0].append(name)
+                break
+        else:
+            kept.append(([name], text))
+    return {" / ".join(names): text for names, text in kept}
+
+
+def fit_responses(responses, budget=SUMMARY_INPUT_BUDGET, model="gpt-4o", threshold=DEDUPE_THRESHOLD):
+    """Dedupe `responses` and trim them so together they fit in `budget` tokens.
+
+    Short answers are kept whole and the budget they leave is shared among the
+    long ones (max-min fair split).
+    """
+    responses = dedupe(responses, threshold) if threshold is not None else dict(responses)
+    sizes = {name: count_tokens(text, model) for name, text in responses.items()}
+    remaining, pending = budget, sorted(sizes, key=sizes.get)
+    shares = {}
+    while pending:
+        share = remaining // len(pending)
+        name = pending[0]
+        if sizes[name] > share:
+            break
+        shares[name] = sizes[name]
+        remaining -= sizes[name]
+        pending.pop(0)
+    for name in pending:
+        shares[name] = remaining // len(pending)
+    return {name: truncate(text, shares[name], model) for name, text in responses.items()}
+
+
+def compact_messages(messages, budget=CONVERSATION_BUDGET, model="gpt-4o"):
+    """Return a copy of `messages` that fits in `budget` tokens.
+
+    System messages and the last message are kept; older turns are trimmed
+    oldest first, and dropped entirely if trimming is not enough.
+    """
+    messages = [dict(m) for m in messages]
+    excess = count_message_tokens(messages, model) - budget
+    older = [i for i, m in enumerate(messages[:-1]) if m["role"] != "system"]
+    for i in older:
+        if excess <= 0:
+            break
+        size = count_tokens(messages[i]["content"], model)
+        keep = max(size - excess, 0)
+        messages[i]["content"] = truncate(messages[i]["content"], keep, model) if keep else ""
+        excess -= size - count_tokens(messages[i]["content"], model)
+    return [m for i, m in enumerate(messages) if m["content"] or i not in older]
@@ -0,0 +1,53 @@
+"""Convergence tracking for the CoLM refinement loop.
+
+After every round each refined answer is compared with the same expert's
+previous answer and with the round's summary. An expert whose answer barely
+moved (or already matches the summary) is marked converged and is not
+re-queried; the loop ends once every expert has converged or the token budget
+is spent.
+"""
+import difflib
+
+from colm_ratelimit import estimate_tokens
+
+
+def similarity(a, b):
+    """Word-level edit similarity in [0, 1] (difflib ratio over whitespace tokens)."""
+    if not a or not b:
+        return 0.0
+    return difflib.SequenceMatcher(None, a.split(), b.split(), autojunk=False).ratio()
+
+
+class ConvergenceTracker:
+    def __init__(self, model_names, threshold=0.9, token_budget=None):
+        self.active = list(model_names)
+        self.threshold = threshold
+        self.token_budget = token_budget
+        self.tokens_spent = 0
+        self.history = []
+
+    def charge(self, messages, response=""):
+        """Account for one call; estimated the same way the rate limiter reserves TPM."""
+        self.tokens_spent += estimate_tokens(messages) + len(response or "") // 4
+
+    @property
+    def budget_exhausted(self):
+        return self.token_budget is not None and self.tokens_spent >= self.token_budget
+
+    @property
+    def done(self):
+        return not self.active or self.budget_exhausted
+
+    def update(self, previous, refined, summary):
+        """Record a round and drop experts whose answers converged; returns their names."""
+        converged = []
+        scores = {}
+        for name, response in refined.items():
+            moved = similarity(previous.get(name, ""), response)
+            aligned = similarity(summary, response)
+            scores[name] = {"previous": round(moved, 3), "summary": round(aligned, 3)}
+            if response and max(moved, aligned) >= self.threshold:
+                converged.append(name)
+        self.active = [name for name in self.active if name not in converged]
+        self.history.append({"similarity": scores, "converged": converged, "tokens_spent": self.tokens_spent})
+        return converged
@@ -0,0 +1,23 @@
+"""
+Config-driven CoLM pipelines.
+
+A pipeline config (YAML, merged over defaults.yaml) names a dataset reader, an
+answer writer and a graph of stages (select, answer, summarize, refine, write)
+whose `after` lists give the order they run in. The Engine runs every stage
+with its own worker threads behind a bounded queue and fans expert calls out
+per provider. generate_alpaca.py, generate_arena.py and generate_mt_bench.py
+are thin wrappers around the bundled configs in configs/.
+
+Usage:
+python -m colm_engine arena_hard
+python -m colm_engine path/to/pipeline.yaml --limit 20
+"""
+from colm_engine.config import DEFAULTS, available_configs, load_config, stage_order
+from colm_engine.data import READERS, WRITERS, read_dataset
+from colm_engine.engine import Engine
+from colm_engine.stages import STAGE_TYPES
+
+__all__ = [
+    "DEFAULTS", "Engine", "READERS", "STAGE_TYPES", "WRITERS",
+    "available_configs", "load_config", "read_dataset", "stage_order",
+]
@@ -0,0 +1,11 @@
+import argparse
+
+from colm_engine import Engine, available_configs, load_config
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", type=str, help=f"Config file or one of {sorted(available_configs())}.")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N items.")
+    args = parser.parse_args()
+
+    Engine(load_config(args.config)).run(limit=args.limit)
@@ -0,0 +1,106 @@
+"""Pipeline configs: YAML files merged over defaults.yaml."""
+import copy
+import os
+
+import yaml
+
+from colm_gateway import GATEWAY
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(PACKAGE_DIR, "configs")
+
+
+def merge(base, override):
+    """Deep-merge `override` into a copy of `base`; the `stages` section is replaced, not merged."""
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict) and key != "stages":
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+DEFAULTS = _read(os.path.join(PACKAGE_DIR, "defaults.yaml"))
+
+# sections a pipeline config must add to the defaults, with the keys each one needs
+PIPELINE_SECTIONS = {
+    "dataset": ["reader", "path"],
+    "output": ["writer", "path"],
+    "stages": [],
+}
+
+
+def config_path(name):
+    """A config file path, or the name of one of the bundled configs (e.g. `arena_hard`)."""
+    if os.path.isfile(name):
+        return name
+    bundled = os.path.join(CONFIG_DIR, f"{name}.yaml")
+    if os.path.exists(bundled):
+        return bundled
+    raise FileNotFoundError(f"no pipeline config {name} (bundled: {sorted(available_configs())})")
+
+
+def available_configs():
+    return [file[:-5] for file in os.listdir(CONFIG_DIR) if file.endswith(".yaml")]
+
+
+def stage_order(stages):
+    """Stage names in dependency order (each stage runs after everything in its `after` list)."""
+    order, visiting = [], set()
+
+    def visit(name, path):
+        if name in order:
+            return
+        if name not in stages:
+            raise ValueError(f"stage {path[-1]} depends on unknown stage {name}")
+        if name in visiting:
+            raise ValueError(f"stage dependencies form a cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dependency in stages[name].get("after", []):
+            visit(dependency, path + [name])
+        visiting.discard(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name, [])
+    return order
+
+
+def check_pipeline(config, name):
+    """Raise a ValueError naming every missing pipeline section or key of config `name`."""
+    missing = []
+    for section, keys in PIPELINE_SECTIONS.items():
+        if not config.get(section):
+            missing.append(section)
+        elif isinstance(config[section], dict):
+            missing += [f"{section}.{key}" for key in keys if not config[section].get(key)]
+        else:
+            missing.append(f"{section} (expected a mapping)")
+    if missing:
+        raise ValueError(f"pipeline config {name} is missing {', '.join(missing)} (see colm_engine/defaults.yaml)")
+
+
+def load_config(name=None, **overrides):
+    """Load a pipeline config over the defaults; keyword arguments override top-level sections.
+
+    `load_config()` returns the defaults alone (experts, providers, prompts), as
+    used by CoLM.py. A named pipeline config must define dataset, output and
+    stages.
+    """
+    config = merge(DEFAULTS, _read(config_path(name)) if name else {})
+    config = merge(config, overrides)
+    if name:
+        check_pipeline(config, name)
+    # colm_gateway.yaml can point experts at other models
+    sources = GATEWAY.model_sources({expert: spec["source"] for expert, spec in config["experts"].items()})
+    for expert, spec in config["experts"].items():
+        spec["source"] = sources[expert]
+    stages = config.get("stages") or {}
+    config["stage_order"] = stage_order(stages)
+    return config
@@ -0,0 +1,113 @@
+"""Dataset readers and answer writers.
+
+A reader turns a dataset into items `{"id", "turns", "multi_turn", "record"}`
+(`turns` are plain strings, `record` is the original row). A writer stores the
+final expert answers of an item in the format the matching evaluation reads.
+"""
+import hashlib
+import json
+import os
+import time
+
+import shortuuid
+
+from colm_writer import compact_jsonl
+
+
+def instruction_id(instr):
+    return hashlib.sha256(instr.encode("utf-8")).hexdigest()[:16]
+
+
+def read_alpaca_eval(spec):
+    from datasets import load_from_disk
+
+    eval_set = load_from_disk(spec["path"])[spec.get("split", "eval")]
+    eval_set = eval_set.remove_columns(["output", "generator"])
+    print(f"Loaded {len(eval_set)} items from alpaca_eval.")
+    for row in eval_set:
+        yield {"id": instruction_id(row["instruction"]), "turns": [row["instruction"]], "multi_turn": False, "record": row}
+
+
+def read_question_items(questions):
+    """Items from FastChat-style questions (MT-Bench, Arena-Hard); turns may be strings or `{"content": ...}`."""
+    for question in questions:
+        turns = [turn["content"] if isinstance(turn, dict) else turn for turn in question["turns"]]
+        yield {"id": question["question_id"], "turns": turns, "multi_turn": True, "record": question}
+
+
+def read_question_file(spec):
+    with open(spec["path"], "r", encoding="utf-8") as f:
+        return read_question_items([json.loads(line) for line in f if line.strip()])
+
+
+READERS = {
+    "alpaca_eval": read_alpaca_eval,
+    "arena_hard": read_question_file,
+    "mt_bench": read_question_file,
+}
+
+
+def read_dataset(spec):
+    assert spec["reader"] in READERS, f"unknown dataset reader {spec['reader']}, expected one of {list(READERS)}"
+    return READERS[spec["reader"]](spec)
+
+
+class AlpacaEvalWriter:
+    """{model}.jsonl with one AlpacaEval output per instruction, for the selected experts."""
+
+    def __init__(self, spec, writer):
+        self.path = spec["path"]
+        self.compact = spec.get("compact", True)
+        self.writer = writer
+
+    def write(self, state):
+        item = state["item"]
+        for model_name in state["selected"]:
+            self.writer.write(os.path.join(self.path, f"{model_name}.jsonl"), {
+                "dataset": item["record"].get("dataset", "alpaca_eval"),
+                "generator": model_name,
+                "instruction": item["turns"][0],
+                "output": state["responses"][model_name][-1],
+            })
+
+    def close(self, model_names):
+        if not self.compact:
+            return
+        # turn the append-only {model}.jsonl files into the JSON arrays alpaca_eval reads
+        for model_name in model_names:
+            jsonl_file = os.path.join(self.path, f"{model_name}.jsonl")
+            if os.path.exists(jsonl_file):
+                count = compact_jsonl(jsonl_file, os.path.join(self.path, f"{model_name}.json"), key="instruction")
+                print(f"Wrote {count} outputs to {model_name}.json")
+
+
+class FastChatWriter:
+    """FastChat model-answer files ({model}.jsonl) with every answered or refined expert."""
+
+    def __init__(self, spec, writer):
+        self.path = spec["path"]
+        self.writer = writer
+
+    def write(self, state):
+        for model_name, turns in state["responses"].items():
+            self.writer.write(os.path.join(self.path, f"{model_name}.jsonl"), {
+                "question_id": state["item"]["id"],
+                "answer_id": shortuuid.uuid(),
+                "model_id": model_name,
+                "choices": [{"index": 0, "turns": turns}],
+                "tstamp": time.time(),
+            })
+
+    def close(self, model_names):
+        pass
+
+
+WRITERS = {
+    "alpaca_eval": AlpacaEvalWriter,
+    "fastchat": FastChatWriter,
+}
+
+
+def answer_writer(spec, writer):
+    assert spec["writer"] in WRITERS, f"unknown answer writer {spec['writer']}, expected one of {list(WRITERS)}"
+    return WRITERS[spec["writer"]](spec, writer)
@@ -0,0 +1,241 @@
+"""Shared executor for the CoLM pipelines.
+
+An Engine owns everything the stages share: clients, the per-provider expert
+pools, the journal, the summary batcher and the answer writer. `run()` streams
+a dataset through the configured stages (in dependency order, each with its own
+worker threads and bounded queue, see colm_pipeline.py); `process()` runs one
+item through the same stages inline.
+"""
+import json
+import os
+
+from loguru import logger
+
+from colm_batch import SummaryBatcher, SummaryDeferred
+from colm_cache import RESPONSE_CACHE
+from colm_engine.data import answer_writer, read_dataset
+from colm_engine.prompts import selection_messages
+from colm_engine.stages import STAGE_TYPES
+from colm_gateway import GATEWAY
+from colm_journal import Journal
+from colm_pipeline import Pipeline, ProviderPool, Stage
+from colm_ratelimit import RATE_LIMITS, estimate_tokens
+from colm_router import route_models
+from colm_writer import JsonlWriter
+
+
+class Engine:
+    def __init__(self, config, clients=None):
+        self.config = config
+        self.model_prompts = {name: spec["prompt"] for name, spec in config["experts"].items()}
+        self.model_sources = {name: spec["source"] for name, spec in config["experts"].items()}
+        self.providers = config["providers"]
+        self.selection_model = config["selection"]["model"]
+        self.summary_model = config["summary"]["model"]
+        # models served by the same endpoint share a pooled client
+        self.clients = clients if clients is not None else GATEWAY.clients(list(dict.fromkeys(
+            [self.selection_model, self.summary_model, *self.model_sources.values()]
+        )))
+        self.pools = None
+        self.journal = None
+        self.batcher = None
+        self.output = None
+        self._writer = None
+
+    # -----------------------------
+    # Model calls
+    # -----------------------------
+    def provider(self, model_id):
+        return self.providers.get(model_id, "openai")
+
+    def call_model(self, model_source, messages):
+        max_tokens = self.config["max_tokens"]
+
+        def request():
+            client = self.clients[model_source]
+            response = RATE_LIMITS.call(
+                self.provider(model_source),
+                model_source,
+                lambda: client.chat.completions.create(
+                    model=model_source,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    stream=False
+                ),
+                estimate_tokens(messages, max_tokens)
+            )
+            return response.choices[0].message.content.strip()
+
+        try:
+            return RESPONSE_CACHE.cached(model_source, messages, {"max_tokens": max_tokens}, request)
+        except Exception as e:
+            print(f"Model call failed for {model_source}: {e}")
+            return ""
+
+    def select_models(self, question, top_k):
+        model_id = self.selection_model
+        messages = selection_messages(self.config["selection"]["prompt"], question, self.model_prompts, top_k)
+
+        def request():
+            response = RATE_LIMITS.call(
+                self.provider(model_id),
+                model_id,
+                lambda: self.clients[model_id].chat.completions.create(model=model_id, messages=messages),
+                estimate_tokens(messages, 100)
+            )
+            return response.choices[0].message.content.strip()
+
+        try:
+            selected = RESPONSE_CACHE.cached(model_id, messages, {}, request).split(", ")
+            print(f"\n>>> Selected Models: {selected}")
+            return selected
+        except Exception as e:
+            print(f"Model selection failed: {e}")
+            return []
+
+    def choose_models(self, question):
+        selector, top_k = self.config["selection"]["selector"], self.config["selection"]["top_k"]
+        if selector == "none":
+            return list(self.model_prompts)
+        if selector == "local":
+            return route_models(question, self.model_prompts, top_k, lambda: self.select_models(question, top_k))
+        return self.select_models(question, top_k)
+
+    def summarize(self, messages):
+        model_id = self.summary_model
+
+        def request():
+            response = RATE_LIMITS.call(
+                self.provider(model_id),
+                model_id,
+                lambda: self.clients[model_id].chat.completions.create(model=model_id, messages=messages),
+                estimate_tokens(messages, 1000)
+            )
+            return response.choices[0].message.content.strip()
+
+        if self.batcher is not None:
+            return RESPONSE_CACHE.cached(model_id, messages, {}, lambda: self.batcher.summarize(messages, request))
+        return RESPONSE_CACHE.cached(model_id, messages, {}, request)
+
+    def fan_out(self, model_names, fn):
+        """`{name: fn(name)}`, run on the experts' provider pools when the engine is open."""
+        if self.pools is None:
+            return {name: fn(name) for name in model_names}
+        futures = {
+            name: self.pools.submit(self.provider(self.model_sources.get(name, "gpt-4o")), fn, name)
+            for name in model_names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    # -----------------------------
+    # Execution
+    # -----------------------------
+    def open(self):
+        config = self.config
+        self.pools = ProviderPool(config["provider_workers"])
+        if config.get("journal"):
+            self.journal = Journal(config["journal"])
+        summary = config["summary"]
+        if summary.get("batching"):
+            self.batcher = SummaryBatcher(
+                self.clients[self.summary_model], self.summary_model, self.provider(self.summary_model),
+                summary["batching"], summary["batch_tokens"], summary["batch_wait"], batch_file=summary["batch_file"]
+            )
+        if config.get("output"):
+            self._writer = JsonlWriter()
+            self.output = answer_writer(config["output"], self._writer)
+        return self
+
+    def close(self):
+        if self.pools is not None:
+            self.pools.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        if self.batcher is not None:
+            self.batcher.close()
+        if self._writer is not None:
+            self._writer.close()
+            self.output.close(self.model_prompts)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def process(self, item):
+        """Run one dataset item through every stage in order; returns its final state."""
+        state = {"id": item["id"], "item": item}
+        for name in self.config["stage_order"]:
+            spec = self.config["stages"][name]
+            state = STAGE_TYPES[spec["type"]](self, spec, state)
+        return state
+
+    def build_pipeline(self):
+        stages = []
+        for name in self.config["stage_order"]:
+            spec = self.config["stages"][name]
+            assert spec["type"] in STAGE_TYPES, f"unknown stage type {spec['type']}, expected one of {list(STAGE_TYPES)}"
+            workers = spec.get("workers", 4)
+            if spec["type"] == "summarize" and self.batcher is not None:
+                # every summarize worker blocks on its batch, so keep enough of them to fill batches
+                workers = max(workers, 2 * self.batcher.max_batch_size)
+            stage_fn = STAGE_TYPES[spec["type"]]
+            stages.append(Stage(name, lambda state, fn=stage_fn, spec=spec: fn(self, spec, state),
+                                workers, self.config["stage_queue_size"]))
+        return Pipeline(stages)
+
+    def save_run_metadata(self):
+        config = self.config
+        os.makedirs(config["output"]["path"], exist_ok=True)
+        with open(os.path.join(config["output"]["path"], "run_metadata.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "selector": config["selection"]["selector"],
+                "top_k": config["selection"]["top_k"],
+                "iterations": sum(config["stages"][name]["type"] == "refine" for name in config["stage_order"]),
+                "participation": config["participation"],
+                "adaptive_refinement": config["adaptive"]["enabled"],
+                "convergence_threshold": config["adaptive"]["threshold"],
+                "refine_token_budget": config["adaptive"]["token_budget"],
+                "stages": config["stage_order"],
+                "model_sources": self.model_sources,
+            }, f, indent=2, ensure_ascii=False)
+
+    def run(self, limit=None):
+        """Run the whole dataset, skipping items the journal has already finished."""
+        config = self.config
+        items = list(read_dataset(config["dataset"]))
+        if limit:
+            items = items[:limit]
+        if config["output"].get("metadata"):
+            self.save_run_metadata()
+
+        with self:
+            if self.journal is not None:
+                finished = sum(self.journal.is_done(item["id"]) for item in items)
+                items = [item for item in items if not self.journal.is_done(item["id"])]
+                if finished:
+                    logger.info(f"Skipping {finished} items already finished in {self.journal.path}")
+            logger.info(f"Starting concurrent processing of {len(items)} items...")
+            logger.info(f"Run metadata: selector={config['selection']['selector']}, top_k={config['selection']['top_k']}, "
+                        f"participation={config['participation']}, stages={' -> '.join(config['stage_order'])}")
+            results = self.build_pipeline().run(
+                ({"id": item["id"], "item": item} for item in items), total=len(items)
+            )
+
+        deferred = 0
+        for state in results:
+            if isinstance(state.get("error"), SummaryDeferred):
+                deferred += 1
+            elif state["status"] != "success":
+                logger.warning(f"{state['id']}: {state['status']}")
+        logger.info(f"Rate limiter state: {RATE_LIMITS.report()}")
+        logger.info(f"Response cache: {RESPONSE_CACHE.stats()}")
+        if self.journal is not None:
+            logger.info(f"Replayed {self.journal.replayed} stages from {self.journal.path}")
+        if self.batcher is not None:
+            logger.info(f"Summary batching: {self.batcher.stats()}")
+            if deferred:
+                logger.info(f"{deferred} summaries wait in {self.batcher.batch_file}; run and import the batch "
+                            "with colm_batch.py, then re-run")
+        return results
@@ -0,0 +1,85 @@
+"""Prompt builders shared by CoLM.py and the engine stages.
+
+The texts are kept byte-for-byte identical to the original scripts so existing
+response caches stay valid.
+"""
+
+REFINE_SYSTEM_PROMPT = (
+    "You are an expert assistant responsible for refining your own previous response using feedback from other model outputs.\n\n"
+    "Your goals:\n"
+    "- Carefully analyze the provided summary of strong model responses.\n"
+    "- Identify concrete ways to improve factual accuracy, clarity, and reasoning depth.\n"
+    "- Revise your answer to better meet the user's original request, while preserving your unique style and domain expertise.\n\n"
+    "Requirements:\n"
+    "- Your updated response must fully address the user's original question.\n"
+    "- Maintain logical flow and coherence across turns.\n"
+    "- Be specific, accurate, and helpful.\n"
+    "- Output only the final improved answer — do not include any explanations, commentary, or headings.\n\n"
+    "Only return the refined answer text."
+)
+
+TURN_SUMMARY_TEMPLATE = """
+        Round {round} question: {turn}
+        Here are responses from different models:
+        {responses}
+        Please synthesize and refine...
+        """
+
+TURN_REFINE_TEMPLATE = """
+                    ### Round {round}:
+                    #### Question:
+                    {turn}
+
+                    #### Summary of the best response:
+                    {summary}
+
+                    Using the above summary, revise your original answer.  
+                    Ensure the updated response:
+                    - Maintains dialogue flow and consistency with previous turns  
+                    - Preserves factual accuracy  
+                    - Aligns in tone and reasoning style with the summary  
+
+                    **Output only the final improved answer. Do not repeat the question or summary.**
+                    """
+
+
+def selection_messages(selection_prompt, question, specializations, top_k):
+    return [
+        {"role": "system", "content": selection_prompt},
+        {"role": "user", "content": f"Given the question: '{question}', select the {top_k} most relevant specializations from the following:\n\n" +
+                                    "\n".join(specializations) + "\n\nReturn only the names of the most relevant models, separated by commas."}
+    ]
+
+
+def summary_messages(summary_prompt, responses):
+    """One summary over the latest answer of every expert (`responses`: name -> text)."""
+    combined = "\n\n".join([f"{name}:\n{resp}" for name, resp in responses.items()])
+    return [
+        {"role": "system", "content": summary_prompt},
+        {"role": "user", "content": f"Here are multiple responses:\n\n{combined}"}
+    ]
+
+
+def turn_summary_messages(summary_prompt, turn_idx, turn, responses):
+    """Summary of the answers to one turn of a multi-turn question."""
+    joined = "\n\n".join(f"{name}: {resp}" for name, resp in responses.items())
+    return [
+        {"role": "system", "content": summary_prompt},
+        {"role": "user", "content": TURN_SUMMARY_TEMPLATE.format(round=turn_idx + 1, turn=turn, responses=joined)}
+    ]
+
+
+def refine_messages(model_name, prompt, summary, selected_models, question):
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "system", "content": (
+            f"Here is a refined summary of previous answers:\n\n{summary}\n\n"
+            f"{'Your perspective is relevant.' if model_name in selected_models else 'Your perspective is less relevant.'}\n"
+            "Please revise your previous answer based on this summary and the question."
+        )},
+        {"role": "user", "content": question}
+    ]
+
+
+def turn_refine_message(turn_idx, turn, summary):
+    return {"role": "user", "content": TURN_REFINE_TEMPLATE.format(round=turn_idx + 1, turn=turn, summary=summary)}
@@ -0,0 +1,181 @@
+"""Stage types of a CoLM pipeline.
+
+Every stage is `fn(engine, spec, state) -> state`, where `spec` is the stage's
+section of the config and `state` carries one dataset item through the
+pipeline. Expert answers are kept as lists of turns (one turn for single-turn
+datasets) in `state["responses"]`.
+
+    select     pick the experts, the refinement participants and the tracker
+    answer     every selected expert answers every turn (fanned out per provider)
+    summarize  style `turns`: one summary per turn of the current answers;
+               style `rounds`: one summary of the latest answers for round `round`
+    refine     style `conversation`: each participant revises every turn against
+               that turn's summary; style `rounds`: each participant revises its
+               answer against the round's summary
+    write      hand the final answers to the output writer and mark the item done
+"""
+from colm_context import compact_messages, fit_responses
+from colm_convergence import ConvergenceTracker
+from colm_engine.prompts import (
+    REFINE_SYSTEM_PROMPT,
+    refine_messages,
+    summary_messages,
+    turn_refine_message,
+    turn_summary_messages,
+)
+from colm_journal import journal_step
+from colm_participation import participating_experts
+
+
+def question_of(item):
+    return "\n".join(item["turns"])
+
+
+def select_stage(engine, spec, state):
+    config = engine.config
+    state["log"] = engine.journal.for_question(state["id"]) if engine.journal is not None else None
+    state["selected"] = journal_step(state["log"], "select", lambda: engine.choose_models(question_of(state["item"])))
+    state["participants"] = participating_experts(
+        config["participation"], state["selected"], engine.model_prompts, engine.model_sources
+    )
+    state["tracker"] = None
+    if config["adaptive"]["enabled"]:
+        state["tracker"] = ConvergenceTracker(
+            state["participants"], config["adaptive"]["threshold"], config["adaptive"]["token_budget"]
+        )
+    state["responses"] = {}
+    return state
+
+
+def answer_stage(engine, spec, state):
+    item = state["item"]
+
+    def answer(model_name):
+        model_id = engine.model_sources.get(model_name, "gpt-4o")
+        messages = [{"role": "system", "content": engine.model_prompts[model_name]}]
+        turns = []
+        for turn_idx, turn in enumerate(item["turns"]):
+            messages.append({"role": "user", "content": turn})
+            prompt = compact_messages(messages)
+            response = journal_step(
+                state["log"], "answer", lambda: engine.call_model(model_id, prompt), model_name,
+                turn_idx if item["multi_turn"] else None, messages=prompt
+            )
+            turns.append(response)
+            messages.append({"role": "assistant", "content": response})
+        print(f"\n>>> {model_name} initial response: {turns[-1][:100] if turns else ''}...")
+        return turns
+
+    state["responses"] = engine.fan_out(state["selected"], answer)
+    return state
+
+
+def summarize_stage(engine, spec, state):
+    prompt = engine.config["summary"]["prompt"]
+    responses, log = state["responses"], state["log"]
+
+    if spec.get("style", "turns") == "turns":
+        summaries = []
+        for turn_idx, turn in enumerate(state["item"]["turns"]):
+            # near-duplicate answers are merged and long ones trimmed to keep the prompt within budget
+            turn_responses = fit_responses({m: r[turn_idx] for m, r in responses.items() if turn_idx < len(r)})
+            if not turn_responses:
+                continue
+            messages = turn_summary_messages(prompt, turn_idx, turn, turn_responses)
+            summaries.append(journal_step(
+                log, "summary", lambda: engine.summarize(messages), iteration=turn_idx, messages=messages
+            ))
+        state["summary"] = summaries
+        return state
+
+    round_idx, tracker = spec.get("round", 0), state["tracker"]
+    state["summary"] = None
+    if tracker is not None and tracker.done:
+        if not state.get("stopped"):
+            reason = "token budget spent" if tracker.budget_exhausted else "all experts converged"
+            print(f"\n=== Stopping after {round_idx} iteration(s): {reason} ===")
+            state["stopped"] = True
+        return state
+
+    print(f"\n=== Iteration {round_idx + 1}: Refinement ===")
+    current = {m: r[-1] for m, r in responses.items()}
+    messages = summary_messages(prompt, fit_responses(current))
+    state["summary"] = journal_step(log, "summary", lambda: engine.summarize(messages), iteration=round_idx, messages=messages)
+    if tracker is not None:
+        tracker.charge([{"content": prompt}] + [{"content": r} for r in current.values()], state["summary"])
+    return state
+
+
+def refine_stage(engine, spec, state):
+    item, log, responses = state["item"], state["log"], state["responses"]
+    participants = state["participants"]
+
+    if spec.get("style", "conversation") == "conversation":
+        summaries = state["summary"]
+
+        def finalize(model_name):
+            model_id = engine.model_sources.get(model_name, "gpt-4o")
+            messages = [
+                {"role": "system", "content": engine.model_prompts[model_name]},
+                {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+            ]
+            turns = []
+            for turn_idx, turn in enumerate(item["turns"]):
+                messages.append(turn_refine_message(turn_idx, turn, summaries[turn_idx] if turn_idx < len(summaries) else ""))
+                # earlier turns are trimmed once the conversation outgrows the budget
+                prompt = compact_messages(messages)
+                response = journal_step(
+                    log, "refine", lambda: engine.call_model(model_id, prompt), model_name, turn_idx, messages=prompt
+                )
+                turns.append(response)
+                messages.append({"role": "assistant", "content": response})
+            print(turns)
+            return turns
+
+        refined = engine.fan_out([m for m in engine.model_prompts if m in participants], finalize)
+    else:
+        if state["summary"] is None:
+            return state
+        round_idx, tracker, summary = spec.get("round", 0), state["tracker"], state["summary"]
+        question = question_of(item)
+        # experts already converged are not re-queried
+        active = [m for m in engine.model_prompts if m in participants and (tracker is None or m in tracker.active)]
+
+        def revise(model_name):
+            model_id = engine.model_sources.get(model_name, "gpt-4o")
+            messages = refine_messages(model_name, engine.model_prompts[model_name], summary, state["selected"], question)
+            response = journal_step(
+                log, "refine", lambda: engine.call_model(model_id, messages), model_name, round_idx, messages=messages
+            )
+            print(f"\n>>> {model_name} refined response (iteration {round_idx + 1}): {response[:100]}...")
+            return messages, response
+
+        results = engine.fan_out(active, revise)
+        refined = {m: [response] for m, (_, response) in results.items()}
+        if tracker is not None:
+            for messages, response in results.values():
+                tracker.charge(messages, response)
+            tracker.update({m: r[-1] for m, r in responses.items()}, {m: r[-1] for m, r in refined.items()}, summary)
+
+    # experts outside the participation policy keep their previous answer, if they have one
+    state["responses"] = {
+        m: refined[m] if m in refined else responses[m]
+        for m in engine.model_prompts if m in refined or m in responses
+    }
+    return state
+
+
+def write_stage(engine, spec, state):
+    engine.output.write(state)
+    if engine.journal is not None:
+        engine.journal.mark_done(state["id"])
+    return state
+
+
+STAGE_TYPES = {
+    "select": select_stage,
+    "answer": answer_stage,
+    "summarize": summarize_stage,
+    "refine": refine_stage,
+    "write": write_stage,
+}
@@ -0,0 +1,384 @@
+"""
+Inference gateway: maps the model names used by CoLM and the generate scripts
+to backends described in colm_gateway.yaml.
+
+Backend types:
+    openai    any OpenAI-compatible HTTP endpoint (api_base, api_key_env)
+    fastchat  a FastChat openai_api_server (defaults to http://localhost:8000/v1)
+    mock      a deterministic in-process model with configurable latency,
+              token throughput and error rates, for offline benchmarks
+
+Set COLM_GATEWAY_CONFIG to use another config file and COLM_GATEWAY_BACKEND to
+send every model to one backend, e.g. `COLM_GATEWAY_BACKEND=mock python CoLM.py`.
+
+The mock can also be served over HTTP, so the openai backend (and everything
+else that speaks the OpenAI API) can be benchmarked against it:
+python colm_gateway.py --serve-mock --port 8001
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+from colm_clients import CLIENT_REGISTRY
+
+BACKEND_TYPES = ("openai", "fastchat", "mock")
+FASTCHAT_API_BASE = "http://localhost:8000/v1"
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "colm_gateway.yaml")
+
+# the expert-selection prompt built by select_models
+SELECTION_PATTERN = re.compile(r"select the (\d+) most relevant specializations from the following:\n\n(.*?)\n\nReturn", re.S)
+
+
+def sample_latency(rng, spec):
+    """Seconds drawn from a latency spec: a number, or a dict with a `distribution`."""
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    distribution = spec.get("distribution", "constant")
+    if distribution == "constant":
+        value = spec["value"]
+    elif distribution == "uniform":
+        value = rng.uniform(spec["low"], spec["high"])
+    elif distribution == "normal":
+        value = rng.gauss(spec["mean"], spec["std"])
+    elif distribution == "lognormal":
+        # `median` in seconds, `sigma` of the underlying normal
+        value = spec["median"] * rng.lognormvariate(0, spec["sigma"])
+    else:
+        raise ValueError(f"unknown latency distribution {distribution}")
+    return max(0.0, value)
+
+
+class MockAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = None
+
+
+def _message(content, prompt_tokens, completion_tokens, logprobs=None):
+    if logprobs is not None:
+        logprobs = types.SimpleNamespace(content=[
+            types.SimpleNamespace(token=token, logprob=logprob) for token, logprob in zip(content.split(" "), logprobs)
+        ])
+    return types.SimpleNamespace(
+        choices=[types.SimpleNamespace(index=0, message=types.SimpleNamespace(role="assistant", content=content),
+                                       logprobs=logprobs, finish_reason="stop")],
+        usage=types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                    total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+def _chunk(delta):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(index=0, delta=types.SimpleNamespace(content=delta))])
+
+
+class MockBackend:
+    """Deterministic fake model.
+
+    Every call is planned from (seed, model, messages, attempt number), so a run
+    replays identically regardless of scheduling, and a retried request gets a
+    fresh draw for its error instead of failing forever.
+    """
+
+    def __init__(self, latency=0.5, tokens_per_second=50.0, completion_tokens=(50, 400),
+                 error_rate=0.0, rate_limit_rate=0.0, difficulty=(0.0, 0.6), chunk_words=8, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = tuple(completion_tokens)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.difficulty = tuple(difficulty)
+        self.chunk_words = chunk_words
+        self.seed = seed
+        self.calls = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget attempt counts, so the next run replays the same draws."""
+        with self._lock:
+            self._attempts = {}
+            self.calls = 0
+
+    def _answer(self, rng, model, digest, max_tokens, temperature=0):
+        """Words of the answer and the request's difficulty.
+
+        The answer is fixed per request; sampling at temperature > 0 resamples a
+        share of its words that grows with the request's difficulty, so harder
+        requests get less self-consistent samples and lower logprobs.
+        """
+        base = random.Random(f"{self.seed}:{digest}:answer")
+        difficulty = base.uniform(*self.difficulty)
+        low, high = self.completion_tokens
+        tokens = base.randint(low, high)
+        if max_tokens:
+            tokens = min(tokens, max_tokens)
+        words = [f"{model}-{digest[:6]}"] + [f"w{base.randint(0, 999)}" for _ in range(tokens - 1)]
+        if temperature:
+            resample = difficulty * min(temperature, 1.0)
+            words = [w if i == 0 or rng.random() >= resample else f"w{rng.randint(0, 999)}" for i, w in enumerate(words)]
+        return words, difficulty
+
+    def plan(self, model, messages, max_tokens=None, json_mode=False, temperature=0, logprobs=False):
+        if any(not isinstance(m.get("content"), str) for m in messages):
+            raise MockAPIError(400, "message content must be a string")
+        digest = hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.calls += 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            error = 429
+        elif roll < self.rate_limit_rate + self.error_rate:
+            error = 500
+        else:
+            error = None
+
+        selection = SELECTION_PATTERN.search(messages[-1].get("content") or "") if messages else None
+        if selection:
+            # answer expert selection in the format the selector parses
+            names = rng.sample(selection.group(2).split("\n"), int(selection.group(1)))
+            words = ", ".join(names).split(" ")
+        elif json_mode:
+            # JSON mode over a list of tasks (colm_batch) answers every task id
+            try:
+                tasks = json.loads(messages[-1]["content"])
+                ids = [str(task["id"]) for task in tasks]
+            except (ValueError, TypeError, KeyError):
+                ids = ["answer"]
+            budget = max_tokens // len(ids) if max_tokens else None
+            words = json.dumps({i: " ".join(self._answer(rng, model, f"{digest}:{i}", budget)[0]) for i in ids}).split(" ")
+        else:
+            words, difficulty = self._answer(rng, model, digest, max_tokens, temperature)
+        return {
+            "error": error,
+            "logprobs": [math.log(1 - difficulty * rng.random()) for _ in words] if logprobs and not (selection or json_mode) else None,
+            "ttft": sample_latency(rng, self.latency),
+            "words": words,
+            "prompt_tokens": sum(len(m.get("content") or "") for m in messages) // 4,
+        }
+
+    def _chunks(self, words):
+        for i in range(0, len(words), self.chunk_words):
+            piece = words[i:i + self.chunk_words]
+            yield (" " if i else "") + " ".join(piece), len(piece) / self.tokens_per_second
+
+    def _raise(self, plan, model):
+        if plan["error"] == 429:
+            raise MockAPIError(429, f"mock rate limit for {model}")
+        raise MockAPIError(500, f"mock server error for {model}")
+
+    def create(self, model, messages, max_tokens=None, stream=False, response_format=None,
+                temperature=None, logprobs=None, **kwargs):
+        plan = self.plan(model, messages, max_tokens, (response_format or {}).get("type") == "json_object",
+                         temperature or 0, bool(logprobs))
+        time.sleep(plan["ttft"])
+        if plan["error"]:
+            self._raise(plan, model)
+        if stream:
+            return self._stream(plan)
+        time.sleep(len(plan["words"]) / self.tokens_per_second)
+        return _message(" ".join(plan["words"]), plan["prompt_tokens"], len(plan["words"]), plan["logprobs"])
+
+    def _stream(self, plan):
+        for delta, delay in self._chunks(plan["words"]):
+            time.sleep(delay)
+            yield _chunk(delta)
+
+    async def acreate(self, model, messages, max_tokens=None, stream=False, response_format=None,
+                temperature=None, logprobs=None, **kwargs):
+        plan = self.plan(model, messages, max_tokens, (response_format or {}).get("type") == "json_object",
+                         temperature or 0, bool(logprobs))
+        await asyncio.sleep(plan["ttft"])
+        if plan["error"]:
+            self._raise(plan, model)
+        if stream:
+            return self._astream(plan)
+        await asyncio.sleep(len(plan["words"]) / self.tokens_per_second)
+        return _message(" ".join(plan["words"]), plan["prompt_tokens"], len(plan["words"]), plan["logprobs"])
+
+    async def _astream(self, plan):
+        for delta, delay in self._chunks(plan["words"]):
+            await asyncio.sleep(delay)
+            yield _chunk(delta)
+
+
+class MockClient:
+    """OpenAI-client-shaped front for a MockBackend."""
+
+    def __init__(self, backend, asynchronous=False):
+        self.backend = backend
+        self.asynchronous = asynchronous
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(
+            create=backend.acreate if asynchronous else backend.create
+        ))
+
+    def close(self):
+        if self.asynchronous:
+            return asyncio.sleep(0)
+
+
+class RoutedClient:
+    """Sends requests to `client` under the backend's own model name."""
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        kwargs["model"] = self.model
+        return self.client.chat.completions.create(**kwargs)
+
+    def close(self):
+        return self.client.close()
+
+
+class Gateway:
+    def __init__(self, config, override=None):
+        self.backends = config.get("backends", {})
+        self.models = config.get("models") or {}
+        self.experts = config.get("experts") or {}
+        self.override = override
+        self._mocks = {}
+        for name, backend in self.backends.items():
+            assert backend.get("type") in BACKEND_TYPES, f"backend {name}: type must be one of {BACKEND_TYPES}"
+        assert override is None or override in self.backends, f"unknown backend {override}"
+
+    def route(self, name):
+        """(backend name, backend model name) for a model name."""
+        entry = self.models.get(name, {})
+        backend = self.override or entry.get("backend") or "openai"
+        return backend, entry.get("model", name)
+
+    def mock(self, backend_name):
+        if backend_name not in self._mocks:
+            spec = {k: v for k, v in self.backends[backend_name].items() if k != "type"}
+            self._mocks[backend_name] = MockBackend(**spec)
+        return self._mocks[backend_name]
+
+    def client(self, name, asynchronous=False, registry=None):
+        backend_name, model = self.route(name)
+        backend = self.backends[backend_name]
+        if backend["type"] == "mock":
+            client = MockClient(self.mock(backend_name), asynchronous)
+        else:
+            registry = registry or CLIENT_REGISTRY
+            api_base = backend.get("api_base") or (FASTCHAT_API_BASE if backend["type"] == "fastchat" else None)
+            api_key = os.environ[backend["api_key_env"]] if backend.get("api_key_env") else backend.get("api_key")
+            if backend["type"] == "fastchat":
+                api_key = api_key or "EMPTY"
+            client = registry.get("openai_async" if asynchronous else "openai", api_base, api_key)
+        return client if model == name else RoutedClient(client, model)
+
+    def clients(self, names, asynchronous=False, registry=None):
+        return {name: self.client(name, asynchronous, registry) for name in names}
+
+    def model_sources(self, defaults):
+        """Expert -> model mapping, with the config's `experts` section applied on top."""
+        return {**defaults, **self.experts}
+
+    def reset_mocks(self):
+        for mock in self._mocks.values():
+            mock.reset()
+
+    def stats(self):
+        return {name: {"calls": mock.calls} for name, mock in self._mocks.items()}
+
+
+def load_gateway(path=None, override=None):
+    path = path or os.environ.get("COLM_GATEWAY_CONFIG", DEFAULT_CONFIG)
+    config = {"backends": {"openai": {"type": "openai", "api_key_env": "OPENAI_API_KEY"}}}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.load(f, Loader=yaml.SafeLoader)
+    return Gateway(config, override or os.environ.get("COLM_GATEWAY_BACKEND") or None)
+
+
+GATEWAY = load_gateway()
+
+
+def mock_handler(backend):
+    class MockHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._json(200, {"object": "list", "data": []})
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            model = request.get("model", "mock")
+            try:
+                response = backend.create(model, request.get("messages", []), request.get("max_tokens"),
+                                          request.get("stream", False), request.get("response_format"),
+                                          request.get("temperature"), request.get("logprobs"))
+            except MockAPIError as e:
+                return self._json(e.status_code, {"error": {"message": str(e), "code": e.status_code}})
+
+            if not request.get("stream"):
+                usage = response.usage
+                choice = response.choices[0]
+                logprobs = None
+                if choice.logprobs is not None:
+                    logprobs = {"content": [{"token": t.token, "logprob": t.logprob} for t in choice.logprobs.content]}
+                return self._json(200, {
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": choice.message.content},
+                                 "logprobs": logprobs, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+                              "total_tokens": usage.total_tokens},
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for chunk in response:
+                event = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {"content": chunk.choices[0].delta.content}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return MockHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve-mock", action="store_true", help="Serve a mock backend over the OpenAI HTTP API.")
+    parser.add_argument("--backend", type=str, default="mock", help="Mock backend from the config to serve.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    if args.serve_mock:
+        server = ThreadingHTTPServer((args.host, args.port), mock_handler(GATEWAY.mock(args.backend)))
+        print(f"Mock backend '{args.backend}' listening on http://{args.host}:{args.port}/v1")
+        server.serve_forever()
+    else:
+        for name in ["gpt-4o", "deepseek-chat", "qwen-math-plus", "qwen-coder-plus"]:
+            print(name, "->", GATEWAY.route(name))
@@ -0,0 +1,161 @@
+"""
+Checkpoint journal for the CoLM generation scripts.
+
+Every completed stage of every question (selection, each expert answer, each
+summary, each refinement) is appended to a JSONL journal. On restart the
+scripts replay recorded stages instead of calling the model again, and skip
+questions that were already finished.
+
+Usage (progress and cost report from the journal alone):
+python colm_journal.py output/journal.jsonl --total 500
+python colm_journal.py output/journal.jsonl --config arena_hard
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+
+from colm_metrics import call_stage
+from colm_ratelimit import estimate_tokens
+from colm_writer import JsonlWriter, read_jsonl
+
+# USD per 1M (prompt, completion) tokens, used only for the cost report
+PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "deepseek-chat": (0.27, 1.1),
+    "qwen-math-plus": (0.6, 1.8),
+    "qwen-coder-plus": (0.5, 1.0),
+}
+
+
+def _key(qid, stage, model=None, iteration=None):
+    return (str(qid), stage, model, iteration)
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.replayed = 0
+        self._entries = {}
+        self._done = set()
+        self._lock = threading.Lock()
+        for entry in read_jsonl(path):
+            self._index(entry)
+        self._writer = JsonlWriter()
+
+    def _index(self, entry):
+        if entry["stage"] == "done":
+            self._done.add(str(entry["qid"]))
+        else:
+            self._entries[_key(entry["qid"], entry["stage"], entry.get("model"), entry.get("iteration"))] = entry["value"]
+
+    def is_done(self, qid):
+        return str(qid) in self._done
+
+    def record(self, qid, stage, value=None, model=None, iteration=None, prompt_tokens=None, completion_tokens=None):
+        entry = {"qid": qid, "stage": stage, "model": model, "iteration": iteration, "value": value,
+                 "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "tstamp": time.time()}
+        with self._lock:
+            self._index(entry)
+        self._writer.write(self.path, entry)
+
+    def step(self, qid, stage, fn, model=None, iteration=None, messages=None):
+        """Return the recorded value of this stage, or run `fn()` and record its result.
+
+        Empty results are not recorded, so failed calls are retried on the next run.
+        """
+        key = _key(qid, stage, model, iteration)
+        with self._lock:
+            if key in self._entries:
+                self.replayed += 1
+                return self._entries[key]
+        with call_stage(stage):
+            value = fn()
+        if value:
+            text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+            self.record(
+                qid, stage, value, model, iteration,
+                prompt_tokens=estimate_tokens(messages) if messages else None,
+                completion_tokens=len(text) // 4,
+            )
+        return value
+
+    def mark_done(self, qid):
+        self.record(qid, "done")
+
+    def for_question(self, qid):
+        return QuestionJournal(self, qid)
+
+    def close(self):
+        self._writer.close()
+
+
+class QuestionJournal:
+    """A journal bound to one question id, passed down into the stage functions."""
+
+    def __init__(self, journal, qid):
+        self.journal = journal
+        self.qid = qid
+
+    def step(self, stage, fn, model=None, iteration=None, messages=None):
+        return self.journal.step(self.qid, stage, fn, model, iteration, messages)
+
+
+def journal_step(log, stage, fn, model=None, iteration=None, messages=None):
+    """Run `fn` through `log` when a QuestionJournal is given, otherwise call it directly."""
+    if log is None:
+        with call_stage(stage):
+            return fn()
+    return log.step(stage, fn, model, iteration, messages)
+
+
+def report(path, total=None, model_sources=None):
+    entries = read_jsonl(path)
+    questions = {str(e["qid"]) for e in entries}
+    done = {str(e["qid"]) for e in entries if e["stage"] == "done"}
+    stages = defaultdict(int)
+    tokens = defaultdict(lambda: [0, 0])
+    for e in entries:
+        if e["stage"] == "done":
+            continue
+        stages[e["stage"]] += 1
+        model = e.get("model") or "gpt-4o"
+        model = (model_sources or {}).get(model, model)
+        tokens[model][0] += e.get("prompt_tokens") or 0
+        tokens[model][1] += e.get("completion_tokens") or 0
+
+    cost = {}
+    for model, (prompt, completion) in tokens.items():
+        price_in, price_out = PRICES.get(model, (0.0, 0.0))
+        cost[model] = round((prompt * price_in + completion * price_out) / 1e6, 4)
+
+    summary = {
+        "questions_started": len(questions),
+        "questions_done": len(done),
+        "stages_recorded": dict(stages),
+        "estimated_tokens": {model: {"prompt": p, "completion": c} for model, (p, c) in tokens.items()},
+        "estimated_cost_usd": cost,
+        "estimated_total_cost_usd": round(sum(cost.values()), 4),
+    }
+    if total:
+        summary["progress"] = f"{len(done)}/{total} ({100 * len(done) / total:.1f}%)"
+        if done:
+            summary["projected_total_cost_usd"] = round(sum(cost.values()) / len(done) * total, 2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("journal", type=str)
+    parser.add_argument("--total", type=int, default=None, help="Number of questions in the run, for progress.")
+    parser.add_argument("--config", type=str, default=None, help="Pipeline config of the run (defaults only if omitted).")
+    args = parser.parse_args()
+
+    # imported here: colm_engine imports this module
+    from colm_engine import load_config
+
+    # expert -> model as the config resolves it, so each expert's tokens are priced at its source
+
+    model_sources = {name: spec["source"] for name, spec in load_config(args.config)["experts"].items()}
+    print(json.dumps(report(args.journal, args.total, model_sources), indent=4))
@@ -0,0 +1,69 @@
+"""
+Per-call accounting for CoLM runs.
+
+Call sites tag their model calls with a stage (`with call_stage("answer"):`) and
+the benchmark tags each question (`with call_question(qid):`); both are context
+variables, so they follow asyncio tasks and stay per-thread in worker pools.
+A CallRecorder listens on the rate limiter registry and stores one record per
+API call with its stage, question, provider, model, latency, retries and token
+usage. Streaming calls record the time until the stream opened.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from colm_ratelimit import RATE_LIMITS
+
+CURRENT_STAGE = contextvars.ContextVar("colm_stage", default="other")
+CURRENT_QUESTION = contextvars.ContextVar("colm_question", default=None)
+
+
+@contextlib.contextmanager
+def call_stage(name):
+    token = CURRENT_STAGE.set(name)
+    try:
+        yield
+    finally:
+        CURRENT_STAGE.reset(token)
+
+
+@contextlib.contextmanager
+def call_question(question_id):
+    token = CURRENT_QUESTION.set(question_id)
+    try:
+        yield
+    finally:
+        CURRENT_QUESTION.reset(token)
+
+
+class CallRecorder:
+    def __init__(self, registry=None):
+        self.registry = RATE_LIMITS if registry is None else registry
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        usage = event["usage"]
+        record = {
+            "stage": CURRENT_STAGE.get(),
+            "question_id": CURRENT_QUESTION.get(),
+            "provider": event["provider"],
+            "model": event["model"],
+            "latency": event["latency"],
+            "service_time": event["service_time"],
+            "retries": event["retries"],
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "error": event["error"],
+            "tstamp": time.time(),
+        }
+        with self._lock:
+            self.calls.append(record)
+
+    def __enter__(self):
+        self.registry.add_listener(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.remove_listener(self)
@@ -0,0 +1,28 @@
+"""Which experts take part in the CoLM refinement rounds.
+
+Policies:
+    selected        only the experts picked by the selector
+    selected+cheap  the selected experts plus every expert served by a cheap model
+    all             every expert in model_prompts (the original behaviour)
+
+Experts that do not participate keep their previous answer.
+"""
+
+PARTICIPATION_POLICIES = ("selected", "selected+cheap", "all")
+
+# model sources cheap enough to keep refining even when not selected
+CHEAP_SOURCES = {"deepseek-chat", "qwen-math-plus", "qwen-coder-plus"}
+
+
+def participating_experts(policy, selected, model_prompts, model_sources, cheap_sources=None):
+    assert policy in PARTICIPATION_POLICIES, f"unknown participation policy {policy}, expected one of {PARTICIPATION_POLICIES}"
+    cheap_sources = CHEAP_SOURCES if cheap_sources is None else cheap_sources
+    if policy == "all":
+        return list(model_prompts)
+    participants = [name for name in model_prompts if name in selected]
+    if policy == "selected+cheap":
+        participants += [
+            name for name in model_prompts
+            if name not in selected and model_sources.get(name, "gpt-4o") in cheap_sources
+        ]
+    return participants
@@ -0,0 +1,195 @@
+"""Stage-based pipeline scheduler for the CoLM generation scripts.
+
+Every stage (select -> respond -> summarize -> finalize) owns a bounded input
+queue and its own pool of worker threads, so different questions sit in
+different stages at the same time. Model calls inside a stage can be fanned out
+through per-provider executors, which keeps one slow provider from starving the
+others.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from tqdm import tqdm
+
+_STOP = object()
+
+
+class Stage:
+    """One pipeline stage: `fn(state) -> state` run by `num_workers` threads."""
+
+    def __init__(self, name, fn, num_workers=4, max_queue=64):
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._alive = num_workers
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            self.busy_time += elapsed
+            if ok:
+                self.processed += 1
+            else:
+                self.failed += 1
+
+    def sample_depth(self):
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+        return depth
+
+    def worker_done(self):
+        """Return True when the last worker of this stage has exited."""
+        with self._lock:
+            self._alive -= 1
+            return self._alive == 0
+
+    def stats(self, elapsed):
+        return {
+            "stage": self.name,
+            "workers": self.num_workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "throughput_per_min": round(60 * self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "utilization": round(self.busy_time / (elapsed * self.num_workers), 3) if elapsed > 0 else 0.0,
+        }
+
+
+class ProviderPool:
+    """Per-provider thread pools used to fan model calls out inside a stage."""
+
+    def __init__(self, workers_per_provider, default_workers=8):
+        self.workers_per_provider = dict(workers_per_provider)
+        self.default_workers = default_workers
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def executor(self, provider):
+        with self._lock:
+            if provider not in self._executors:
+                workers = self.workers_per_provider.get(provider, self.default_workers)
+                self._executors[provider] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=f"provider-{provider}"
+                )
+            return self._executors[provider]
+
+    def submit(self, provider, fn, *args, **kwargs):
+        return self.executor(provider).submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+            self._executors = {}
+
+
+class Pipeline:
+    """Run items through a chain of stages connected by bounded queues.
+
+    Each item is a state dict that must carry an `"id"` key. A stage that raises
+    marks the item as failed and it skips the remaining stages.
+    """
+
+    def __init__(self, stages, report_interval=30):
+        self.stages = stages
+        self.report_interval = report_interval
+        self._results = queue.Queue()
+        self._start = None
+        self._finished = threading.Event()
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_queue = self.stages[index + 1].queue if index + 1 < len(self.stages) else None
+        while True:
+            state = stage.queue.get()
+            if state is _STOP:
+                break
+            stage.sample_depth()
+            start = time.time()
+            try:
+                state = stage.fn(state)
+                ok = True
+            except Exception as e:
+                state["status"] = f"failed at {stage.name}: {e}"
+                state["error"] = e
+                ok = False
+            stage.record(time.time() - start, ok)
+
+            if ok and next_queue is not None:
+                next_queue.put(state)
+            else:
+                state.setdefault("status", "success")
+                self._results.put(state)
+
+        if stage.worker_done():
+            if next_queue is not None:
+                for _ in range(self.stages[index + 1].num_workers):
+                    next_queue.put(_STOP)
+            else:
+                self._results.put(_STOP)
+
+    def _monitor(self):
+        while not self._finished.wait(self.report_interval):
+            self.log_report()
+
+    def _feed(self, items):
+        first = self.stages[0]
+        for item in items:
+            first.queue.put(item)
+        for _ in range(first.num_workers):
+            first.queue.put(_STOP)
+
+    def report(self):
+        elapsed = time.time() - self._start if self._start else 0.0
+        for stage in self.stages:
+            stage.sample_depth()
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def log_report(self):
+        for stats in self.report():
+            logger.info(
+                f"[{stats['stage']}] processed={stats['processed']} failed={stats['failed']} "
+                f"queue={stats['queue_depth']} (max {stats['max_queue_depth']}) "
+                f"throughput={stats['throughput_per_min']}/min utilization={stats['utilization']}"
+            )
+
+    def run(self, items, total=None):
+        """Push `items` through all stages and return the final states in completion order."""
+        self._start = time.time()
+        self._finished.clear()
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.num_workers):
+                threads.append(threading.Thread(
+                    target=self._worker, args=(index,), name=f"{stage.name}-{i}", daemon=True
+                ))
+        monitor = threading.Thread(target=self._monitor, daemon=True)
+        for thread in threads:
+            thread.start()
+        monitor.start()
+
+        results = []
+        with tqdm(total=total, desc="Processing") as pbar:
+            while True:
+                state = self._results.get()
+                if state is _STOP:
+                    break
+                results.append(state)
+                pbar.update(1)
+
+        for thread in threads:
+            thread.join()
+        self._finished.set()
+        monitor.join()
+        self.log_report()
+        return results
@@ -0,0 +1,324 @@
+"""Per-provider rate limiting and adaptive concurrency for CoLM model calls.
+
+Each (provider, model) pair gets token buckets for requests and tokens per
+minute plus an AIMD concurrency window: the window grows by roughly one slot per
+round of successful calls and is cut multiplicatively on a 429 or when latency
+drifts past its target. Throttled and transient failures are retried with
+jittered exponential backoff instead of turning into empty answers.
+"""
+import asyncio
+import random
+import threading
+import time
+
+# Limits per provider; a model inherits its provider's limits unless it has an
+# entry in MODEL_LIMITS.
+PROVIDER_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 300000, "max_concurrency": 64, "latency_target": 30.0},
+    "deepseek": {"rpm": 300, "tpm": 200000, "max_concurrency": 32, "latency_target": 45.0},
+    "qwen": {"rpm": 300, "tpm": 200000, "max_concurrency": 32, "latency_target": 45.0},
+}
+DEFAULT_LIMITS = {"rpm": 60, "tpm": 60000, "max_concurrency": 8, "latency_target": 60.0}
+MODEL_LIMITS = {}
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+POLL_INTERVAL = 0.05
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call is still throttled after MAX_RETRIES attempts."""
+
+
+def estimate_tokens(messages, max_tokens=0):
+    """Rough token estimate (4 characters per token) used to reserve TPM budget."""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + max_tokens
+
+
+def is_rate_limited(e):
+    return getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+
+
+def is_retryable(e):
+    if is_rate_limited(e):
+        return True
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status >= 500
+    return type(e).__name__ in ("APIConnectionError", "APITimeoutError", "TimeoutError", "ConnectionError")
+
+
+def retry_after(e):
+    """Seconds requested by the server's Retry-After header, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding at most `per_minute` units."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount):
+        """Consume `amount` and return 0, or return the seconds to wait before retrying."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def refund(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AIMDWindow:
+    """Additive-increase / multiplicative-decrease concurrency window."""
+
+    def __init__(self, max_concurrency, min_concurrency=1, initial=None, decrease=0.5, latency_decrease=0.9):
+        self.max_limit = float(max_concurrency)
+        self.min_limit = float(min_concurrency)
+        self.limit = float(initial or max(min_concurrency, max_concurrency // 4))
+        self.decrease = decrease
+        self.latency_decrease = latency_decrease
+        self.in_flight = 0
+
+    def try_enter(self):
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def leave(self):
+        self.in_flight -= 1
+
+    def on_success(self, latency, latency_target):
+        if latency_target and latency > latency_target:
+            self.limit = max(self.min_limit, self.limit * self.latency_decrease)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class RateLimiter:
+    """RPM/TPM buckets and an AIMD window for one (provider, model) pair."""
+
+    def __init__(self, rpm, tpm, max_concurrency, latency_target=None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.window = AIMDWindow(max_concurrency)
+        self.latency_target = latency_target
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, est_tokens):
+        """Return 0 once a slot and the budget are reserved, otherwise the seconds to wait."""
+        with self._lock:
+            if not self.window.try_enter():
+                return POLL_INTERVAL
+            wait = self.requests.try_consume(1)
+            if wait == 0:
+                wait = self.tokens.try_consume(est_tokens)
+                if wait > 0:
+                    self.requests.refund(1)
+            if wait > 0:
+                self.window.leave()
+            return wait
+
+    def acquire(self, est_tokens):
+        while True:
+            wait = self._try_acquire(est_tokens)
+            if wait == 0:
+                return
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, est_tokens):
+        while True:
+            wait = self._try_acquire(est_tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, est_tokens, used_tokens=None, latency=None, throttled=False):
+        with self._lock:
+            self.window.leave()
+            if throttled:
+                self.throttled += 1
+                self.window.on_throttle()
+            elif latency is not None:
+                self.window.on_success(latency, self.latency_target)
+            if used_tokens is not None and used_tokens < est_tokens:
+                self.tokens.refund(est_tokens - used_tokens)
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class RateLimiterRegistry:
+    """Lazily builds one RateLimiter per (provider, model)."""
+
+    def __init__(self, provider_limits=None, model_limits=None):
+        self.provider_limits = PROVIDER_LIMITS if provider_limits is None else provider_limits
+        self.model_limits = MODEL_LIMITS if model_limits is None else model_limits
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self.listeners = []
+
+    def add_listener(self, fn):
+        """Call `fn(event)` after every limited call; events carry latency, retries and usage."""
+        self.listeners.append(fn)
+
+    def remove_listener(self, fn):
+        self.listeners.remove(fn)
+
+    def _notify(self, provider, model, began, attempt, service_time=None, response=None, error=None):
+        if not self.listeners:
+            return
+        event = {
+            "provider": provider,
+            "model": model,
+            "latency": time.monotonic() - began,
+            "service_time": service_time,
+            "retries": attempt,
+            "usage": getattr(response, "usage", None),
+            "error": type(error).__name__ if error is not None else None,
+        }
+        for fn in list(self.listeners):
+            fn(event)
+
+    def get(self, provider, model):
+        key = (provider, model)
+        with self._lock:
+            if key not in self._limiters:
+                limits = dict(DEFAULT_LIMITS)
+                limits.update(self.provider_limits.get(provider, {}))
+                limits.update(self.model_limits.get(model, {}))
+                self._limiters[key] = RateLimiter(**limits)
+            return self._limiters[key]
+
+    def call(self, provider, model, fn, est_tokens):
+        """Run `fn()` under the (provider, model) limits, retrying throttled calls."""
+        limiter = self.get(provider, model)
+        began = time.monotonic()
+        for attempt in range(MAX_RETRIES):
+            limiter.acquire(est_tokens)
+            start = time.monotonic()
+            try:
+                response = fn()
+            except Exception as e:
+                limiter.release(est_tokens, throttled=is_rate_limited(e))
+                if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                    self._notify(provider, model, began, attempt, error=e)
+                    if is_rate_limited(e):
+                        raise RateLimitExceeded(f"{provider}/{model} still throttled after {MAX_RETRIES} attempts") from e
+                    raise
+                time.sleep(retry_after(e) or backoff_delay(attempt))
+                continue
+            service_time = time.monotonic() - start
+            limiter.release(est_tokens, _used_tokens(response), service_time)
+            self._notify(provider, model, began, attempt, service_time, response)
+            return response
+
+    async def acall(self, provider, model, fn, est_tokens):
+        """Async variant of `call`; `fn()` must return an awaitable."""
+        limiter = self.get(provider, model)
+        began = time.monotonic()
+        for attempt in range(MAX_RETRIES):
+            await limiter.acquire_async(est_tokens)
+            start = time.monotonic()
+            try:
+                response = await fn()
+            except Exception as e:
+                limiter.release(est_tokens, throttled=is_rate_limited(e))
+                if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                    self._notify(provider, model, began, attempt, error=e)
+                    if is_rate_limited(e):
+                        raise RateLimitExceeded(f"{provider}/{model} still throttled after {MAX_RETRIES} attempts") from e
+                    raise
+                await asyncio.sleep(retry_after(e) or backoff_delay(attempt))
+                continue
+            service_time = time.monotonic() - start
+            limiter.release(est_tokens, _used_tokens(response), service_time)
+            self._notify(provider, model, began, attempt, service_time, response)
+            return response
+
+    async def astream(self, provider, model, fn, est_tokens):
+        """Streaming variant of `acall`: yields the chunks of the stream `fn()` opens.
+
+        The concurrency slot is held until the stream is consumed or fails, not
+        just while it is opened. Only opening the stream is retried; an error
+        mid-stream is raised to the caller. The latency fed to the AIMD window is
+        the time to the first chunk, so long answers do not read as congestion.
+        """
+        limiter = self.get(provider, model)
+        began = time.monotonic()
+        for attempt in range(MAX_RETRIES):
+            await limiter.acquire_async(est_tokens)
+            start = time.monotonic()
+            try:
+                stream = await fn()
+            except Exception as e:
+                limiter.release(est_tokens, throttled=is_rate_limited(e))
+                if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                    self._notify(provider, model, began, attempt, error=e)
+                    if is_rate_limited(e):
+                        raise RateLimitExceeded(f"{provider}/{model} still throttled after {MAX_RETRIES} attempts") from e
+                    raise
+                await asyncio.sleep(retry_after(e) or backoff_delay(attempt))
+                continue
+            error = None
+            first_chunk = None
+            try:
+                async for chunk in stream:
+                    if first_chunk is None:
+                        first_chunk = time.monotonic() - start
+                    yield chunk
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                service_time = time.monotonic() - start
+                if error is None:
+                    limiter.release(est_tokens, latency=service_time if first_chunk is None else first_chunk)
+                else:
+                    limiter.release(est_tokens, throttled=is_rate_limited(error))
+                self._notify(provider, model, began, attempt, service_time, error=error)
+            return
+
+    def report(self):
+        return {
+            f"{provider}/{model}": {
+                "concurrency_limit": round(limiter.window.limit, 2),
+                "in_flight": limiter.window.in_flight,
+                "throttled": limiter.throttled,
+            }
+            for (provider, model), limiter in self._limiters.items()
+        }
+
+
+RATE_LIMITS = RateLimiterRegistry()
@@ -0,0 +1,158 @@
+"""Local specialization router for CoLM.
+
+Scores a question against each expert specialization with a small TF-IDF index
+built from the expert's system prompt, a short description and a handful of
+prototypical questions, and returns the top_k experts without a network round
+trip. When the best match is too weak to trust, `route` returns None so the
+caller can fall back to the LLM selector. Decisions are memoized per question
+hash.
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+
+SPECIALIZATION_PROFILES = {
+    "qwen-math": {
+        "description": "mathematics, arithmetic, algebra, geometry, calculus, probability, statistics, "
+                       "equations, proofs, numbers, formulas, compute, solve, calculate",
+        "examples": [
+            "Solve for x: 3x + 7 = 22.",
+            "What is the probability of rolling two sixes with two dice?",
+            "Prove that the square root of 2 is irrational.",
+            "Compute the derivative of sin(x) * x^2.",
+            "How many ways can 5 people be seated around a round table?",
+            "Find the area of a triangle with sides 3, 4 and 5.",
+        ],
+    },
+    "gpt-conv": {
+        "description": "conversation, advice, explanation, opinion, everyday questions, emails, "
+                       "communication, summary, recommendation, discussion, analysis",
+        "examples": [
+            "Can you explain the main themes of this book?",
+            "Draft a polite email asking my manager for feedback.",
+            "What are the pros and cons of remote work?",
+            "How should I prepare for a job interview?",
+            "Recommend some books about the history of science.",
+            "Summarize the key arguments for and against nuclear energy.",
+        ],
+    },
+    "qwen-coder": {
+        "description": "programming, code, software, python, javascript, c++, java, sql, function, class, "
+                       "algorithm, bug, debug, implement, script, api, compile, regex",
+        "examples": [
+            "Write a Python function that reverses a linked list.",
+            "Why does my JavaScript code throw undefined is not a function?",
+            "Implement binary search in C++.",
+            "Write a SQL query to find the top 5 customers by revenue.",
+            "How do I read a CSV file with pandas?",
+            "Refactor this class to use dependency injection.",
+        ],
+    },
+    "ds-creative": {
+        "description": "creative writing, story, poem, fiction, song, lyrics, character, imaginative, "
+                       "artistic, screenplay, dialogue, novel, narrative, melody",
+        "examples": [
+            "Write a short story about a robot who learns to paint.",
+            "Compose a haiku about autumn leaves.",
+            "Create a fantasy world with its own history and magic system.",
+            "Write song lyrics about leaving home.",
+            "Describe a sunset in the style of a romantic poet.",
+            "Write a dialogue between a detective and a mysterious stranger.",
+        ],
+    },
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9+#]+")
+
+
+def question_text(question):
+    """Flatten a plain string or a question record with `turns` into text."""
+    if isinstance(question, str):
+        return question
+    turns = question.get("turns", [])
+    return "\n".join(t["content"] if isinstance(t, dict) else t for t in turns)
+
+
+def tokenize(text):
+    words = _TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class LocalRouter:
+    """TF-IDF router over specialization profiles.
+
+    `min_score` is the cosine similarity the best specialization must reach;
+    below it the router abstains.
+    """
+
+    def __init__(self, specializations, profiles=None, min_score=0.05):
+        self.profiles = SPECIALIZATION_PROFILES if profiles is None else profiles
+        self.min_score = min_score
+        self.names = list(specializations.keys())
+        self._memo = {}
+        self._lock = threading.Lock()
+
+        documents = {}
+        for name, prompt in specializations.items():
+            profile = self.profiles.get(name, {})
+            text = "\n".join([prompt, profile.get("description", "")] + profile.get("examples", []))
+            documents[name] = Counter(tokenize(text))
+
+        df = Counter()
+        for counts in documents.values():
+            df.update(counts.keys())
+        n = len(documents)
+        self.idf = {term: math.log((1 + n) / (1 + count)) + 1 for term, count in df.items()}
+        self.vectors = {name: self._weigh(counts) for name, counts in documents.items()}
+
+    def _weigh(self, counts):
+        vector = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in counts.items() if term in self.idf}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {term: w / norm for term, w in vector.items()}
+
+    def scores(self, question):
+        vector = self._weigh(Counter(tokenize(question_text(question))))
+        return {
+            name: sum(w * doc.get(term, 0.0) for term, w in vector.items())
+            for name, doc in self.vectors.items()
+        }
+
+    def route(self, question, top_k):
+        """Return the top_k specialization names, or None when the router is not confident."""
+        text = question_text(question)
+        key = hashlib.sha256(f"{top_k}\n{text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+
+        scores = self.scores(text)
+        ranked = sorted(self.names, key=lambda name: scores[name], reverse=True)
+        selected = ranked[:top_k] if scores[ranked[0]] >= self.min_score else None
+
+        with self._lock:
+            self._memo[key] = selected
+        return selected
+
+
+_ROUTERS = {}
+_ROUTERS_LOCK = threading.Lock()
+
+
+def get_router(specializations):
+    """Shared router per specialization set, so memoized decisions survive across calls."""
+    key = tuple(sorted(specializations.items()))
+    with _ROUTERS_LOCK:
+        if key not in _ROUTERS:
+            _ROUTERS[key] = LocalRouter(specializations)
+        return _ROUTERS[key]
+
+
+def route_models(question, specializations, top_k, fallback):
+    """Route locally, calling `fallback()` (the LLM selector) only when the router abstains."""
+    selected = get_router(specializations).route(question, top_k)
+    if selected is None:
+        return fallback()
+    print(f"\n>>> Selected Models (local router): {selected}")
+    return selected
@@ -0,0 +1,108 @@
+"""
+Speculative client-first answering.
+
+The top selected client expert answers alone and a cheap confidence check runs on
+its answer; the server-side summary and refinement loop only runs when
+confidence is below the threshold.
+
+Confidence methods:
+    self_consistency  mean word-level similarity between the answer and `samples`
+                      extra answers sampled at temperature 1 from the same expert
+    logprobs          geometric-mean token probability of the answer
+    verifier          local heuristics: empty, hedging or refusing, truncated, or
+                      very short answers lose confidence (no extra calls)
+"""
+import asyncio
+import json
+import math
+import re
+
+from colm_cache import RESPONSE_CACHE
+from colm_convergence import similarity
+from colm_metrics import call_stage
+from colm_ratelimit import RATE_LIMITS, estimate_tokens
+
+CONFIDENCE_METHODS = ("self_consistency", "logprobs", "verifier")
+DEFAULT_THRESHOLDS = {"self_consistency": 0.5, "logprobs": 0.8, "verifier": 0.7}
+
+HEDGES = re.compile(
+    r"\b(i'?m not sure|i am not sure|i don'?t know|i cannot|i can'?t|i'?m unable|i am unable|"
+    r"as an ai|not enough information|it depends)\b",
+    re.I,
+)
+
+
+def verify(question, answer):
+    """Heuristic confidence in [0, 1] for `answer`, without calling a model."""
+    if not answer or not answer.strip():
+        return 0.0
+    score = 1.0
+    if HEDGES.search(answer):
+        score -= 0.5
+    text = answer.rstrip()
+    if text.count("```") % 2 or not re.search(r"[.!?)\]`*\"'\d:;]$", text):
+        score -= 0.3
+    if len(text.split()) < 20 and len(question.split()) > 30:
+        score -= 0.2
+    return max(score, 0.0)
+
+
+def logprob_confidence(choice):
+    content = getattr(getattr(choice, "logprobs", None), "content", None)
+    if not content:
+        return None
+    return math.exp(sum(token.logprob for token in content) / len(content))
+
+
+async def _complete(client, model_id, provider, messages, params, sample=None):
+    async def request():
+        response = await RATE_LIMITS.acall(
+            provider,
+            model_id,
+            lambda: client.chat.completions.create(model=model_id, messages=messages, **params),
+            estimate_tokens(messages, params.get("max_tokens", 1000))
+        )
+        choice = response.choices[0]
+        if params.get("logprobs"):
+            return json.dumps({"content": choice.message.content.strip(), "confidence": logprob_confidence(choice)})
+        return choice.message.content.strip()
+
+    # samples differ only in their cache key, so re-runs reuse the same draws
+    key_params = params if sample is None else {**params, "sample": sample}
+    return await RESPONSE_CACHE.acached(model_id, messages, key_params, request)
+
+
+async def speculate(client, model_id, provider, messages, question, method="verifier", samples=3, answer=None):
+    """Return (answer, confidence) for one expert; `answer` skips the call when already known.
+
+    A failed call returns ("", 0.0) and a failed logprobs or consistency draw
+    gives confidence 0.0, so the caller falls back to the server loop.
+    """
+    assert method in CONFIDENCE_METHODS, f"unknown confidence method {method}, expected one of {CONFIDENCE_METHODS}"
+    with call_stage("speculate"):
+        if method == "logprobs":
+            try:
+                result = json.loads(await _complete(client, model_id, provider, messages, {"max_tokens": 1000, "logprobs": True}))
+            except Exception as e:
+                print(f"Speculative call failed for {model_id}: {e}")
+                return "", 0.0
+            return result["content"], result["confidence"] or 0.0
+
+        if answer is None:
+            try:
+                answer = await _complete(client, model_id, provider, messages, {"max_tokens": 1000})
+            except Exception as e:
+                print(f"Speculative call failed for {model_id}: {e}")
+                return "", 0.0
+        if method == "verifier":
+            return answer, verify(question, answer)
+
+        draws = await asyncio.gather(*(
+            _complete(client, model_id, provider, messages, {"max_tokens": 1000, "temperature": 1.0}, sample=i)
+            for i in range(samples)
+        ), return_exceptions=True)
+        failed = [draw for draw in draws if isinstance(draw, Exception)]
+        if failed:
+            print(f"Consistency draw failed for {model_id}: {failed[0]}")
+            return answer, 0.0
+        return answer, sum(similarity(answer, draw) for draw in draws) / samples
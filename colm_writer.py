@@ -0,0 +1,128 @@
+"""Append-only JSONL output sink shared by the generation scripts.
+
+Worker threads hand records to `JsonlWriter.write`; a single background thread
+appends them to their files, so no file is ever re-read or rewritten and workers
+never wait on a lock. Writes are flushed and fsync'ed in batches (every
+`fsync_every` records or `flush_interval` seconds). A torn last line left by a
+crash is ended before the next append, so it cannot swallow a record, and is
+skipped (and reported) when reading the file back.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+def read_jsonl(path):
+    """Read records from a JSONL file, skipping malformed lines.
+
+    Malformed lines are torn writes from interrupted runs; they can sit anywhere
+    in the file once a resumed run has appended after them. Their line numbers
+    are printed.
+    """
+    records, skipped = [], []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                skipped.append(number)
+    if skipped:
+        print(f"Skipped {len(skipped)} malformed line(s) in {path}: {', '.join(map(str, skipped))}")
+    return records
+
+
+def compact_jsonl(jsonl_path, json_path, key=None):
+    """Rewrite a JSONL file as the JSON array AlpacaEval expects (atomically).
+
+    With `key`, only the last record for each value of that field is kept, so
+    outputs re-written by a resumed run are not duplicated.
+    """
+    records = read_jsonl(jsonl_path)
+    if key is not None:
+        records = list({record[key]: record for record in records}.values())
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
+    return len(records)
+
+
+class JsonlWriter:
+    def __init__(self, fsync_every=32, flush_interval=1.0, max_queue=10000):
+        self.fsync_every = fsync_every
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._files = {}
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, record):
+        self._queue.put((path, json.dumps(record, ensure_ascii=False) + "\n"))
+
+    def _handle(self, path):
+        if path not in self._files:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            torn = False
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            self._files[path] = open(path, "a", encoding="utf-8")
+            if torn:
+                # end a torn last line left by a crash, so it cannot swallow the next record
+                self._files[path].write("\n")
+        return self._files[path]
+
+    def _sync(self):
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._pending:
+                    self._sync()
+                continue
+            if item is _STOP:
+                break
+            path, line = item
+            self._handle(path).write(line)
+            self.written += 1
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.flush_interval:
+                self._sync()
+
+        self._sync()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def close(self):
+        """Drain queued records, fsync and close every file."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,14 +1,28 @@
 """
+MT-Bench judgments, run on asyncio.
+
+Each judge model runs at most --parallel matches at a time, with the blocking
+API clients in worker threads. A single writer task owns the output file and
+appends results in match order every --flush-interval seconds (or --flush-size
+results), so concurrent matches never interleave lines. Matches already in the
+output file, keyed by (question_id, model, judge, turn), are skipped, so an
+interrupted run resumes where it stopped.
+
 Usage:
-python gen_judgment.py --model-list [LIST-OF-MODEL-ID] --parallel [num-concurrent-api-call] --mode [single|pairwise-baseline|pairwise-all]
+python eval_mt_bench.py --model-list [LIST-OF-MODEL-ID] --parallel [num-concurrent-api-call] --mode [single|pairwise-baseline|pairwise-all]
 """
 import argparse
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+import time
 
-import numpy as np
 from tqdm import tqdm
 
+from fastchat.llm_judge.answer_store import iter_jsonl
+from fastchat.llm_judge.judgment_cache import JUDGMENT_CACHE
+from fastchat.llm_judge import common
 from fastchat.llm_judge.common import (
     load_questions,
     load_model_answers,
@@ -21,6 +35,8 @@ from fastchat.llm_judge.common import (
     MatchPair,
     MatchSingle,
     NEED_REF_CATS,
+    ANSWER_FIELDS,
+    API_ERROR_OUTPUT,
 )
 
 
@@ -167,6 +183,142 @@ def make_judge_single(judge_model, judge_prompts):
     return judges
 
 
+def match_key(match):
+    """(question_id, model, judge, turn) of a match; pairwise matches use (model_1, model_2) as the model."""
+    if isinstance(match, MatchSingle):
+        model = match.model
+    else:
+        model = (match.model_1, match.model_2)
+    judge = (match.judge.model_name, match.judge.prompt_template["name"])
+    return (match.question["question_id"], model, judge, 2 if match.multi_turn else 1)
+
+
+def record_key(record):
+    """`match_key` of a judgment record written by play_a_match_single / play_a_match_pair."""
+    if "model" in record:
+        model = record["model"]
+    else:
+        model = (record["model_1"], record["model_2"])
+    judge = tuple(record["judge"])
+    # records written before pair results carried a turn: multi-turn judges are named "*-multi-turn"
+    turn = record.get("turn", 2 if judge[1].endswith("-multi-turn") else 1)
+    return (record["question_id"], model, judge, turn)
+
+
+def load_existing_keys(output_file):
+    """Keys of the judgments already in `output_file`; a torn last line from an interrupted run is ignored."""
+    if not os.path.exists(output_file):
+        return set()
+    fields = ["model", "model_1", "model_2", "judge", "turn"]
+    return {record_key(record) for record in iter_jsonl(output_file, fields)}
+
+
+def is_failed(result):
+    judgments = [result.get(k) for k in ("judgment", "g1_judgment", "g2_judgment")]
+    return API_ERROR_OUTPUT in judgments
+
+
+class MatchWriter:
+    """Single writer task: buffers results and appends them to the output file in match order."""
+
+    def __init__(self, output_file, flush_interval=5.0, flush_size=64):
+        self.output_file = output_file
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.written = 0
+        self._queue = asyncio.Queue()
+        self._pending = []
+        # end a torn last line left by an interrupted run, so it cannot swallow the next record
+        if os.path.exists(output_file) and os.path.getsize(output_file):
+            with open(output_file, "rb") as fin:
+                fin.seek(-1, os.SEEK_END)
+                torn = fin.read(1) != b"\n"
+            if torn:
+                with open(output_file, "a") as fout:
+                    fout.write("\n")
+
+    def put(self, index, result):
+        self._queue.put_nowait((index, result))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self._pending.sort(key=lambda item: item[0])
+        with open(self.output_file, "a") as fout:
+            fout.write("".join(json.dumps(result) + "\n" for _, result in self._pending))
+            fout.flush()
+            os.fsync(fout.fileno())
+        self.written += len(self._pending)
+        self._pending = []
+
+    async def run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    self._queue.get(), timeout=max(deadline - time.monotonic(), 0)
+                )
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._pending.append(item)
+            if len(self._pending) >= self.flush_size or time.monotonic() >= deadline:
+                await asyncio.to_thread(self._flush)
+                deadline = time.monotonic() + self.flush_interval
+        self._flush()
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+
+async def run_matches(matches, play_a_match_func, output_file, args):
+    """Play `matches` with at most args.parallel in flight per judge model; results go through one writer."""
+    judge_models = sorted({match.judge.model_name for match in matches})
+    slots = {model: asyncio.Semaphore(args.parallel) for model in judge_models}
+    # the blocking clients run in threads; one per slot
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(1, args.parallel * len(judge_models)))
+    )
+    writer = MatchWriter(output_file, args.flush_interval, args.flush_size)
+    writer_task = asyncio.create_task(writer.run())
+    print(
+        f"Judging {len(matches)} matches with {judge_models}, "
+        f"concurrency {args.parallel} per judge"
+    )
+
+    async def one(index, match):
+        async with slots[match.judge.model_name]:
+            result = await asyncio.to_thread(play_a_match_func, match, output_file=None)
+        if is_failed(result):
+            raise RuntimeError(f"judge API error on question {result['question_id']}")
+        writer.put(index, result)
+
+    failed = 0
+    start = time.monotonic()
+    # tqdm reports the throughput (matches/s) and the ETA
+    with tqdm(total=len(matches), unit="match") as pbar:
+        for future in asyncio.as_completed(
+            [one(index, match) for index, match in enumerate(matches)]
+        ):
+            try:
+                await future
+            except Exception as e:
+                failed += 1
+                print(f"Match failed: {type(e).__name__}: {e}")
+            pbar.update(1)
+            pbar.set_postfix(failed=failed)
+    writer.close()
+    await writer_task
+    elapsed = time.monotonic() - start
+    print(
+        f"Wrote {writer.written} judgments in {elapsed:.1f}s "
+        f"({len(matches) / elapsed if elapsed else 0:.2f} matches/s)"
+        + (f", {failed} failed (re-run to retry them)" if failed else "")
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -203,12 +355,46 @@ if __name__ == "__main__":
         help="A list of models to be evaluated",
     )
     parser.add_argument(
-        "--parallel", type=int, default=1, help="The number of concurrent API calls."
+        "--parallel",
+        type=int,
+        default=1,
+        help="The number of concurrent matches per judge model.",
+    )
+    parser.add_argument(
+        "--output-file",
+        type=str,
+        default=None,
+        help="The judgment file; defaults to outputs/{bench}/model_judgment/{judge}_{single|pair}.jsonl.",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between appends to the judgment file.",
+    )
+    parser.add_argument(
+        "--flush-size",
+        type=int,
+        default=64,
+        help="Append early once this many judgments are buffered.",
+    )
+    parser.add_argument(
+        "--retry-sleep",
+        type=float,
+        default=1.0,
+        help="First judge API retry delay in seconds; doubles per attempt, with full jitter.",
+    )
+    parser.add_argument(
+        "--retry-sleep-max",
+        type=float,
+        default=60.0,
+        help="Cap on the judge API retry delay in seconds.",
     )
     parser.add_argument(
         "--first-n", type=int, help="A debug option. Only run the first `n` judgments."
     )
     args = parser.parse_args()
+    common.API_RETRY_BACKOFF = (args.retry_sleep, args.retry_sleep_max)
 
     question_file = f"FastChat/fastchat/llm_judge/data/{args.bench_name}/question.jsonl"
     answer_dir = f"/mt_bench"
@@ -220,8 +406,8 @@ if __name__ == "__main__":
     questions = load_questions(question_file, None, None)
 
     # Load answers
-    model_answers = load_model_answers(answer_dir)
-    ref_answers = load_model_answers(ref_answer_dir)
+    model_answers = load_model_answers(answer_dir, ANSWER_FIELDS)
+    ref_answers = load_model_answers(ref_answer_dir, ANSWER_FIELDS)
 
     # Load judge
     judge_prompts = load_judge_prompts(args.judge_file)
@@ -238,8 +424,8 @@ if __name__ == "__main__":
         judges = make_judge_single(args.judge_model, judge_prompts)
         play_a_match_func = play_a_match_single
         output_file = (
-            fr"/gemini/code/mt-bench/model_judgment_single.jsonl"
-)
+            f"outputs/{args.bench_name}/model_judgment/{args.judge_model}_single.jsonl"
+        )
         make_match_func = make_match_single
         baseline_model = None
     else:
@@ -255,6 +441,9 @@ if __name__ == "__main__":
             make_match_func = make_match
             baseline_model = args.baseline_model
 
+    if args.output_file:
+        output_file = args.output_file
+
     check_data(questions, model_answers, ref_answers, models, judges)
 
     question_math = [q for q in questions if q["category"] in NEED_REF_CATS]
@@ -291,6 +480,11 @@ if __name__ == "__main__":
         multi_turn=True,
     )
 
+    # matches already judged in the output file are not played again
+    existing = load_existing_keys(output_file)
+    num_matches = len(matches)
+    matches = [match for match in matches if match_key(match) not in existing]
+
     match_stat = {}
     match_stat["bench_name"] = args.bench_name
     match_stat["mode"] = args.mode
@@ -298,7 +492,8 @@ if __name__ == "__main__":
     match_stat["baseline"] = baseline_model
     match_stat["model_list"] = models
     match_stat["total_num_questions"] = len(questions)
-    match_stat["total_num_matches"] = len(matches)
+    match_stat["total_num_matches"] = num_matches
+    match_stat["num_existing_matches"] = num_matches - len(matches)
     match_stat["output_path"] = output_file
     print(output_file)
     # Show match stats and prompt enter to continue
@@ -308,21 +503,7 @@ if __name__ == "__main__":
     # input("Press Enter to confirm...")
 
     # Play matches
-    print(output_file)
-    if args.parallel == 1:
-        for match in tqdm(matches):
-            print(output_file)
-            play_a_match_func(match, output_file=output_file)
-    else:
-
-        def play_a_match_wrapper(match):
-            play_a_match_func(match, output_file=output_file)
-
-        np.random.seed(0)
-        np.random.shuffle(matches)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    asyncio.run(run_matches(matches, play_a_match_func, output_file, args))
 
-        with ThreadPoolExecutor(args.parallel) as executor:
-            for match in tqdm(
-                executor.map(play_a_match_wrapper, matches), total=len(matches)
-            ):
-                pass
\ No newline at end of file
+    JUDGMENT_CACHE.print_stats()
\ No newline at end of file